@@ -0,0 +1,28 @@
+import os
+import tempfile
+import contextlib
+
+@contextlib.contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    file written next to path and moved over it at once when the block ends,
+    so a reader never sees half a file. each writer (process or thread) has
+    its own temporary file, which is removed when the block fails
+    args:
+        path (str): file to replace, its directory is created
+        mode (str): mode of the temporary file ("wb" or "w")
+    usage:
+        with atomic_write(path) as file:
+            np.save(file, array)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(mode, dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False)
+    try:
+        with file:
+            yield file
+        os.replace(file.name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(file.name)
+        raise
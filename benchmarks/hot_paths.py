@@ -0,0 +1,215 @@
+"""
+micro-benchmarks of the simulation hot paths, each stage is timed separately
+for every screen size, track type and seed. runs offscreen with the dummy
+video driver of SDL.
+
+usage (from the root of the repository):
+    python -m benchmarks.hot_paths run --out baseline.json
+    python -m benchmarks.hot_paths run --out new.json
+    python -m benchmarks.hot_paths compare baseline.json new.json
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import statistics
+import numpy as np
+import pygame
+from scipy import stats
+from simulator import SimulatorController, Cluster, TrackField, get_future_points
+from graphics.graphics_elements import FULL, MEDIUM, SMALL
+from graphics.track_generator import LEMNISCATE, CIRCLE
+from car_modeling.gpc import GPC
+
+SIZES = [SMALL, MEDIUM, FULL]
+TRACKS = {"LEMNISCATE": LEMNISCATE, "CIRCLE": CIRCLE}
+
+# main.py setup
+FPS = 80
+CAR = dict(wheels_radius=0.04, wheels_distance=0.15, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1,
+           accommodation_time_l=0.62, accommodation_time_r=0.58, sensor_distance=0.15, sensor_count=15)
+FUTURE_POINTS = 45
+FUTURE_SPACING = 3
+
+class Case:
+    """
+    one simulator driven by the GPC of main.py, the stages are timed on it
+    """
+    def __init__(self, screen_size, track_type, seed, headless=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sim = SimulatorController(screen_size, FPS, 100, 100, 300, 4, track_type, 0.02, 0.008,
+                                           headless=headless, track_seed=seed)
+            self.sim.setup_car_dynamics(**CAR)
+        self.sim.set_future_points(FUTURE_POINTS, FUTURE_SPACING)
+        if self.sim.track_field is None:
+            self.sim.track_field = TrackField(self.sim.x_track, self.sim.y_track, self.sim.track_length)
+
+        self.gpc = GPC(1/FPS, CAR["wheels_radius"], CAR["wheels_distance"], FUTURE_POINTS)
+        self.v1 = 0
+        self.v2 = 0
+        self.data = None
+
+        # leave the start line
+        for _ in range(FPS):
+            self.step()
+
+    def step(self):
+        # the simulated time is advanced by step_simulation
+        self.sim.time_simulation += 1/FPS
+        data = self.sim.step(self.v1, self.v2)
+        if data is not None:
+            self.data = data
+            self.control()
+
+    def control(self):
+        delta_u_l, delta_u_r = self.gpc.step(self.data[1], self.data[4])
+        self.v1 = max(min(self.v1 + delta_u_l, 100), -100)
+        self.v2 = max(min(self.v2 + delta_u_r, 100), -100)
+
+    def visible_clusters(self):
+        # the clusters inside the circle of visibility of the track
+        track = self.sim.track
+        return [track.matrix[i][j] for i, j in track.visible_cells() if isinstance(track.matrix[i][j], Cluster)]
+
+    def stages(self):
+        """
+        returns the functions timed for this case (name -> callable)
+        """
+        sim = self.sim
+        stages = {
+            "car_dynamics": lambda: sim.car.step_space(self.v1, self.v2, 0, 0),
+            "future_points": lambda: get_future_points(sim.x_track, sim.y_track, sim.get_car_pose(), sim.track.progress.next_point,
+                                                       sim.future_points_count, sim.future_space),
+            "sensor_field": sim._read_line_sensor_field,
+            "gpc": self.control,
+        }
+        if sim.headless:
+            stages["step_headless"] = self.step
+            return stages
+
+        screen = sim.simulator.screen
+        clusters = self.visible_clusters()
+        stages.update({
+            "step": self.step,
+            "simulator_draw": sim.simulator.draw,
+            "track_draw": lambda: sim.track.draw(screen),
+            "cluster_draw": lambda: [cluster.draw(screen) for cluster in clusters],
+            "sensor_screen": sim._read_line_sensor,
+        })
+        return stages
+
+def _calibrate(function, target=0.005):
+    # number of calls that take about target seconds
+    number = 1
+    while True:
+        begin = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - begin >= target or number >= 1 << 16:
+            return number
+        number *= 2
+
+def time_stage(function, rounds):
+    """
+    returns the time of one call in microseconds, one sample per round
+    """
+    number = _calibrate(function)
+    samples = []
+    for _ in range(rounds):
+        begin = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - begin) / number * 1e6)
+    return samples
+
+def run(sizes, tracks, seeds, rounds):
+    """
+    returns the results of every stage of every case
+    """
+    results = {}
+    cases = [(size, track, seed, False) for size in sizes for track in tracks for seed in seeds]
+    cases += [("HEADLESS", track, seed, True) for track in tracks for seed in seeds]
+    for size, track, seed, headless in cases:
+        case = Case(MEDIUM if headless else size, TRACKS[track], seed, headless)
+        for stage, function in case.stages().items():
+            samples = time_stage(function, rounds)
+            name = f"{size}/{track}/{seed}/{stage}"
+            results[name] = {
+                "samples_us": samples,
+                "median_us": statistics.median(samples),
+                "mean_us": statistics.mean(samples),
+                "stdev_us": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            }
+            print(f"{name:45s} {results[name]['median_us']:12.2f} us", flush=True)
+    return results
+
+def compare(baseline, new, alpha=0.01, threshold=0.1):
+    """
+    returns the stages significantly slower in new than in baseline, a stage is
+    flagged when a Mann-Whitney U test rejects equal times (p < alpha) and the
+    median is more than threshold slower
+    """
+    slower = []
+    for name, result in new.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        ratio = result["median_us"] / base["median_us"]
+        p_value = stats.mannwhitneyu(base["samples_us"], result["samples_us"], alternative="less").pvalue
+        flagged = p_value < alpha and ratio > 1 + threshold
+        print(f"{name:45s} {base['median_us']:12.2f} -> {result['median_us']:12.2f} us  x{ratio:6.3f}  p={p_value:.4f}"
+              + ("  SLOWER" if flagged else ""))
+        if flagged:
+            slower.append(name)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="micro-benchmarks of the simulation hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="time every stage and write the results")
+    run_parser.add_argument("--sizes", nargs="+", default=SIZES, choices=SIZES)
+    run_parser.add_argument("--tracks", nargs="+", default=list(TRACKS), choices=list(TRACKS))
+    run_parser.add_argument("--seeds", nargs="+", type=int, default=[1112, 7])
+    run_parser.add_argument("--rounds", type=int, default=15)
+    run_parser.add_argument("--out", default="benchmark.json")
+
+    compare_parser = commands.add_parser("compare", help="flag the stages slower than the baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--alpha", type=float, default=0.01)
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.sizes, args.tracks, args.seeds, args.rounds)
+        meta = {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pygame": pygame.version.ver,
+            "rounds": args.rounds,
+        }
+        with open(args.out, "w") as file:
+            json.dump({"meta": meta, "results": results}, file, indent=1)
+        print(f"results written to {args.out}")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)["results"]
+    with open(args.new) as file:
+        new = json.load(file)["results"]
+    slower = compare(baseline, new, args.alpha, args.threshold)
+    print(f"{len(slower)} stage(s) significantly slower")
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+accuracy of the pose integrators of car_dynamics against the step size, each
+integrator drives the same inputs at several rates and its trajectory is
+compared with a reference integrated at a very fine step.
+
+usage (from the root of the repository):
+    python -m benchmarks.integrators
+    python -m benchmarks.integrators --rates 20 40 80 160 --duration 20 --out integrators.json
+"""
+import io
+import sys
+import json
+import math
+import time
+import argparse
+import contextlib
+import numpy as np
+from car_modeling.car_dynamics import car_dynamics, POSE_INTEGRATORS, POSE_EULER, POSE_RK4
+
+# main.py setup
+CAR = dict(wheels_radius=0.04, wheels_distance=0.15, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1,
+           accommodation_time_l=0.62, accommodation_time_r=0.58)
+RATES = [20, 40, 80, 160, 320]
+REFERENCE_RATE = 20480
+HOLD = 0.05     # the inputs change every HOLD seconds, a multiple of every step
+
+def make_inputs(duration, seed):
+    """
+    returns the inputs (u1, u2) held for HOLD seconds each, random turns
+    around a forward speed
+    """
+    rng = np.random.default_rng(seed)
+    count = int(round(duration / HOLD))
+    forward = rng.uniform(30, 90, count)
+    turn = rng.uniform(-40, 40, count)
+    return np.clip(forward + turn, -100, 100), np.clip(forward - turn, -100, 100)
+
+def simulate(integrator, rate, inputs):
+    """
+    returns the pose (x, y, angle) at the end of every hold of the inputs, the
+    pose is integrated like the simulator moves the track
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        car = car_dynamics(1/rate, integrator=integrator, **CAR)
+    steps = int(round(HOLD * rate))
+    x = y = heading = 0.0
+    poses = []
+    for u1, u2 in zip(*inputs):
+        for _ in range(steps):
+            car.step(u1, u2, 0, 0)
+            dx, dy, angle = car.get_space()
+            heading -= angle
+            x -= dx * math.cos(heading) + dy * math.sin(heading)
+            y -= -dx * math.sin(heading) + dy * math.cos(heading)
+        poses.append((x, y, heading))
+    return np.array(poses)
+
+def time_integrator(integrator, rate, number=20000):
+    # time of one step and get_space in microseconds
+    with contextlib.redirect_stdout(io.StringIO()):
+        car = car_dynamics(1/rate, integrator=integrator, **CAR)
+    begin = time.perf_counter()
+    for k in range(number):
+        car.step(60 + k % 20, 50, 0, 0)
+        car.get_space()
+    return (time.perf_counter() - begin) / number * 1e6
+
+def run(rates, duration, seed):
+    """
+    returns the error of every integrator at every rate, the maximum distance
+    to the reference along the trajectory (m) and the final heading error (rad)
+    """
+    inputs = make_inputs(duration, seed)
+    reference = simulate(POSE_RK4, REFERENCE_RATE, inputs)
+    results = {}
+    for integrator in POSE_INTEGRATORS:
+        results[integrator] = {}
+        for rate in rates:
+            poses = simulate(integrator, rate, inputs)
+            position = np.hypot(*(poses[:, :2] - reference[:, :2]).T)
+            results[integrator][rate] = {
+                "max_position_error_m": float(position.max()),
+                "final_heading_error_rad": float(abs(poses[-1, 2] - reference[-1, 2])),
+                "step_us": time_integrator(integrator, rate),
+            }
+    return results
+
+def coarsest_rate(results, integrator, error):
+    # the lowest rate of the integrator with a position error not above error
+    rates = [rate for rate, result in results[integrator].items() if result["max_position_error_m"] <= error]
+    return min(rates) if rates else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="accuracy of the pose integrators against the step size")
+    parser.add_argument("--rates", nargs="+", type=int, default=RATES, help="physics rates in Hz, HOLD must be a multiple of each step")
+    parser.add_argument("--duration", type=float, default=10.0, help="simulated seconds")
+    parser.add_argument("--seed", type=int, default=1112)
+    parser.add_argument("--baseline-rate", type=int, default=80, help="rate of the euler integrator used as the target error")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    rates = sorted(set(args.rates) | {args.baseline_rate})
+    results = run(rates, args.duration, args.seed)
+
+    print(f"{'integrator':12s} {'rate':>6s} {'max error (m)':>14s} {'heading (rad)':>14s} {'step (us)':>10s}")
+    for integrator, by_rate in results.items():
+        for rate, result in by_rate.items():
+            print(f"{integrator:12s} {rate:6d} {result['max_position_error_m']:14.3e} "
+                  f"{result['final_heading_error_rad']:14.3e} {result['step_us']:10.2f}")
+
+    # how much coarser each integrator can step for the error of euler at the baseline rate
+    target = results[POSE_EULER][args.baseline_rate]["max_position_error_m"]
+    print(f"\nrate needed for the error of {POSE_EULER} at {args.baseline_rate} Hz ({target:.3e} m):")
+    for integrator in results:
+        rate = coarsest_rate(results, integrator, target)
+        print(f"{integrator:12s} " + (f"{rate:6d} Hz  ({args.baseline_rate / rate:g}x the step)" if rate else "   not reached"))
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({"duration": args.duration, "seed": args.seed, "reference_rate": REFERENCE_RATE, "results": results}, file, indent=1)
+        print(f"results written to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
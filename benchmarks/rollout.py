@@ -0,0 +1,114 @@
+"""
+open-loop rollouts of the car model, stepping the model on each sample against
+the closed-form rollout (car_dynamics.rollout and batch_car_dynamics.rollout)
+that filters the whole input sequence at once. the batch runs once with the
+constants of main.py shared by all cars and once with accommodation times of
+each car (stepped along the time for all cars at once). the rollout must
+follow the steps to the rounding.
+
+usage (from the root of the repository):
+    python -m benchmarks.rollout
+    python -m benchmarks.rollout --steps 100000 --cars 256 --out rollout.json
+"""
+import io
+import sys
+import json
+import math
+import time
+import argparse
+import contextlib
+import numpy as np
+from car_modeling.car_dynamics import car_dynamics, POSE_INTEGRATORS
+from car_modeling.batch_dynamics import batch_car_dynamics
+
+# main.py setup
+CAR = dict(wheels_radius=0.04, wheels_distance=0.15, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1,
+           accommodation_time_l=0.62, accommodation_time_r=0.58)
+FPS = 80
+
+def make_inputs(steps, cars, seed):
+    # random inputs (u1, u2, q1, q2) with one row per step and one column per car
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(-120, 120, (steps, cars)), rng.uniform(-120, 120, (steps, cars)),
+            rng.normal(0, 5, (steps, cars)), rng.normal(0, 5, (steps, cars)))
+
+def make_car(integrator):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return car_dynamics(1/FPS, integrator=integrator, **CAR)
+
+def step_car(integrator, u1, u2, q1, q2):
+    # the pose after each step of the model, moved like the track of the simulator
+    car = make_car(integrator)
+    x = y = heading = 0.0
+    poses = []
+    for k in range(len(u1)):
+        car.step(u1[k], u2[k], q1[k], q2[k])
+        dx, dy, angle = car.get_space()
+        heading -= angle
+        x -= dx * math.cos(heading) + dy * math.sin(heading)
+        y -= -dx * math.sin(heading) + dy * math.cos(heading)
+        poses.append((x, y, heading))
+    return np.array(poses)
+
+def per_car(cars, seed):
+    # the car of main.py with accommodation times of each car
+    rng = np.random.default_rng(seed)
+    return {**CAR, "accommodation_time_l": rng.uniform(0.5, 0.7, cars), "accommodation_time_r": rng.uniform(0.5, 0.7, cars)}
+
+def step_batch(car, u1, u2, q1, q2):
+    batch = batch_car_dynamics(u1.shape[1], 1/FPS, **car)
+    poses = []
+    for k in range(len(u1)):
+        batch.step(u1[k], u2[k], q1[k], q2[k])
+        batch.get_space()
+        poses.append(np.array(batch.get_pose()))
+    return np.array(poses)
+
+def timed(function, *args):
+    # result and time in seconds of one call
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+def run(steps, cars, seed):
+    """
+    returns for each integrator (and the batch) the time of the steps and of
+    the rollout and the largest difference of the poses
+    """
+    u1, u2, q1, q2 = make_inputs(steps, cars, seed)
+    results = {}
+    for integrator in POSE_INTEGRATORS:
+        stepped, step_time = timed(step_car, integrator, u1[:, 0], u2[:, 0], q1[:, 0], q2[:, 0])
+        rolled, rollout_time = timed(make_car(integrator).rollout, u1[:, 0], u2[:, 0], q1[:, 0], q2[:, 0])
+        results[integrator] = {"step_s": step_time, "rollout_s": rollout_time,
+                               "max_pose_difference": float(np.abs(rolled["pose"] - stepped).max())}
+
+    for name, car in ((f"batch x{cars}", CAR), (f"per car x{cars}", per_car(cars, seed))):
+        stepped, step_time = timed(step_batch, car, u1, u2, q1, q2)
+        rolled, rollout_time = timed(batch_car_dynamics(cars, 1/FPS, **car).rollout, u1, u2, q1, q2)
+        results[name] = {"step_s": step_time, "rollout_s": rollout_time,
+                         "max_pose_difference": float(np.abs(np.stack(rolled["pose"], axis=1) - stepped).max())}
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stepped against closed-form rollouts of the car model")
+    parser.add_argument("--steps", type=int, default=20000)
+    parser.add_argument("--cars", type=int, default=64, help="cars of the batch")
+    parser.add_argument("--seed", type=int, default=1112)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    results = run(args.steps, args.cars, args.seed)
+    print(f"{'model':14s} {'step (ms)':>10s} {'rollout (ms)':>13s} {'speedup':>8s} {'max difference':>15s}")
+    for model, result in results.items():
+        print(f"{model:14s} {result['step_s'] * 1e3:10.1f} {result['rollout_s'] * 1e3:13.2f} "
+              f"{result['step_s'] / result['rollout_s']:7.0f}x {result['max_pose_difference']:15.3e}")
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({"steps": args.steps, "cars": args.cars, "seed": args.seed, "fps": FPS, "results": results}, file, indent=1)
+        print(f"results written to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+python calls of one physics tick of the windowed simulator, the step by step
+calls of the car model (step, get_space, the values of the graphs and the
+speed, omega and wheels returned by the step, as the simulator made them)
+against the fused car_dynamics.step_space, both with the step of the track.
+the reference tick makes the same calls on a copy of the model and the shape
+before they were slotted (get_y chains, saturate, rotation matrix rebuilt on
+each step, euler only), the other paths run the current code.
+the calls are counted with a profile hook (python functions and builtins) and
+the tick is timed without it.
+
+usage (from the root of the repository):
+    python -m benchmarks.tick_calls
+    python -m benchmarks.tick_calls --number 200000 --out tick_calls.json
+"""
+import io
+import sys
+import math
+import json
+import timeit
+import argparse
+import contextlib
+from car_modeling.car_dynamics import car_dynamics, POSE_INTEGRATORS, POSE_EULER
+from graphics.graphics_elements import Shape
+
+# main.py setup
+FPS = 80
+SCALE = 300
+CAR = dict(wheels_radius=0.04, wheels_distance=0.15, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1,
+           accommodation_time_l=0.62, accommodation_time_r=0.58)
+
+class _reference_motor:
+    # first order motor as it was, the output read through get_y
+    def __init__(self, a, b, c):
+        self._y = 0
+        self._a = [a]
+        self._b = [b]
+        self._c = [c]
+
+    def get_y(self):
+        return self._y
+
+    def saturate(self, u):
+        return max(-100, min(100, u))
+
+    def step(self, u, q):
+        u = self.saturate(u)
+        self._y = (self._a[0] * self._y + self._b[0] * u + self._c[0] * q)
+
+class _reference_car:
+    # the calls of the tick of car_dynamics as it was, euler integrator
+    def __init__(self, car):
+        self.z = car.z
+        self.last_speed = 0
+        self.last_omega = 0
+        self._gain_Vm = car._gain_Vm
+        self._gain_Omega = car._gain_Omega
+        self._gain_Vm_norm = car._gain_Vm_norm
+        self._gain_Omega_norm = car._gain_Omega_norm
+        self._ml = _reference_motor(car._ml._a0, car._ml._b0, car._ml._c0)
+        self._mr = _reference_motor(car._mr._a0, car._mr._b0, car._mr._c0)
+
+    def _speed(self):
+        return (self._ml.get_y() + self._mr.get_y())
+
+    def _omega(self):
+        return (self._ml.get_y() - self._mr.get_y())
+
+    def speed_norm(self):
+        return self._speed() * self._gain_Vm_norm
+
+    def omega_norm(self):
+        return self._omega() * self._gain_Omega_norm
+
+    def speed(self):
+        return self._speed() * self._gain_Vm
+
+    def omega(self):
+        return self._omega() * self._gain_Omega
+
+    def get_space(self):
+        speed = self.speed()
+        omega = self.omega()
+        space = speed * self.z
+        angle = omega * self.z
+        dx = space * math.sin(angle)
+        dy = space * math.cos(angle)
+        self.last_speed = speed
+        self.last_omega = omega
+        return dx, dy, angle
+
+    def _get_wheels(self):
+        return self._ml.get_y(), self._mr.get_y()
+
+    def get_wheels_norm(self):
+        return self._get_wheels()
+
+    def get_wheels_speed(self):
+        return self._ml.get_y(), self._mr.get_y()
+
+    def step(self, u1, u2, q1, q2):
+        self._ml.step(u1, q1), self._mr.step(u2, q2)
+        self.v1 = u1
+        self.v2 = u2
+        self.q1 = q1
+        self.q2 = q2
+
+class _reference_shape:
+    # the step of Shape as it was, the rotation matrix is rebuilt on each rotation
+    def __init__(self, coo, angle=0):
+        self._x, self._y = coo
+        self.set_angle(angle)
+
+    def set_angle(self, angle):
+        self._angle = angle
+        cos_theta = math.cos(self._angle)
+        sin_theta = math.sin(self._angle)
+        self._rotation_matrix = [
+            [cos_theta, -sin_theta],
+            [sin_theta, cos_theta]
+        ]
+
+    def step(self, dx, dy, angle):
+        self._rotate(angle)
+        self._move(dx, dy)
+
+    def _rotate(self, angle):
+        self._angle += angle
+        self.set_angle(self._angle)
+
+    def _move(self, dx, dy):
+        s = dx * math.cos(-self._angle) - dy * math.sin(-self._angle)
+        dy = dx * math.sin(-self._angle) + dy * math.cos(-self._angle)
+        dx = s
+        self._x += dx
+        self._y += dy
+
+def make_ticks(integrator):
+    # the tick of each path (name -> callable) on its own car and track
+    with contextlib.redirect_stdout(io.StringIO()):
+        cars = [car_dynamics(1/FPS, integrator=integrator, **CAR) for _ in range(3)]
+    tracks = [Shape((0, 0)) for _ in range(2)]
+    ticks = {}
+
+    if integrator == POSE_EULER:
+        def reference(car=_reference_car(cars[2]), track=_reference_shape((0, 0))):
+            car.step(60, 50, 0, 0)
+            dx, dy, angle = car.get_space()
+            track.step(dx * -SCALE, dy * -SCALE, -angle)
+            graphs = car.get_wheels_norm()[0], car.get_wheels_norm()[1], car.speed_norm(), car.omega_norm()
+            return car.speed(), car.omega(), car.get_wheels_speed(), graphs
+        ticks["reference"] = reference
+
+    def stepped(car=cars[0], track=tracks[0]):
+        car.step(60, 50, 0, 0)
+        dx, dy, angle = car.get_space()
+        track.step(dx * -SCALE, dy * -SCALE, -angle)
+        graphs = car.get_wheels_norm()[0], car.get_wheels_norm()[1], car.speed_norm(), car.omega_norm()
+        return car.speed(), car.omega(), car.get_wheels_speed(), graphs
+
+    def fused(car=cars[1], track=tracks[1]):
+        dx, dy, angle, speed, omega, left, right = car.step_space(60, 50, 0, 0)
+        track.step(dx * -SCALE, dy * -SCALE, -angle)
+        graphs = left, right, car.speed_norm(), car.omega_norm()
+        return speed, omega, (left, right), graphs
+
+    ticks["stepped"] = stepped
+    ticks["fused"] = fused
+    return ticks
+
+def count_calls(function, number=100):
+    # python calls and builtin calls of one call of function, itself excluded
+    counts = {"call": 0, "c_call": 0}
+    def hook(frame, event, arg):
+        if event in counts:
+            counts[event] += 1
+    sys.setprofile(hook)
+    try:
+        for _ in range(number):
+            function()
+    finally:
+        sys.setprofile(None)
+    return (counts["call"] - number) / number, counts["c_call"] / number
+
+def run(number):
+    """
+    returns for each integrator and path the python and builtin calls of one
+    tick and its time in microseconds
+    """
+    results = {}
+    for integrator in POSE_INTEGRATORS:
+        results[integrator] = {}
+        for name, tick in make_ticks(integrator).items():
+            python_calls, builtin_calls = count_calls(tick)
+            results[integrator][name] = {
+                "python_calls": python_calls,
+                "builtin_calls": builtin_calls,
+                "tick_us": min(timeit.repeat(tick, number=number, repeat=5)) / number * 1e6,
+            }
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="python calls of one physics tick, reference and step by step against fused")
+    parser.add_argument("--number", type=int, default=100000, help="ticks of each timing")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    results = run(args.number)
+    print(f"{'integrator':12s} {'path':8s} {'python calls':>13s} {'builtins':>9s} {'tick (us)':>10s}")
+    for integrator, paths in results.items():
+        for name, result in paths.items():
+            print(f"{integrator:12s} {name:8s} {result['python_calls']:13.0f} {result['builtin_calls']:9.0f} {result['tick_us']:10.3f}")
+        # the fused tick against the code before it, or the current step by step calls
+        slow, fused = paths.get("reference", paths["stepped"]), paths["fused"]
+        print(f"{'':12s} {'ratio':8s} {slow['python_calls'] / fused['python_calls']:12.1f}x "
+              f"{slow['builtin_calls'] / max(1, fused['builtin_calls']):8.1f}x {slow['tick_us'] / fused['tick_us']:9.2f}x")
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({"number": args.number, "fps": FPS, "results": results}, file, indent=1)
+        print(f"results written to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+progress along the track of many cars, one TrackProgress per car against one
+BatchTrackProgress for all of them. the cars follow the track line at random
+speeds (some of them backwards) with a lateral noise, and some jump to other
+parts of the track, so the walk, the laps and the recovery are exercised. the
+batch must give every car the result of its own tracker.
+
+usage (from the root of the repository):
+    python -m benchmarks.track_progress
+    python -m benchmarks.track_progress --cars 256 --steps 4000 --out track_progress.json
+"""
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+from graphics.track_generator import load_track, LEMNISCATE, CIRCLE
+from graphics.track_progress import TrackLine, TrackProgress, BatchTrackProgress
+
+TRACKS = {"LEMNISCATE": LEMNISCATE, "CIRCLE": CIRCLE}
+TOLERANCE = 0.15    # the car size of main.py
+
+def make_paths(x_track, y_track, cars, steps, seed, noise=0.005, jumps=0.1):
+    # positions (steps, cars) of the cars moving along the track, a fraction of them jump once
+    rng = np.random.default_rng(seed)
+    count = len(x_track) - 1
+    speed = rng.uniform(-1, 4, cars)     # track points per step
+    position = (np.arange(steps)[:, None] * speed) % count
+    for car in np.flatnonzero(rng.random(cars) < jumps):
+        position[rng.integers(steps):, car] += rng.uniform(0, count)
+    position %= count
+    index = position.astype(int)
+    fraction = position - index
+    x = x_track[index] * (1 - fraction) + x_track[index + 1] * fraction + rng.normal(0, noise, (steps, cars))
+    y = y_track[index] * (1 - fraction) + y_track[index + 1] * fraction + rng.normal(0, noise, (steps, cars))
+    return x, y
+
+def run(track_type, seed, cars, steps):
+    """
+    returns the time of one update per car of the single and the batch
+    trackers and the number of steps where they differ
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        x_track, y_track, _ = load_track(track_type, seed, noise_level=0.225, checkpoints=36, resolution=500, track_rad=30,
+                                         length=100, width=100, scale=300)
+    line = TrackLine(x_track, y_track)
+    x, y = make_paths(np.asarray(x_track), np.asarray(y_track), cars, steps, seed)
+
+    single = [TrackProgress(line, None, tolerance=TOLERANCE) for _ in range(cars)]
+    batch = BatchTrackProgress(line, None, cars, tolerance=TOLERANCE)
+    single_time = batch_time = 0.0
+    differences = recovered = 0
+    for k in range(steps):
+        row_x, row_y = x[k].tolist(), y[k].tolist()
+        begin = time.perf_counter()
+        for tracker, car_x, car_y in zip(single, row_x, row_y):
+            tracker.update(car_x, car_y)
+        single_time += time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        batch.update(x[k], y[k])
+        batch_time += time.perf_counter() - begin
+
+        state = np.array([tracker.get_state() for tracker in single], dtype=float)
+        differences += not np.array_equal(state, np.column_stack((batch.index, batch.lap, batch.distance, batch.offset,
+                                                                   batch.progress, batch.recovered)))
+        recovered += int(batch.recovered.sum())
+
+    return {
+        "single_us": single_time / (steps * cars) * 1e6,
+        "batch_us": batch_time / (steps * cars) * 1e6,
+        "steps_with_differences": differences,
+        "recoveries": recovered,
+        "laps": [int(batch.lap.min()), int(batch.lap.max())],
+        "track_length_m": line.length,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="single against batch progress along the track")
+    parser.add_argument("--tracks", nargs="+", choices=list(TRACKS), default=list(TRACKS))
+    parser.add_argument("--seed", type=int, default=1112)
+    parser.add_argument("--cars", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    results = {name: run(TRACKS[name], args.seed, args.cars, args.steps) for name in args.tracks}
+    print(f"{'track':12s} {'single (us)':>12s} {'batch (us)':>11s} {'differences':>12s} {'recoveries':>11s} {'laps':>9s}")
+    for name, result in results.items():
+        print(f"{name:12s} {result['single_us']:12.2f} {result['batch_us']:11.2f} {result['steps_with_differences']:12d} "
+              f"{result['recoveries']:11d} {str(result['laps']):>9s}")
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({"seed": args.seed, "cars": args.cars, "steps": args.steps, "results": results}, file, indent=1)
+        print(f"results written to {args.out}")
+    return 0 if all(result["steps_with_differences"] == 0 for result in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
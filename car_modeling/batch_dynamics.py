@@ -0,0 +1,191 @@
+import numpy as np
+from car_modeling.car_dynamics import motor_response, accumulate_pose
+
+class batch_car_dynamics:
+    """
+    steps N independent cars at once, every constant and state is an array with
+    one value per car. the equations are the same of motor and car_dynamics.
+    """
+    def __init__(self, count, z=0.1, wheels_radius=0.04, wheels_distance=0.2, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1, accommodation_time_l=1.0, accommodation_time_r=1.0):
+        """
+        initializes the cars
+        args:
+            count (int): number of cars
+            z (float): sample time in seconds, shared by all cars
+            the other arguments are scalars or arrays with one value per car
+        """
+        self.count = count
+        self.z = z
+
+        wheels_radius = self._per_car(wheels_radius)
+        wheels_distance = self._per_car(wheels_distance)
+        wheels_speed_rad_s = (2 * np.pi * self._per_car(wheels_RPM))/(60*100) # divide by 100%
+
+        self._wheels_radius = wheels_radius
+        self._wheels_distance = wheels_distance
+
+        # gains for calculating speed and omega
+        self._gain_Vm = wheels_speed_rad_s * (wheels_radius/2)
+        self._gain_Omega = wheels_speed_rad_s * wheels_radius/wheels_distance
+
+        # gains for calculating normalized speed and omega
+        self._gain_Vm_norm = (1/2)
+        self._gain_Omega_norm = (1/2)
+
+        # accommodation time
+        self.tau_l = self._per_car(accommodation_time_l)/5
+        self.tau_r = self._per_car(accommodation_time_r)/5
+
+        # --- motor constants (using z transform) ---
+
+        # time constants
+        self._a1 = np.exp(-z/self.tau_l)
+        self._a2 = np.exp(-z/self.tau_r)
+
+        # control gain
+        self._b1 = self._per_car(ke_l) * (1 - self._a1)
+        self._b2 = self._per_car(ke_r) * (1 - self._a2)
+
+        # noise gain
+        kq = self._per_car(kq)
+        self._c1 = kq * (1 - self._a1)
+        self._c2 = kq * (1 - self._a2)
+
+        # motor outputs, last inputs and pose of each car
+        self.reset()
+
+    def _per_car(self, value):
+        # broadcast a scalar or an array to one float per car
+        return np.array(np.broadcast_to(np.asarray(value, dtype=float), (self.count,)))
+
+    def reset(self):
+        # clears the motors, the inputs and the pose of every car
+        self._yl = np.zeros(self.count)
+        self._yr = np.zeros(self.count)
+        self.v1 = np.zeros(self.count)
+        self.v2 = np.zeros(self.count)
+        self.q1 = np.zeros(self.count)
+        self.q2 = np.zeros(self.count)
+        self.x = np.zeros(self.count)
+        self.y = np.zeros(self.count)
+        self.angle = np.zeros(self.count)
+
+    def set_pose(self, x, y, angle):
+        # sets the pose of the cars in the track frame (meters, radians)
+        self.x = self._per_car(x)
+        self.y = self._per_car(y)
+        self.angle = self._per_car(angle)
+
+    def get_pose(self):
+        return self.x, self.y, self.angle
+
+    def step(self, u1, u2, q1=0, q2=0):
+        """
+        steps the motors of all cars, the inputs are scalars or arrays
+        """
+        self.v1 = self._per_car(u1)
+        self.v2 = self._per_car(u2)
+        self.q1 = self._per_car(q1)
+        self.q2 = self._per_car(q2)
+
+        # saturate and calculate the step of each motor
+        self._yl = self._a1 * self._yl + self._b1 * np.clip(self.v1, -100, 100) + self._c1 * self.q1
+        self._yr = self._a2 * self._yr + self._b2 * np.clip(self.v2, -100, 100) + self._c2 * self.q2
+
+    def rollout(self, u1, u2, q1=0, q2=0):
+        """
+        steps all cars over whole input sequences in one vectorized pass, the
+        same as step and get_space on each row (to the rounding), the cars end
+        in the state and pose of the last step. when the cars share the motor
+        constants the motors are filtered over the whole sequences at once,
+        otherwise they are stepped along the time with every car in one operation
+        args:
+            u1, u2, q1, q2 (np.ndarray): one row per step and one column per car, a row or a column is broadcast
+        returns:
+            dict: wheels speed (left, right), speed, omega, the moves (dx, dy, angle) and the pose (x, y, angle), each (steps, count)
+        """
+        # a sequence of one value per step is shared by all cars
+        u1, u2, q1, q2 = (np.asarray(value, dtype=float) for value in (u1, u2, q1, q2))
+        u1, u2, q1, q2 = (value[:, None] if value.ndim == 1 else value for value in (u1, u2, q1, q2))
+        shape = np.broadcast_shapes(u1.shape, u2.shape, q1.shape, q2.shape, (1, self.count))
+        if shape[0] == 0:
+            raise ValueError("The inputs are empty")
+        u1, u2, q1, q2 = (np.broadcast_to(value, shape) for value in (u1, u2, q1, q2))
+
+        left = self._motor_rollout(self._a1, self._b1, self._c1, self._yl, u1, q1)
+        right = self._motor_rollout(self._a2, self._b2, self._c2, self._yr, u2, q2)
+        speed = (left + right) * self._gain_Vm
+        omega = (left - right) * self._gain_Omega
+
+        space = speed * self.z
+        angle = omega * self.z
+        dx = space * np.sin(angle)
+        dy = space * np.cos(angle)
+        x, y, heading = accumulate_pose(dx, dy, angle, self.get_pose())
+
+        # the state of the last step
+        self._yl = left[-1].copy()
+        self._yr = right[-1].copy()
+        self.v1, self.v2, self.q1, self.q2 = (value[-1].copy() for value in (u1, u2, q1, q2))
+        self.x, self.y, self.angle = x[-1].copy(), y[-1].copy(), heading[-1].copy()
+        return {"wheels": (left, right), "speed": speed, "omega": omega, "dx": dx, "dy": dy, "angle": angle, "pose": (x, y, heading)}
+
+    def _motor_rollout(self, a, b, c, y, u, q):
+        # cars with the same motor constants share one filter over the whole sequences,
+        # otherwise the recurrence of step is stepped along the time for all the cars at once
+        if (a == a[0]).all() and (b == b[0]).all() and (c == c[0]).all():
+            return motor_response([a[0]], [b[0]], [c[0]], u, q, (y, (), (), ()))[0]
+
+        control = b * np.clip(u, -100, 100)
+        noise = c * q
+        outputs = np.empty(u.shape)
+        for k in range(len(outputs)):
+            output = outputs[k]
+            np.multiply(a, y, out=output)
+            output += control[k]
+            output += noise[k]
+            y = output
+        return outputs
+
+    def _speed(self):
+        return self._yl + self._yr
+
+    def _omega(self):
+        return self._yl - self._yr
+
+    def speed_norm(self):
+        return self._speed() * self._gain_Vm_norm
+
+    def omega_norm(self):
+        return self._omega() * self._gain_Omega_norm
+
+    def speed(self):
+        return self._speed() * self._gain_Vm
+
+    def omega(self):
+        return self._omega() * self._gain_Omega
+
+    def get_wheels_speed(self):
+        return self._yl, self._yr
+
+    def get_space(self):
+        """
+        returns the displacement of each car in its own frame, like
+        car_dynamics.get_space, and moves the pose of the cars
+        """
+        space = self.speed() * self.z
+        angle = self.omega() * self.z
+
+        dx = space * np.sin(angle)
+        dy = space * np.cos(angle)
+
+        # the track frame turns against the car, as in Track.step
+        self.angle -= angle
+        cos_theta = np.cos(self.angle)
+        sin_theta = np.sin(self.angle)
+        self.x -= dx * cos_theta + dy * sin_theta
+        self.y -= dy * cos_theta - dx * sin_theta
+        return dx, dy, angle
+
+    def get_size(self):
+        return self._wheels_distance
@@ -1,16 +1,95 @@
 import math
+import numpy as np
+from scipy.signal import lfilter
+
+# integrators of the pose over one step (see car_dynamics.get_space)
+POSE_EULER = 'EULER'            # straight move along the step rotation
+POSE_ARC = 'ARC'                # exact arc for constant wheel speeds over the step
+POSE_TRAPEZOID = 'TRAPEZOID'    # arc of the mean of the speeds at both ends of the step
+POSE_RK4 = 'RK4'                # runge-kutta over the response of the motors within the step (first order motors)
+POSE_INTEGRATORS = (POSE_EULER, POSE_ARC, POSE_TRAPEZOID, POSE_RK4)
+
+def _initial_conditions(num, den, y_past, x_past, shape):
+    # state of lfilter (direct form II transposed) after the past outputs and
+    # inputs, the most recent first (scipy.signal.lfiltic for many columns)
+    order = max(len(num), len(den)) - 1
+    num = np.pad(np.asarray(num, dtype=float), (0, order + 1 - len(num)))
+    den = np.pad(np.asarray(den, dtype=float), (0, order + 1 - len(den)))
+    zi = np.zeros((order, *shape))
+    for m in range(order):
+        for i in range(m + 1, order + 1):
+            lag = i - m - 1
+            if lag < len(x_past):
+                zi[m] += num[i] * x_past[lag]
+            if lag < len(y_past):
+                zi[m] -= den[i] * y_past[lag]
+    return zi
+
+def motor_response(a, b, c, u, q, state=(0.0, (), (), ())):
+    """
+    outputs of a motor (see motor.step) for whole input sequences in one pass
+    args:
+        a, b, c (list): coefficients of the motor, of any order
+        u, q (np.ndarray): input and perturbation, one row per step (and one column per motor)
+        state (tuple): output before the first step and the older outputs, inputs and perturbations, the most recent first
+    returns:
+        tuple: the outputs of each step and the state after the last step
+    """
+    y_0, y_past, u_past, q_past = state
+    u = np.clip(u, -100, 100)
+    den = np.concatenate(([1.0], -np.asarray(a, dtype=float)))
+
+    # the input and the perturbation share the poles, the past outputs go with the input
+    y = lfilter(b, den, u, axis=0, zi=_initial_conditions(b, den, (y_0, *y_past), u_past, u.shape[1:]))[0]
+    y = y + lfilter(c, den, q, axis=0, zi=_initial_conditions(c, den, (), q_past, q.shape[1:]))[0]
+
+    # the newest values of each sequence, followed by the past ones
+    outputs = [*y[::-1], y_0, *y_past][:len(a)]
+    state = (outputs[0], tuple(outputs[1:]), tuple([*u[::-1], *u_past][:len(b) - 1]), tuple([*q[::-1], *q_past][:len(c) - 1]))
+    return y, state
+
+def accumulate_pose(dx, dy, angle, pose=(0.0, 0.0, 0.0)):
+    """
+    the pose after each move of get_space, the frame turns against the car as
+    in Track.step (the sums are in the order of a loop, so they match it)
+    returns:
+        tuple: x, y and angle after each step
+    """
+    x_0, y_0, angle_0 = (np.broadcast_to(np.asarray(value, dtype=float), np.shape(dx)[1:]) for value in pose)
+    heading = np.cumsum(np.concatenate(([angle_0], -angle)), axis=0)[1:]
+    cos_heading = np.cos(heading)
+    sin_heading = np.sin(heading)
+    x = np.cumsum(np.concatenate(([x_0], -(dx * cos_heading + dy * sin_heading))), axis=0)[1:]
+    y = np.cumsum(np.concatenate(([y_0], -(dy * cos_heading - dx * sin_heading))), axis=0)[1:]
+    return x, y, heading
 
 class motor:
+    # the coefficients of the first order are kept as numbers (_a0, _b0, _c0) for the step
+    __slots__ = ("_y", "_a", "_b", "_c", "_a0", "_b0", "_c0", "_y_past", "_u_past", "_q_past", "_first_order",
+                 "dead_zone_const", "magnetic_saturation_const")
+
     def __init__(self):
         self._y = 0
         self._a = [0]
         self._b = [0]
         self._c = [0]
+        self._a0 = self._b0 = self._c0 = 0
+
+        # older outputs, inputs and perturbations of the higher orders, the most recent first
+        self._y_past = []
+        self._u_past = []
+        self._q_past = []
+        self._first_order = True
     
     def set_constants(self, a, b, c):
         self._a = a
         self._b = b
         self._c = c
+        self._a0, self._b0, self._c0 = a[0], b[0], c[0]
+        self._y_past = [0] * (len(a) - 1)
+        self._u_past = [0] * (len(b) - 1)
+        self._q_past = [0] * (len(c) - 1)
+        self._first_order = len(a) == len(b) == len(c) == 1
 
         self.dead_zone_const = 20
         self.magnetic_saturation_const = 90
@@ -18,6 +97,26 @@ class motor:
     def get_y(self):
         return self._y
 
+    def get_a(self):
+        return self._a0
+
+    def get_state(self):
+        # the output and the older values of the higher orders
+        return (self._y, tuple(self._y_past), tuple(self._u_past), tuple(self._q_past))
+
+    def set_state(self, state):
+        y, y_past, u_past, q_past = state
+        self._y = y
+        self._y_past = list(y_past)
+        self._u_past = list(u_past)
+        self._q_past = list(q_past)
+
+    def rollout(self, u, q):
+        # the outputs of step over whole sequences, see motor_response
+        y, state = motor_response(self._a, self._b, self._c, u, q, self.get_state())
+        self.set_state(state)
+        return y
+
     def saturate(self, u):
         # saturate output
         return max(-100, min(100, u))
@@ -35,14 +134,34 @@ class motor:
     def step(self, u, q):
         #u = self.dead_zone(u)
         #u = self.magnetic_saturation(u)
-        u = self.saturate(u)
+        u = u if u < 100 else 100       # saturate, inline
+        u = u if u > -100 else -100
 
         # calculate the step
-        self._y = (self._a[0] * self._y + self._b[0] * u + self._c[0] * q)
+        if self._first_order:
+            self._y = (self._a0 * self._y + self._b0 * u + self._c0 * q)
+            return
+
+        # y[k] = a[0] y[k-1] + a[1] y[k-2] + ... + b[0] u[k] + b[1] u[k-1] + ... + c[0] q[k] + ...
+        y_past = [self._y] + self._y_past
+        u_past = [u] + self._u_past
+        q_past = [q] + self._q_past
+        self._y = (sum(a * y for a, y in zip(self._a, y_past)) + sum(b * u for b, u in zip(self._b, u_past))
+                   + sum(c * q for c, q in zip(self._c, q_past)))
+        self._y_past = y_past[:len(self._a) - 1]
+        self._u_past = u_past[:len(self._b) - 1]
+        self._q_past = q_past[:len(self._c) - 1]
     
 class car_dynamics:
-    def __init__(self, z=0.1,  wheels_radius=0.04, wheels_distance=0.2, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1, accommodation_time_l=1.0, accommodation_time_r=1.0):
+    __slots__ = ("z", "_half_z", "integrator", "v1", "v2", "q1", "q2", "_wheels_radius", "_wheels_distance", "_wheels_speed_rad_s",
+                 "last_speed", "last_omega", "_gain_Vm", "_gain_Omega", "_gain_Vm_norm", "_gain_Omega_norm", "tau_l", "tau_r",
+                 "_ml", "_mr")
+
+    def __init__(self, z=0.1,  wheels_radius=0.04, wheels_distance=0.2, wheels_RPM=1000, ke_l=1, ke_r=1, kq=1, accommodation_time_l=1.0, accommodation_time_r=1.0,
+                 integrator=POSE_EULER):
         self.z = z
+        self._half_z = z/2
+        self.set_integrator(integrator)
 
         self.v1 = 0
         self.v2 = 0
@@ -86,55 +205,143 @@ class car_dynamics:
         # noise gain
         c1 = kq * (1 - a1)
         c2 = kq * (1 - a2)
-        print(c1, c2)
 
         self._ml.set_constants([a1], [b1], [c1])
         self._mr.set_constants([a2], [b2], [c2])
 
     def _speed(self):
-        return (self._ml.get_y() + self._mr.get_y())
+        return (self._ml._y + self._mr._y)
     
     def _omega(self):
-        return (self._ml.get_y() - self._mr.get_y())
+        return (self._ml._y - self._mr._y)
 
     def speed_norm(self):
-        return self._speed() * self._gain_Vm_norm
+        return (self._ml._y + self._mr._y) * self._gain_Vm_norm
     
     def omega_norm(self):
-        return self._omega() * self._gain_Omega_norm
+        return (self._ml._y - self._mr._y) * self._gain_Omega_norm
 
     def speed(self):
-        return self._speed() * self._gain_Vm
+        return (self._ml._y + self._mr._y) * self._gain_Vm
     
     def omega(self):
-        return self._omega() * self._gain_Omega
+        return (self._ml._y - self._mr._y) * self._gain_Omega
     
+    def set_integrator(self, integrator):
+        # sets the integrator of the pose, one of POSE_INTEGRATORS
+        if integrator not in POSE_INTEGRATORS:
+            raise ValueError("Invalid pose integrator")
+        self.integrator = integrator
+
     def get_space(self):
+        """
+        returns the move of the car in the last step (dx, dy) in the frame of
+        the car at the end of the step and the rotation of the step
+        """
         # get the current speed and omega
-        speed = self.speed()
-        omega = self.omega()
-        
-        # calculate the space using trapezoidal rule
-        space = speed * self.z #(self.last_speed + speed) * self.z/2
-        angle = omega * self.z #(self.last_omega + omega) * self.z/2
+        speed = (self._ml._y + self._mr._y) * self._gain_Vm
+        omega = (self._ml._y - self._mr._y) * self._gain_Omega
+        return self._space(speed, omega)
 
-        # update last speed and omega
-        dx = space * math.sin(angle)
-        dy = space * math.cos(angle)
+    def _space(self, speed, omega):
+        # the move of the step with the integrator, the last speed and omega are updated
+        if self.integrator == POSE_EULER:
+            space = speed * self.z
+            angle = omega * self.z
+            dx = space * math.sin(angle)
+            dy = space * math.cos(angle)
+        elif self.integrator == POSE_ARC:
+            dx, dy, angle = self._arc(speed * self.z, omega * self.z)
+        elif self.integrator == POSE_TRAPEZOID:
+            dx, dy, angle = self._arc((self.last_speed + speed) * self._half_z, (self.last_omega + omega) * self._half_z)
+        else:
+            dx, dy, angle = self._rk4()
 
         # update last speed and omega
         self.last_speed = speed
         self.last_omega = omega
         return dx, dy, angle
 
+    def step_space(self, u1, u2, q1, q2):
+        """
+        step and get_space in one call, the motors of the first order are
+        stepped inline
+        returns:
+            tuple: the move of get_space (dx, dy, angle), speed, omega and the wheels speed (left, right)
+        """
+        ml = self._ml
+        mr = self._mr
+        if ml._first_order and mr._first_order:
+            u = u1 if u1 < 100 else 100
+            u = u if u > -100 else -100
+            left = ml._y = ml._a0 * ml._y + ml._b0 * u + ml._c0 * q1
+            u = u2 if u2 < 100 else 100
+            u = u if u > -100 else -100
+            right = mr._y = mr._a0 * mr._y + mr._b0 * u + mr._c0 * q2
+        else:
+            ml.step(u1, q1)
+            mr.step(u2, q2)
+            left = ml._y
+            right = mr._y
+        self.v1 = u1
+        self.v2 = u2
+        self.q1 = q1
+        self.q2 = q2
+
+        speed = (left + right) * self._gain_Vm
+        omega = (left - right) * self._gain_Omega
+        dx, dy, angle = self._space(speed, omega)
+        return dx, dy, angle, speed, omega, left, right
+
+    def _arc(self, space, angle):
+        # the chord of the arc of length space that turns angle, it points half the angle aside
+        half = angle/2
+        chord = space * math.sin(half)/half if half != 0 else space
+        return chord * math.sin(half), chord * math.cos(half), angle
+
+    def _check_first_order(self):
+        # the runge-kutta integrator follows the exponential response of a motor of the first order
+        if not (self._ml._first_order and self._mr._first_order):
+            raise ValueError("The RK4 pose integrator needs motors of the first order")
+
+    def _rk4(self):
+        # the wheels follow the exponential response of the motors from the
+        # speeds of the last step (the input is held over the step), the pose
+        # is integrated with one runge-kutta step in the frame of the last step
+        self._check_first_order()
+        z = self.z
+        sum_0 = self.last_speed / self._gain_Vm
+        dif_0 = self.last_omega / self._gain_Omega
+        wheels = []
+        for y_1, y_0, a, tau in ((self._ml.get_y(), (sum_0 + dif_0)/2, self._ml.get_a(), self.tau_l),
+                                 (self._mr.get_y(), (sum_0 - dif_0)/2, self._mr.get_a(), self.tau_r)):
+            final = (y_1 - a * y_0)/(1 - a)
+            wheels.append((final, y_0 - final, tau))
+
+        def rates(t, heading):
+            (final_l, delta_l, tau_l), (final_r, delta_r, tau_r) = wheels
+            y_l = final_l + delta_l * math.exp(-t/tau_l)
+            y_r = final_r + delta_r * math.exp(-t/tau_r)
+            speed = (y_l + y_r) * self._gain_Vm
+            return -speed * math.sin(heading), speed * math.cos(heading), (y_l - y_r) * self._gain_Omega
+
+        k1 = rates(0, 0)
+        k2 = rates(z/2, z/2 * k1[2])
+        k3 = rates(z/2, z/2 * k2[2])
+        k4 = rates(z, z * k3[2])
+        x, y, angle = (z/6 * (k1[i] + 2*k2[i] + 2*k3[i] + k4[i]) for i in range(3))
+
+        # from the frame of the last step to the frame of the car now
+        cos_angle = math.cos(angle)
+        sin_angle = math.sin(angle)
+        return x * cos_angle + y * sin_angle, -x * sin_angle + y * cos_angle, angle
+
     def _get_wheels(self):
-        return self._ml.get_y(), self._mr.get_y()
-    
-    def get_wheels_norm(self):
-        return self._get_wheels()
+        return self._ml._y, self._mr._y
 
-    def get_wheels_speed(self):
-        return self._ml.get_y(), self._mr.get_y()
+    # the normalized wheels speed is the output of the motors too
+    get_wheels_norm = _get_wheels
+    get_wheels_speed = _get_wheels
 
     def step(self, u1, u2, q1, q2):
         # saturate
@@ -148,5 +355,97 @@ class car_dynamics:
         self.q2 = q2
         #return self.speed(), self.omega()
 
+    def get_state(self):
+        # the values that change on each step, see set_state
+        return (self._ml.get_state(), self._mr.get_state(), self.v1, self.v2, self.q1, self.q2, self.last_speed, self.last_omega)
+
+    def set_state(self, state):
+        ml, mr, self.v1, self.v2, self.q1, self.q2, self.last_speed, self.last_omega = state
+        self._ml.set_state(ml)
+        self._mr.set_state(mr)
+
+    def rollout(self, u1, u2, q1=0, q2=0, pose=(0.0, 0.0, 0.0)):
+        """
+        steps the car over whole input sequences in one vectorized pass, the
+        same as step and get_space on each sample (to the rounding), the car
+        ends in the state of the last step
+        args:
+            u1, u2, q1, q2 (np.ndarray): inputs and perturbations of each step, or scalars
+            pose (tuple): pose (x, y, angle) before the first step, it moves like the track of the simulator
+        returns:
+            dict: wheels speed (n, 2), speed, omega, the moves of get_space (dx, dy, angle) and the pose (n, 3)
+        """
+        u1, u2, q1, q2 = np.broadcast_arrays(*(np.atleast_1d(np.asarray(value, dtype=float)) for value in (u1, u2, q1, q2)))
+        if len(u1) == 0:
+            raise ValueError("The inputs are empty")
+
+        left = self._ml.rollout(u1, q1)
+        right = self._mr.rollout(u2, q2)
+        speed = (left + right) * self._gain_Vm
+        omega = (left - right) * self._gain_Omega
+
+        # the speeds at the start of each step
+        last_speed = np.concatenate(([self.last_speed], speed[:-1]))
+        last_omega = np.concatenate(([self.last_omega], omega[:-1]))
+        dx, dy, angle = self._space_rollout(left, right, speed, omega, last_speed, last_omega)
+
+        self.v1, self.v2, self.q1, self.q2 = (float(value[-1]) for value in (u1, u2, q1, q2))
+        self.last_speed = float(speed[-1])
+        self.last_omega = float(omega[-1])
+        return {
+            "wheels": np.column_stack((left, right)),
+            "speed": speed,
+            "omega": omega,
+            "dx": dx,
+            "dy": dy,
+            "angle": angle,
+            "pose": np.column_stack(accumulate_pose(dx, dy, angle, pose)),
+        }
+
+    def _space_rollout(self, left, right, speed, omega, last_speed, last_omega):
+        # get_space of every step at once, with the integrator of the car
+        z = self.z
+        if self.integrator == POSE_EULER:
+            space = speed * z
+            angle = omega * z
+            return space * np.sin(angle), space * np.cos(angle), angle
+        if self.integrator == POSE_ARC:
+            return self._arc_rollout(speed * z, omega * z)
+        if self.integrator == POSE_TRAPEZOID:
+            return self._arc_rollout((last_speed + speed) * z/2, (last_omega + omega) * z/2)
+
+        # runge-kutta over the response of the motors, see _rk4
+        self._check_first_order()
+        sum_0 = last_speed / self._gain_Vm
+        dif_0 = last_omega / self._gain_Omega
+        wheels = []
+        for y_1, y_0, a, tau in ((left, (sum_0 + dif_0)/2, self._ml.get_a(), self.tau_l),
+                                 (right, (sum_0 - dif_0)/2, self._mr.get_a(), self.tau_r)):
+            final = (y_1 - a * y_0)/(1 - a)
+            wheels.append((final, y_0 - final, tau))
+
+        def rates(t, heading):
+            (final_l, delta_l, tau_l), (final_r, delta_r, tau_r) = wheels
+            y_l = final_l + delta_l * math.exp(-t/tau_l)
+            y_r = final_r + delta_r * math.exp(-t/tau_r)
+            speed = (y_l + y_r) * self._gain_Vm
+            return -speed * np.sin(heading), speed * np.cos(heading), (y_l - y_r) * self._gain_Omega
+
+        k1 = rates(0, 0)
+        k2 = rates(z/2, z/2 * k1[2])
+        k3 = rates(z/2, z/2 * k2[2])
+        k4 = rates(z, z * k3[2])
+        x, y, angle = (z/6 * (k1[i] + 2*k2[i] + 2*k3[i] + k4[i]) for i in range(3))
+        cos_angle = np.cos(angle)
+        sin_angle = np.sin(angle)
+        return x * cos_angle + y * sin_angle, -x * sin_angle + y * cos_angle, angle
+
+    def _arc_rollout(self, space, angle):
+        # _arc of every step at once
+        half = angle/2
+        straight = half == 0
+        chord = np.where(straight, space, space * np.sin(half)/np.where(straight, 1, half))
+        return chord * np.sin(half), chord * np.cos(half), angle
+
     def get_size(self):
         return self._wheels_distance
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import hashlib
+import numpy as np
+from scipy.linalg import toeplitz, cho_factor, cho_solve
+from atomic_file import atomic_write
+
+MODELING_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(os.path.dirname(MODELING_DIR), '.cache')
+
+class GPC:
+    """
+    generalized predictive controller of the car, the error is the angle and
+    the distance of the future points minus the free response of the wheels.
+    the gain matrix is solved once (and cached on disk), each tick is a couple
+    of matrix-vector products.
+    """
+    def __init__(self, z, wheels_radius, wheels_distance, N_horizon, N_ul=5, N_ur=5,
+                 lamb_l=1e-3, lamb_r=1e-3, epsl_d=1, epsl_a=5e-1, d0=0.3,
+                 step_file=os.path.join(MODELING_DIR, "g.csv"), free_file=os.path.join(MODELING_DIR, "coeffs.csv"),
+                 cache_dir=CACHE_DIR):
+        """
+        initializes the controller
+        args:
+            z (float): sample time in seconds
+            wheels_radius (float): radius of the wheels in meters
+            wheels_distance (float): distance between the wheels in meters
+            N_horizon (int): number of future points
+            N_ul, N_ur (int): control horizon of each wheel
+            lamb_l, lamb_r (float): weights of the control effort (divided by the control horizon)
+            epsl_d, epsl_a (float): weights of the distance and angle errors (divided by N_horizon)
+            d0 (float): distance used to linearize the angle of the future points
+            step_file (str): step response of the wheels, one column per wheel
+            free_file (str): free response coefficients, three columns per wheel
+            cache_dir (str): directory of the cache, None disables it
+        """
+        self.z = z
+        self.wheels_radius = wheels_radius
+        self.wheels_distance = wheels_distance
+        self.N_horizon = N_horizon
+        self.N_ul = N_ul
+        self.N_ur = N_ur
+        self.d0 = d0
+
+        parameters = (z, wheels_radius, wheels_distance, N_horizon, N_ul, N_ur, lamb_l, lamb_r, epsl_d, epsl_a,
+                      self._file_stamp(step_file), self._file_stamp(free_file))
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f"gpc_{hashlib.sha1(repr(parameters).encode()).hexdigest()[:16]}.npz")
+
+        if path is not None and os.path.exists(path):
+            with np.load(path) as arrays:
+                self.K, self.F = arrays["K"], arrays["F"]
+        else:
+            self.K = self._gain(np.loadtxt(step_file, delimiter=","), lamb_l, lamb_r, epsl_d, epsl_a)
+            self.F = self._free_matrix(np.loadtxt(free_file, delimiter=","))
+            if path is not None:
+                self._save(path)
+
+        # gain of the inputs applied now (receding horizon)
+        self.K_now = self.K[[N_ul, 0]]
+        self.reset()
+
+    def _file_stamp(self, path):
+        # the cache is invalid when a modeling file changes
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _gain(self, g, lamb_l, lamb_r, epsl_d, epsl_a):
+        # --- step response --- #
+
+        # the last sample of the step response is not used
+        g = g[:-1]
+        G_l = self._matrix_G(g[:, 0], self.N_ul)
+        G_r = self._matrix_G(g[:, 1], self.N_ur)
+        G = np.block([
+            [G_l * -self.wheels_radius/(2*self.wheels_distance), G_r * self.wheels_radius/(2*self.wheels_distance)],
+            [G_l * self.wheels_radius/4, G_r * self.wheels_radius/4]
+        ])
+
+        # --- matrices of the control --- #
+
+        R = np.concatenate((np.full(self.N_ul, lamb_l/self.N_ul), np.full(self.N_ur, lamb_r/self.N_ur)))
+        Q = np.concatenate((np.full(self.N_horizon, epsl_a/self.N_horizon), np.full(self.N_horizon, epsl_d/self.N_horizon)))
+
+        # solution of quadratic problem, (G'QG + R) K = G'Q with a cholesky factorization
+        GtQ = G.T * Q
+        return cho_solve(cho_factor(GtQ @ G + np.diag(R)), GtQ)
+
+    def _matrix_G(self, g, N_u):
+        # lower triangular toeplitz convolution matrix, N_horizon rows and N_u columns
+        return toeplitz(g[:self.N_horizon], np.zeros(N_u))
+
+    def _free_matrix(self, coeffs):
+        """
+        free response of the angle and the distance from the last two wheel speeds.
+        the coefficients weight the integrated wheel angle of the last samples relative
+        to the newest one, that is (0, -w[k] z, -(w[k] + w[k-1]) z)
+        """
+        coeffs = coeffs[:self.N_horizon]
+        A_l = -self.z * np.column_stack((coeffs[:, 1] + coeffs[:, 2], coeffs[:, 2]))
+        A_r = -self.z * np.column_stack((coeffs[:, 4] + coeffs[:, 5], coeffs[:, 5]))
+        return np.block([
+            [A_l * self.wheels_radius/self.wheels_distance, -A_r * self.wheels_radius/self.wheels_distance],
+            [A_l * self.wheels_radius/2, A_r * self.wheels_radius/2]
+        ])
+
+    def _save(self, path):
+        # the gains are already computed, a cache that cannot be written is skipped
+        try:
+            with atomic_write(path) as file:
+                np.savez(file, K=self.K, F=self.F)
+        except OSError:
+            pass
+
+    def reset(self):
+        # wheel speeds (left now, left before, right now, right before)
+        self._state = np.zeros(4)
+
+    def free_response(self, omega_wheels):
+        """
+        adds the wheel speeds of this tick and returns the free response
+        returns:
+            tuple: future angle and future distance (N_horizon each)
+        """
+        self._state[1] = self._state[0]
+        self._state[3] = self._state[2]
+        self._state[0] = omega_wheels[0]
+        self._state[2] = omega_wheels[1]
+        free = self.F @ self._state
+        return free[:self.N_horizon], free[self.N_horizon:]
+
+    def reference(self, future_points):
+        """
+        linearized angle and distance of the future points in the car frame
+        """
+        future_points = np.asarray(future_points)
+        return future_points[..., 0]/self.d0, future_points[..., 1]
+
+    def control(self, error):
+        """
+        optimal increments of the inputs for the error (angle errors then distance errors).
+        error can be one vector (2 * N_horizon) or a stack of them (batch, 2 * N_horizon)
+        returns:
+            np.ndarray: increments of the whole control horizon (N_ul + N_ur), per error
+        """
+        return np.asarray(error) @ self.K.T
+
+    def step(self, future_points, omega_wheels):
+        """
+        one tick of the controller
+        returns:
+            tuple: increments of the left and right inputs applied now
+        """
+        future_theta, future_distance = self.free_response(omega_wheels)
+        angle, distance = self.reference(future_points)
+        delta_u = self.K_now @ np.concatenate((angle - future_theta, distance - future_distance))
+        return delta_u[0], delta_u[1]
@@ -1,3 +1,4 @@
+import time
 import pygame
 import math
 import numpy as np
@@ -8,8 +9,11 @@ SMALL = 'SMALL'
 
 class Shape:
     """
-    represents a basic geometric shape with position, color, size, and angle
+    represents a basic geometric shape with position, color, size, and angle,
+    the cosine and sine of the angle are kept for the moves and rotations
     """
+    __slots__ = ("_x", "_y", "_angle", "_color", "_size", "_pivot", "_cos", "_sin")
+
     def __init__(self, coo, color=None, size=None, angle=0):
         """
         initializes the shape
@@ -25,15 +29,8 @@ class Shape:
         self._color = color
         self._size = size
         self._pivot = (0, 0)
-
-        cos_theta = math.cos(self._angle)
-        sin_theta = math.sin(self._angle)
-
-        # Matriz de rotação 2D
-        self._rotation_matrix = [
-            [cos_theta, -sin_theta],
-            [sin_theta, cos_theta]
-        ]
+        self._cos = math.cos(angle)
+        self._sin = math.sin(angle)
 
     def get_center(self):
         # returns the center coordinates of the shape
@@ -46,14 +43,15 @@ class Shape:
     def set_angle(self, angle):
         # sets a new angle for the shape
         self._angle = angle
+        self._cos = math.cos(angle)
+        self._sin = math.sin(angle)
 
-        cos_theta = math.cos(self._angle)
-        sin_theta = math.sin(self._angle)
-
+    @property
+    def _rotation_matrix(self):
         # Matriz de rotação 2D
-        self._rotation_matrix = [
-            [cos_theta, -sin_theta],
-            [sin_theta, cos_theta]
+        return [
+            [self._cos, -self._sin],
+            [self._sin, self._cos]
         ]
 
     def set_coordinates(self, coo):
@@ -81,22 +79,21 @@ class Shape:
         return self._size
 
     def step(self, dx, dy, angle):
-        # moves and rotates the shape
-        self._rotate(angle)
-        self._move(dx, dy)
+        # moves and rotates the shape, _rotate and _move in one call
+        angle = self._angle = self._angle + angle
+        cos_theta = self._cos = math.cos(angle)
+        sin_theta = self._sin = math.sin(angle)
+        self._x += dx * cos_theta + dy * sin_theta
+        self._y += dy * cos_theta - dx * sin_theta
 
     def _rotate(self, angle):
         # rotates the shape by the given angle
-        self._angle += angle
-        self.set_angle(self._angle)
+        self.set_angle(self._angle + angle)
 
     def _move(self, dx, dy):
-        # moves the shape by dx and dy considering rotation
-        s = dx * math.cos(-self._angle) - dy * math.sin(-self._angle)
-        dy = dx * math.sin(-self._angle) + dy * math.cos(-self._angle)
-        dx = s
-        self._x += dx
-        self._y += dy
+        # moves the shape by dx and dy considering rotation (by -angle)
+        self._x += dx * self._cos + dy * self._sin
+        self._y += dy * self._cos - dx * self._sin
 
     def rotate_around_origin(self, theta):
         # rotates the shape around the origin by theta radians
@@ -107,8 +104,8 @@ class Shape:
     def _rotate_point(self, coo):
         x = coo[0]
         y = coo[1]
-        x_rotated = x * self._rotation_matrix[0][0] + y * self._rotation_matrix[0][1]
-        y_rotated = x * self._rotation_matrix[1][0] + y * self._rotation_matrix[1][1]
+        x_rotated = x * self._cos - y * self._sin
+        y_rotated = x * self._sin + y * self._cos
         return x_rotated, y_rotated
 
     def rotate_around_pivot(self, coo):
@@ -116,8 +113,8 @@ class Shape:
         ox, oy = self._pivot
         translated_x = coo[0] - ox
         translated_y = coo[1] - oy
-        x_rotated = translated_x * self._rotation_matrix[0][0] + translated_y * self._rotation_matrix[0][1]
-        y_rotated = translated_x * self._rotation_matrix[1][0] + translated_y * self._rotation_matrix[1][1]
+        x_rotated = translated_x * self._cos - translated_y * self._sin
+        y_rotated = translated_x * self._sin + translated_y * self._cos
         return x_rotated + ox, y_rotated + oy
 
     def draw(self, surface):
@@ -131,6 +128,8 @@ class Car(Shape):
     """
     represents the car in the simulator
     """
+    __slots__ = ("_vertices",)
+
     def __init__(self, coo, color=(0, 0, 200), size=35, angle=30, center=(1, 2)):
         """
         initializes the car
@@ -181,6 +180,8 @@ class FuturePoints(Shape):
     """
     represents the future points of the car in the simulator
     """
+    __slots__ = ("_points",)
+
     def __init__(self, coo, color=(200, 0, 0), size=5, angle=0):
         """
         initializes the future points
@@ -197,6 +198,9 @@ class FuturePoints(Shape):
         # sets the future points to be drawn
         self._points = points
 
+    def get_points(self):
+        return self._points
+
     def draw(self, surface):
         # draws the future points as circles on the given surface
         for point in self._points:
@@ -206,6 +210,8 @@ class Default(Shape):
     """
     represents a default object on the track
     """
+    __slots__ = ()
+
     def __init__(self, coo=(0, 0, 0), color=(50, 50, 50), size=2):
         """
         initializes a default object
@@ -224,6 +230,8 @@ class Wall(Shape):
     """
     represents a wall on the track
     """
+    __slots__ = ("_rotated", "_rotated_key")
+
     def __init__(self, coo=(0, 0, 0), color=(100, 100, 100), size=70):
         """
         initializes a wall object
@@ -234,106 +242,137 @@ class Wall(Shape):
         """
         super().__init__(coo, color, size)
 
+        self._rotated = None
+        self._rotated_key = None
+
     def draw(self, surface):
         # draws the wall as a rotated rectangle on the given surface
-        temp_surface = pygame.Surface((self._size, self._size), pygame.SRCALPHA)
-        temp_surface.fill(self._color)
-        rotated_surface = pygame.transform.rotate(temp_surface, math.degrees(self._angle))
-        rotated_rect = rotated_surface.get_rect(center=(int(self._x), int(self._y)))
-        surface.blit(rotated_surface, rotated_rect)
+        # the rotated rectangle is kept while the angle, size and color do not change
+        key = (self._angle, self._size, self._color)
+        if key != self._rotated_key:
+            temp_surface = pygame.Surface((self._size, self._size), pygame.SRCALPHA)
+            temp_surface.fill(self._color)
+            self._rotated = pygame.transform.rotate(temp_surface, math.degrees(self._angle))
+            self._rotated_key = key
+        rotated_rect = self._rotated.get_rect(center=(int(self._x), int(self._y)))
+        surface.blit(self._rotated, rotated_rect)
+
+class Progress:
+    """
+    the next point of the track to be reached, each track has its own
+    progress so many simulators run in one process. the simulator advances it
+    (see TrackProgress), the drawing only reads it.
+    """
+    __slots__ = ("next_point",)
+
+    def __init__(self):
+        self.next_point = 0
+
+    def reset(self):
+        self.next_point = 0
 
 class Cluster(Shape):
     """
-    Represents a cluster of points on the track
+    Represents a cluster of points on the track, every point is a copy of a
+    circle rasterized once (a stamp), the visited points use the visited stamp.
+    the progress is the one of the track of the cluster (see Track.set_obj)
     static variables:
-        _master (tuple): coordinates of the master point
-        _master_distance (int): radius of the master point
-        _next_point (int): next point to be reached
-        _arr_next_points (list): list of next points to be reached
-        _future_count (int): number of future points
-        _future_space (int): space between future points
-    """
-    _master             = (0, 0)   
-    _master_distance    = 0         
-    _next_point         = 0        
-    _arr_next_points    = []        
-    _future_count       = 10       
-    _future_space       = 30        
+        _visited_color (tuple): color of the points before the next point
+        _stamps (dict): rasterized circle of each size and color
+    """
+    __slots__ = ("__points_list", "__points_arr", "__global_index", "_progress")
+    _visited_color      = (100, 100, 100)
+    _stamps             = {}
 
     def __init__(self, coo=(0, 0), color=(0, 0, 0), size=5, angle=0):
         """
         Initializes the cluster object
         """
         super().__init__(coo, color, size, angle)
-        self.__global_index = []
-        self.__points_arr = [] 
-        self.__colors_arr = []
+        self.__points_list = []
+        self.__points_arr = np.empty((0, 2))
+        self.__global_index = np.empty(0, dtype=int)
+        self._progress = Progress()
 
-    def add_point(self, point, color=(0, 0, 0)):
-        self.__points_arr.append((point[0], point[1]))
-        self.__colors_arr.append(color)
-        self.__global_index.append(point[2])
+    def set_progress(self, progress):
+        self._progress = progress
 
-    @classmethod
-    def set_future_count(cls, future_count, future_space):
-        cls._future_count = future_count
-        cls._future_space = future_space
-        cls._arr_next_points = [(0, 0)] * future_count
+    def get_progress(self):
+        return self._progress
 
-    @classmethod
-    def set_master(cls, master, master_distance):
-        cls._master = master
-        cls._master_distance = master_distance
+    def add_point(self, point):
+        # adds a point (x, y, index), the arrays are built on the next read
+        self.__points_list.append(point)
 
-    @classmethod
-    def update_next_point(cls):
-        cls._next_point += 1
+    def __build(self):
+        # moves the added points to the arrays
+        if self.__points_list:
+            points = np.array(self.__points_list, dtype=float).reshape(-1, 3)
+            self.__points_arr = np.concatenate((self.__points_arr, points[:, :2]))
+            self.__global_index = np.concatenate((self.__global_index, points[:, 2].astype(int)))
+            self.__points_list = []
 
     @classmethod
-    def add_next_point(cls, point, index):
-        cls._arr_next_points[index] = point
-
-    @ classmethod
-    def get_next_point(cls):
-        return [(float(x), float(y)) for x, y in list(cls._arr_next_points)]
+    def get_stamp(cls, size, color):
+        # returns the circle of the size and color, rasterized on the first use
+        key = (size, color)
+        if key not in cls._stamps:
+            radius = int(size)
+            stamp = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            pygame.draw.circle(stamp, color, (radius, radius), size)
+            cls._stamps[key] = stamp
+        return cls._stamps[key]
 
-    def update(self):
-        for i in range(len(self.__points_arr)):
-            point_ = self._rotate_point(self.__points_arr[i])
-            x = point_[0] + self._x
-            y = point_[1] + self._y
-
-            for j in range(self._future_space, self._future_space * self._future_count + self._future_space, self._future_space):
-                if self.__global_index[i] == self._next_point + j:
-                    self.add_next_point((x, y), (self.__global_index[i] - self._next_point)//self._future_space - 1)
+    @classmethod
+    def draw_points(cls, surface, points, index, size, color, next_point):
+        """
+        Stamps the points on the given surface
+        args:
+            surface (pygame.Surface): the surface to draw on
+            points (np.ndarray): screen coordinates of the points (n, 2)
+            index (np.ndarray): global index of the points in the track
+            size (float): radius of the points
+            color (tuple): color of the points not visited yet
+            next_point (int): the points before it are visited
+        """
+        stamps = (cls.get_stamp(size, color), cls.get_stamp(size, cls._visited_color))
+        corners = (np.rint(points) - int(size)).astype(int).tolist()
+        visited = (index < next_point).tolist()
+        surface.blits([(stamps[v], corner) for v, corner in zip(visited, corners)], doreturn=False)
 
     def draw(self, surface):
         """
         Draws the cluster on the given surface
         """
+        self.__build()
+        R = np.array(self._rotation_matrix)
+        points = self.__points_arr @ R.T + (self._x, self._y)
 
-        for i in range(len(self.__points_arr)):
-            point_ = self._rotate_point(self.__points_arr[i])
-            x = point_[0] + self._x
-            y = point_[1] + self._y
-
-            if self._points_in_square(x, y) and self.__global_index[i] == self._next_point:
-                self.__colors_arr[i] = (100, 100, 100)  # Modify the color of the point
-                self.update_next_point()
-
-            pygame.draw.circle(surface, self.__colors_arr[i], (x, y), self._size)
+        # the points before the next point are visited
+        self.draw_points(surface, points, self.__global_index, self._size, self._color, self._progress.next_point)
     
     def get_points(self):
+        self.__build()
         return self.__points_arr
 
-    def _points_in_square(self, x1, y1):
-        x0, y0 = self._master
-        return (x0 - self._master_distance < x1 < x0 + self._master_distance) and (y0 < y1 < y0 + self._master_distance)
+    def get_indices(self):
+        # returns the global index of each point in the track
+        self.__build()
+        return self.__global_index
+
+    def get_style(self):
+        # returns the size and color of the points
+        return self._size, self._color
 
 class MiniMap(Shape):
     """
-    Represents a minimap object on the simulator
+    Represents a minimap object on the simulator, the background and the track
+    are rendered once into a cached surface, rebuilt when the size, the color
+    or the points change
     """
+    __slots__ = ("_width", "_height", "_points", "_player", "_background")
+    _margin = 1     # the points on the border are not clipped
+
     def __init__(self, coo, size, color=(255, 255, 255)):
         """
         Initializes the minimap object.
@@ -346,31 +385,41 @@ class MiniMap(Shape):
         self._width, self._height = size
         self._points = []  # Lista de pontos no formato [(x, y)]
         self._player = (0, 0)
+        self._background = None
 
     def add_point(self, point):
         self._points.append(point)
+        self._background = None
+
+    def set_size(self, size):
+        super().set_size(size)
+        self._width, self._height = size
+        self._background = None
+
+    def set_color(self, color):
+        super().set_color(color)
+        self._background = None
+
+    def set_coordinates(self, coo):
+        super().set_coordinates(coo)
+        self._background = None
 
     def set_player_position(self, player):
         self._player = player
 
-    def draw(self, surface):
-        # coordinates and dimensions of the minimap rectangle
-        rect_x = self._x - self._width // 2
-        rect_y = self._y - self._height // 2
-        rect_width = self._width
-        rect_height = self._height
+    def _render_background(self):
+        # renders the background and the track relative to the top left corner of the minimap
+        margin = self._margin
+        left = int(self._x - self._width // 2) - margin
+        top = int(self._y - self._height // 2) - margin
+        background = pygame.Surface((self._width + 2 * margin, self._height + 2 * margin), pygame.SRCALPHA)
 
-        #border_color = (100, 100, 100)
         border_width = 1
 
-        # draw border
-        #pygame.draw.rect(surface, border_color,
-        #                 (rect_x, rect_y, rect_width, rect_height), border_width)
-
         # draw background
-        pygame.draw.rect(surface, self._color,
-                         (rect_x + border_width, rect_y + border_width,
-                          rect_width - 2 * border_width, rect_height - 2 * border_width))
+        pygame.draw.rect(background, self._color,
+                         (self._x - self._width // 2 - left + border_width, self._y - self._height // 2 - top + border_width,
+                          self._width - 2 * border_width, self._height - 2 * border_width))
 
         # draw track
         point_color = (0, 0, 0)
@@ -378,7 +427,19 @@ class MiniMap(Shape):
             # normalize the point coordinates
             x = int(self._x + px * (self._width // 2))
             y = int(self._y + py * (self._height // 2))
-            pygame.draw.circle(surface, point_color, (x, y), 1)
+            pygame.draw.circle(background, point_color, (x - left, y - top), 1)
+
+        return background
+
+    def draw(self, surface):
+        # coordinates of the minimap rectangle
+        rect_x = self._x - self._width // 2
+        rect_y = self._y - self._height // 2
+
+        # draw the cached background and track
+        if self._background is None:
+            self._background = self._render_background()
+        surface.blit(self._background, (int(rect_x) - self._margin, int(rect_y) - self._margin))
 
         # draw player position
         player_color = (200, 0, 0)
@@ -391,6 +452,9 @@ class Track(Shape):
     """
     represents the track of the simulator with a matrix of points and walls
     """
+    __slots__ = ("screen_size", "__visible", "__point_spacing", "__stencil", "_center", "wall", "default", "matrix", "progress",
+                 "_layer_points", "_layer_index", "_layer_cells", "_layer_mask")
+
     def __init__(self, size, point_spacing, visible, screen_size=(800, 600)):
         """
         initializes the track
@@ -404,6 +468,7 @@ class Track(Shape):
         self.screen_size = screen_size
         self.__visible = visible
         self.__point_spacing = point_spacing
+        self.__stencil = self.__circle_stencil(visible)
         self._center = (0, 0) #(self.screen_size[0] // 1.5, self.screen_size[1] // 2)
 
         # initializes the matrix of points and walls
@@ -411,6 +476,15 @@ class Track(Shape):
         self.default = Default()
         self.matrix = self._create_matrix(size)
 
+        # next point to be reached, shared with the clusters of the track
+        self.progress = Progress()
+
+        # points of all the clusters in track pixels, built on the first draw
+        self._layer_points = None
+        self._layer_index = None
+        self._layer_cells = None
+        self._layer_mask = None
+
     def _create_matrix(self, size):
         # creates the initial matrix of track objects
         matrix = []
@@ -425,6 +499,9 @@ class Track(Shape):
         # sets a specific object in the matrix at the given row and column
         if 0 <= row < self._size[0] and 0 <= col < self._size[1]:
             self.matrix[row][col] = obj
+            self._layer_points = None
+            if isinstance(obj, Cluster):
+                obj.set_progress(self.progress)
 
     def set_center(self, coo):
         # sets the center of the track
@@ -432,34 +509,89 @@ class Track(Shape):
 
     def draw(self, surface):
         """
-        draws the track on the given surface
+        draws the track on the given surface, the points of the visible clusters
+        go through one transform to the screen and are stamped at once
         args:
             surface (pygame.Surface): the surface to draw on
         """
-        x0_col, y0_row = int(self._x // self.__point_spacing), int(self._y // self.__point_spacing)
-        d = (self._center[0] - self._x, self._center[1] - self._y)
-        points = self.__points_in_circle(x0_col, y0_row)
+        if self._layer_points is None:
+            self._build_layer()
+        cells = self.visible_cells()
 
-        # configurate the track
-        for i, j in points:
-            x = i * self.__point_spacing + d[0]
-            y = j * self.__point_spacing + d[1]
-            x, y = self.rotate_around_pivot((x, y))
+        # one transform of the camera for all the visible cells
+        is_cluster = self._layer_mask[cells[:, 0], cells[:, 1]]
+        others = cells[~is_cluster]
+        screen = self.to_screen(others * self.__point_spacing).tolist()
 
-            self.matrix[i][j].set_coordinates((x, y))
-            self.matrix[i][j].set_angle(self._angle)
+        # the objects are shared by many cells, the angle is set once
+        objects = {id(self.matrix[i][j]): self.matrix[i][j] for i, j in cells.tolist()}
+        for obj in objects.values():
+            obj.set_angle(self._angle)
+
+        # configurate the track
+        for (i, j), coo in zip(others.tolist(), screen):
+            self.matrix[i][j].set_coordinates(coo)
             self.matrix[i][j].draw(surface)
 
+        self._draw_clusters(surface, cells[is_cluster].tolist())
+
         # update the elements
-        for i, j in points:
-            self.matrix[i][j].update()
+        for obj in objects.values():
+            obj.update()
 
-    def __points_in_circle(self, x0, y0):
-        # returns the points within a circle of visibility
-        rows, cols = self._size
-        x, y = np.ogrid[:rows, :cols]
-        dist_sq = (x - x0) ** 2 + (y - y0) ** 2
-        return np.argwhere(dist_sq < self.__visible ** 2)
+    def visible_cells(self):
+        """
+        returns the cells (row, column) within the circle of visibility of the
+        current position, the stencil of the circle is shifted to the cell of
+        the position so the cost does not depend on the size of the grid
+        """
+        cells = self.__stencil + (int(self._x // self.__point_spacing), int(self._y // self.__point_spacing))
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < self._size[0]) & (cells[:, 1] >= 0) & (cells[:, 1] < self._size[1])
+        return cells[inside]
+
+    def to_screen(self, points):
+        """
+        transforms points in track pixels (n, 2) to the screen
+        """
+        R = np.array(self._rotation_matrix)
+        offset = np.subtract(self._center, self._pivot) - (self._x, self._y)
+        return (points + offset) @ R.T + self._pivot
+
+    def _build_layer(self):
+        # places the points of every cluster in track pixels, grouped by cell in row order
+        points, index, self._layer_cells = [], [], {}
+        self._layer_mask = np.zeros(self._size, dtype=bool)
+        start = 0
+        for i, row in enumerate(self.matrix):
+            for j, obj in enumerate(row):
+                if isinstance(obj, Cluster):
+                    self._layer_mask[i, j] = True
+                    points.append(obj.get_points() + (i * self.__point_spacing, j * self.__point_spacing))
+                    index.append(obj.get_indices())
+                    self._layer_cells[(i, j)] = (start, start + len(index[-1]))
+                    start += len(index[-1])
+
+        self._layer_points = np.concatenate(points) if points else np.empty((0, 2))
+        self._layer_index = np.concatenate(index) if index else np.empty(0, dtype=int)
+
+    def _draw_clusters(self, surface, cells):
+        # stamps the points of the clusters of the cells, one batch per style of point
+        batches = {}
+        for i, j in cells:
+            start, end = self._layer_cells[(i, j)]
+            batches.setdefault(self.matrix[i][j].get_style(), []).append(np.arange(start, end))
+
+        for (size, color), select in batches.items():
+            select = np.concatenate(select)
+            Cluster.draw_points(surface, self.to_screen(self._layer_points[select]), self._layer_index[select], size, color,
+                                self.progress.next_point)
+
+    def __circle_stencil(self, radius):
+        # offsets (row, column) of the cells within the circle, in row order
+        offsets = np.arange(-math.ceil(radius), math.ceil(radius) + 1)
+        di, dj = np.meshgrid(offsets, offsets, indexing='ij')
+        inside = di ** 2 + dj ** 2 < radius ** 2
+        return np.column_stack((di[inside], dj[inside]))
 
 class Checkbox:
     def __init__(self, x, y, size, label="", font_size=24):
@@ -487,11 +619,79 @@ class Checkbox:
         self.rect.x = coo[0]
         self.rect.y = coo[1]
 
+class RingBuffer:
+    """
+    fixed size buffer of the last samples of a series, the samples are written
+    twice (at k and k + capacity) so the ordered samples are always a view of
+    one contiguous slice, appending is O(1) and reading copies nothing
+    """
+    def __init__(self, capacity, fill=0.0):
+        """
+        initializes the buffer full of the fill value
+        args:
+            capacity (int): number of samples kept
+            fill (float): initial value of the samples
+        """
+        self._capacity = max(1, int(capacity))
+        self._data = np.full(2 * self._capacity, fill, dtype=float)
+        self._head = 0
+
+    def __len__(self):
+        return self._capacity
+
+    def append(self, value):
+        # replaces the oldest sample
+        self._data[self._head] = value
+        self._data[self._head + self._capacity] = value
+        self._head = (self._head + 1) % self._capacity
+
+    def extend(self, values):
+        # appends many samples, only the last capacity ones are kept
+        values = np.asarray(values, dtype=float)[-self._capacity:]
+        count = len(values)
+        first = min(count, self._capacity - self._head)
+        for begin, part in ((self._head, values[:first]), (0, values[first:])):
+            self._data[begin:begin + len(part)] = part
+            self._data[begin + self._capacity:begin + self._capacity + len(part)] = part
+        self._head = (self._head + count) % self._capacity
+
+    def clear(self, fill=0.0):
+        # fills all the samples with the value
+        self._data[:] = fill
+        self._head = 0
+
+    def set(self, data):
+        # replaces all the samples, the capacity follows the length of the data
+        if len(data) == 0:
+            data = (0.0,)
+        if len(data) != self._capacity:
+            self._capacity = len(data)
+            self._data = np.empty(2 * self._capacity)
+        self._data[:self._capacity] = data
+        self._data[self._capacity:] = self._data[:self._capacity]
+        self._head = 0
+
+    def resize(self, capacity):
+        # keeps the newest samples, the new ones are filled with the oldest sample
+        values = self.values()
+        capacity = max(1, int(capacity))
+        if capacity <= len(values):
+            self.set(values[len(values) - capacity:])
+        else:
+            self.set(np.concatenate((np.full(capacity - len(values), values[0]), values)))
+
+    def values(self):
+        # samples from the oldest to the newest (a view, valid until the next write)
+        return self._data[self._head:self._head + self._capacity]
+
+    def last(self):
+        return self._data[self._head + self._capacity - 1]
+
 class Display(Shape):
     """
     represents a display for the simulator with graphs and text
     """
-    __len_data = 100
+    __slots__ = ("font", "__max_value", "__min_value", "__graph_data", "__graph_colors", "__checbox_arr", "__x_steps", "__len_data")
     __saturation = 100
 
     # initializes the display
@@ -506,6 +706,7 @@ class Display(Shape):
             vertical_div (int): number of vertical divisions
         """
         self.font = pygame.font.SysFont("courier", 12, bold=True)
+        self.__len_data = 100
 
         # limits of y axis
         self.__max_value = self.__saturation
@@ -523,9 +724,19 @@ class Display(Shape):
 
         self.__checbox_arr = {}
 
-    # define time of the x axis
-    def set_time(self, fps):
-        self.__len_data = int(fps)
+        # x coordinates of the step plot for each number of samples and graph rectangle
+        self.__x_steps = {}
+
+    # number of samples of each line
+    def get_length(self):
+        return self.__len_data
+
+    # define time of the x axis, the lines keep their newest samples
+    def set_time(self, fps, seconds=1.0):
+        self.__len_data = max(1, int(fps * seconds))
+        for lines in self.__graph_data.values():
+            for data in lines.values():
+                data.resize(self.__len_data)
 
     def verify_checkbox(self, event):
         for graph_name, checkbox in self.__checbox_arr.items():
@@ -552,19 +763,47 @@ class Display(Shape):
     # adds a new line to an existing graph
     def add_line_to_graph(self, graph_name, line_name, color=(0, 200, 0)):
         if graph_name in self.__graph_data:
-            self.__graph_data[graph_name][line_name] = [0 for _ in range(self.__len_data)]
+            self.__graph_data[graph_name][line_name] = RingBuffer(self.__len_data)
             self.__graph_colors[graph_name][line_name] = color
 
     # updates the data for a specific line in a graph
     def update_graph_data(self, graph_name, line_name, new_value):
         if graph_name in self.__graph_data and line_name in self.__graph_data[graph_name]:
             self.__graph_data[graph_name][line_name].append(new_value)
-            if len(self.__graph_data[graph_name][line_name]) > self.__len_data:
-                self.__graph_data[graph_name][line_name].pop(0)
+
+    # appends many samples to a line, the oldest ones leave the graph
+    def extend_graph_data(self, graph_name, line_name, values):
+        if graph_name in self.__graph_data and line_name in self.__graph_data[graph_name]:
+            self.__graph_data[graph_name][line_name].extend(values)
+
+    # sets every sample of all the lines to zero
+    def clear_graph_data(self):
+        for lines in self.__graph_data.values():
+            for data in lines.values():
+                data.clear()
 
     # update the array of data for a specific graph
     def set_graph_data(self, graph_name, line_name, data):
-        self.__graph_data[graph_name][line_name] = data
+        self.__graph_data[graph_name][line_name].set(data)
+
+    # returns the samples of a line from the oldest to the newest
+    def get_graph_data(self, graph_name, line_name):
+        return self.__graph_data[graph_name][line_name].values()
+
+    # returns a read only copy of the samples of every line, see set_graph_state
+    def get_graph_state(self):
+        state = []
+        for graph_name, lines in self.__graph_data.items():
+            for line_name, data in lines.items():
+                values = data.values().copy()
+                values.flags.writeable = False
+                state.append((graph_name, line_name, values))
+        return tuple(state)
+
+    # puts back the samples of get_graph_state
+    def set_graph_state(self, state):
+        for graph_name, line_name, values in state:
+            self.set_graph_data(graph_name, line_name, values)
 
     # draws the display as a rectangle with rounded corners, including graphs and text
     def draw(self, surface):
@@ -636,25 +875,25 @@ class Display(Shape):
         pygame.draw.rect(surface, (255, 255, 255), (rect_x, rect_y, rect_width, rect_height))
         surface.blit(title_label, (graph_x + graph_width // 2 - text_width // 2, rect_y + 5))
 
-    # draw each line in the graph
+    # x coordinates of a step plot of the samples, (x0, x1, x1, x2, ...)
+    def __step_x(self, samples, graph_width, graph_x):
+        key = (samples, graph_width, graph_x)
+        if key not in self.__x_steps:
+            x = graph_x + np.arange(samples + 1) * (graph_width / samples)
+            self.__x_steps[key] = np.repeat(x, 2)[1:-1]
+        return self.__x_steps[key]
+
+    # draw each line in the graph, one polyline per line
     def __draw_graph_separate(self, surface, lines, title, graph_width, graph_height, graph_x, graph_y):
+        scale = graph_height / (self.__max_value - self.__min_value)
         for line_name, data in lines.items():
-            normalized_data = [
-                graph_height - (graph_height * (value - self.__min_value) / (self.__max_value - self.__min_value))
-                for value in data
-            ]
-            step_width = graph_width / len(data)
-            color = self.__graph_colors[title][line_name]
+            values = data.values()
+            y = graph_y + graph_height - (values - self.__min_value) * scale
 
-            for i in range(len(normalized_data)):
-                x1 = graph_x + i * step_width
-                y1 = graph_y + normalized_data[i]
-                x2 = graph_x + (i + 1) * step_width
-                y2 = graph_y + normalized_data[i + 1] if i < len(normalized_data) - 1 else y1
-                # draw the horizontal step
-                pygame.draw.line(surface, color, (x1, y1), (x2, y1), 2)
-                # draw the vertical connection to the next step
-                pygame.draw.line(surface, color, (x2, y1), (x2, y2), 2)
+            # each sample is a horizontal step followed by the vertical connection to the next one
+            points = np.column_stack((self.__step_x(len(values), graph_width, graph_x), np.repeat(y, 2)))
+            color = self.__graph_colors[title][line_name]
+            pygame.draw.lines(surface, color, False, points, 2)
 
     # draw legend
     def __draw_legend(self, surface, graph_x, graph_y, title):
@@ -674,7 +913,7 @@ class Display(Shape):
             # draw a background rectangle
             #pygame.draw.rect(surface, (200, 200, 200), (graph_x, graph_y + graph_height - 25 - i * 23, 100, 25))
             # round 2 decimal places
-            value = round(data[-1], 2)
+            value = round(float(data.last()), 2)
             label = self.font.render(f"{line_name}: {value}", True, (0, 0, 0))
             # draw the label
             x = graph_x + 10
@@ -714,6 +953,7 @@ class Statistics(Shape):
     """
     represents statistical text information displayed on the simulator
     """
+    __slots__ = ("text", "_source", "_offset")
     _font = None
     def __init__(self, coo=(800, 600), color=(0, 200, 0), size=100, angle=0):
         """
@@ -726,6 +966,7 @@ class Statistics(Shape):
         """
         super().__init__(coo, color, size, angle)
         self.text = "_____"
+        self._source = None
         self._offset = 1
         # set the font for the text
         if not Statistics._font:
@@ -744,20 +985,32 @@ class Statistics(Shape):
         # updates the text to be displayed
         self.text = text
 
+    def set_source(self, source):
+        # the text is read from the callable on each draw (None uses set_text)
+        self._source = source
+
     def draw(self, surface):
         """
-        draws the text on the given surface
+        draws the text on the given surface, one line under the other
         args:
             surface (pygame.Surface): the surface to draw on
         """
-        text_surface = self._font.render(self.text, True, self._color)
-        x = self._x - text_surface.get_width() // self._offset
-        surface.blit(text_surface, (x, self._y))
+        if self._source is not None:
+            self.text = self._source()
+
+        y = self._y
+        for line in self.text.split("\n"):
+            text_surface = self._font.render(line, True, self._color)
+            x = self._x - text_surface.get_width() // self._offset
+            surface.blit(text_surface, (x, y))
+            y += self._font.get_linesize()
 
 class Compass(Shape):
     """
     represents a compass object on the simulator
     """
+    __slots__ = ()
+
     def __init__(self, coo, color=(0, 0, 0), size=40, angle=0):
         """
         initializes the compass object
@@ -815,6 +1068,8 @@ class LineSensor(Shape):
     """
     represents a line sensor object on the simulator
     """
+    __slots__ = ()
+
     def __init__(self, coo, color=(150, 150, 150), size=80, angle=0):
         """
         initializes the line sensor object
@@ -846,6 +1101,72 @@ class LineSensor(Shape):
         # returns the size of the line sensor
         return self._size
 
+class CachedLayer:
+    """
+    group of objects drawn into a cached surface that is redrawn once every
+    period draws, between the refreshes the cached surface is blitted unchanged.
+    the surface is blitted whole, finding the drawn parts of it on each refresh
+    costs more than the transparent pixels they save
+    """
+    def __init__(self, size, period=1):
+        """
+        initializes the layer
+        args:
+            size (tuple): size of the cached surface, usually the screen
+            period (int): number of draws between two refreshes
+        """
+        self.__surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.__objects = []
+        self.__names = []
+        self.__profiler = None
+        self.__count = 0
+        self.set_period(period)
+
+    def set_period(self, period):
+        # sets the number of draws between two refreshes
+        self.__period = max(1, int(period))
+        self.refresh()
+
+    def refresh(self):
+        # the next draw redraws the objects
+        self.__count = 0
+
+    def add(self, obj, name=None):
+        # adds an object to the layer, the order of the objects is the layer order
+        self.__objects.append(obj)
+        self.__names.append(name or type(obj).__name__)
+        self.refresh()
+
+    def remove(self, obj):
+        # removes an object from the layer
+        del self.__names[self.__objects.index(obj)]
+        self.__objects.remove(obj)
+        self.refresh()
+
+    def set_profiler(self, profiler, prefix="draw."):
+        # times the draw of each object with the profiler (None disables it)
+        self.__profiler = profiler
+        self.__prefix = prefix
+
+    def __redraw(self):
+        # draws the objects on the cleared surface
+        self.__surface.fill((0, 0, 0, 0))
+        if self.__profiler:
+            clock = time.perf_counter()
+            for obj, name in zip(self.__objects, self.__names):
+                obj.draw(self.__surface)
+                clock = self.__profiler.lap(self.__prefix + name, clock)
+        else:
+            for obj in self.__objects:
+                obj.draw(self.__surface)
+
+    def draw(self, surface):
+        # redraws the objects when it is time, then blits the cached surface
+        if self.__count % self.__period == 0:
+            self.__redraw()
+        self.__count += 1
+        surface.blit(self.__surface, (0, 0))
+
 class Simulator:
     """
     represents the simulator environment for the line follower
@@ -876,6 +1197,8 @@ class Simulator:
         self.__height = height
         self.__FPS = FPS
         self.__objects = []
+        self.__names = []
+        self.__profiler = None
 
     def start(self):
 
@@ -903,14 +1226,20 @@ class Simulator:
         # returns the center coordinates of the simulator window
         return self.__width // 2, self.__height // 2
 
-    def add(self, obj):
-        # adds an object to the simulator environment
+    def add(self, obj, name=None):
+        # adds an object to the simulator environment, the name identifies it in the profiler
         self.__objects.append(obj)
+        self.__names.append(name or type(obj).__name__)
 
     def remove(self, obj):
         # removes an object from the simulator environment
+        del self.__names[self.__objects.index(obj)]
         self.__objects.remove(obj)
 
+    def set_profiler(self, profiler):
+        # times the draw of each object and the flip with the profiler (None disables it)
+        self.__profiler = profiler
+
     def __verify_objects(self):
         # verifies if there are objects to update or draw
         return len(self.__objects) > 0
@@ -920,6 +1249,15 @@ class Simulator:
         if not self.__verify_objects():
             return
         self.screen.fill((255, 255, 255))  # background color
+        if self.__profiler:
+            clock = time.perf_counter()
+            for obj, name in zip(self.__objects, self.__names):
+                obj.draw(self.screen)
+                clock = self.__profiler.lap("draw." + name, clock)
+            pygame.display.flip()
+            self.__profiler.lap("draw.flip", clock)
+            return
+
         for obj in self.__objects:
             obj.draw(self.screen)
 
@@ -0,0 +1,138 @@
+import os
+import hashlib
+import numpy as np
+from scipy.spatial import cKDTree
+from atomic_file import atomic_write
+
+SENSOR_SCREEN = 'SCREEN'
+SENSOR_FIELD = 'FIELD'
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+
+class TrackField:
+    """
+    signed distance raster of the track line, the line is the union of the
+    circles drawn at every track point, so the distance is negative inside it.
+    only the blocks of cells near the line are stored, all the other blocks
+    share a single block far from the line.
+    """
+    _block = 16
+
+    def __init__(self, x_arr, y_arr, radius, resolution=0.004, clip=None, cache_dir=CACHE_DIR):
+        """
+        initializes the field, loading it from the cache when it exists
+        args:
+            x_arr (np.ndarray): x coordinates of the track points in meters
+            y_arr (np.ndarray): y coordinates of the track points in meters
+            radius (float): radius of the line around each point in meters
+            resolution (float): size of each cell in meters
+            clip (float): distances are saturated at +-clip, default is the radius
+            cache_dir (str): directory of the cache, None disables it
+        """
+        self.radius = radius
+        self.resolution = resolution
+        self.clip = radius if clip is None else clip
+
+        points = np.column_stack((np.asarray(x_arr, dtype=float), np.asarray(y_arr, dtype=float)))
+        key = self._key(points)
+        path = None if cache_dir is None else os.path.join(cache_dir, f"field_{key}")
+
+        if path is not None and os.path.exists(path + "_blocks.npy"):
+            self._load(path)
+        else:
+            self._build(points)
+            if path is not None:
+                self._save(path)
+
+        self._set_lookup()
+
+    def _key(self, points):
+        # hash of everything the raster depends on
+        sha = hashlib.sha1(points.tobytes())
+        sha.update(np.array([self.radius, self.resolution, self.clip, self._block], dtype=float).tobytes())
+        return sha.hexdigest()[:16]
+
+    def _build(self, points):
+        block_size = self._block * self.resolution
+        band = self.radius + self.clip
+
+        # the grid has one empty block of margin around the track
+        margin = band + block_size
+        self.origin = points.min(axis=0) - margin
+        shape = np.ceil((points.max(axis=0) + margin - self.origin) / block_size).astype(int) + 1
+
+        # every block closer than the band to a point needs to be stored
+        reach = int(np.ceil(band / block_size))
+        block_index = np.floor((points - self.origin) / block_size).astype(int)
+        offsets = np.arange(-reach, reach + 1)
+        neighbors = (block_index[:, None, None, :] + np.stack(np.meshgrid(offsets, offsets, indexing='ij'), axis=-1)).reshape(-1, 2)
+        neighbors = np.unique(neighbors, axis=0)
+
+        # the block 0 is the shared block far from the line
+        self.table = np.zeros(shape, dtype=np.int32)
+        self.table[neighbors[:, 0], neighbors[:, 1]] = np.arange(1, len(neighbors) + 1)
+
+        # distance from the center of each cell to the nearest point
+        cells = np.arange(self._block)
+        i = neighbors[:, 0, None, None] * self._block + cells[None, :, None]
+        j = neighbors[:, 1, None, None] * self._block + cells[None, None, :]
+        x = self.origin[0] + (i + 0.5) * self.resolution
+        y = self.origin[1] + (j + 0.5) * self.resolution
+        centers = np.column_stack((np.broadcast_to(x, (len(neighbors), self._block, self._block)).ravel(),
+                                   np.broadcast_to(y, (len(neighbors), self._block, self._block)).ravel()))
+        distance, _ = cKDTree(points).query(centers, distance_upper_bound=band)
+        distance = np.clip(distance - self.radius, -self.clip, self.clip)
+
+        self.blocks = np.empty((len(neighbors) + 1, self._block, self._block), dtype=np.float32)
+        self.blocks[0] = self.clip
+        self.blocks[1:] = distance.reshape(len(neighbors), self._block, self._block)
+
+    def _save(self, path):
+        # the blocks are written last, they mark the cache as complete
+        for name, array in (("_table.npy", self.table), ("_origin.npy", self.origin), ("_blocks.npy", self.blocks)):
+            with atomic_write(path + name) as file:
+                np.save(file, array)
+
+    def _load(self, path):
+        # the blocks are memory mapped, only the cells read are loaded
+        self.table = np.load(path + "_table.npy")
+        self.origin = np.load(path + "_origin.npy")
+        self.blocks = np.load(path + "_blocks.npy", mmap_mode='r')
+
+    def _set_lookup(self):
+        # flat view of the blocks and the offsets of the four corners of a cell
+        self._flat = np.asarray(self.blocks).reshape(-1)
+        self._limit = np.array(self.table.shape) * self._block - 1.000001
+        self._corner_i = np.array([[0], [1], [0], [1]])
+        self._corner_j = np.array([[0], [0], [1], [1]])
+
+    def distance(self, x, y):
+        """
+        bilinear interpolation of the signed distance at the points (x, y)
+        args:
+            x (np.ndarray): x coordinates in meters
+            y (np.ndarray): y coordinates in meters
+        returns:
+            np.ndarray: signed distance to the border of the line in meters
+        """
+        # outside the grid the points are moved to the border, far from the line
+        gx = np.minimum(np.maximum((np.asarray(x) - self.origin[0]) / self.resolution - 0.5, 0), self._limit[0])
+        gy = np.minimum(np.maximum((np.asarray(y) - self.origin[1]) / self.resolution - 0.5, 0), self._limit[1])
+        i = gx.astype(np.intp)
+        j = gy.astype(np.intp)
+        fx = gx - i
+        fy = gy - j
+
+        # the four corners are read in a single gather
+        i = i + self._corner_i
+        j = j + self._corner_j
+        index = self.table[i // self._block, j // self._block] * self._block**2 + (i % self._block) * self._block + j % self._block
+        corners = self._flat[index]
+        return ((corners[0] * (1 - fx) + corners[1] * fx) * (1 - fy) +
+                (corners[2] * (1 - fx) + corners[3] * fx) * fy)
+
+    def coverage(self, x, y, pixel_size):
+        """
+        fraction of a pixel of side pixel_size centered at (x, y) covered by the line
+        """
+        return np.clip(0.5 - self.distance(x, y) / pixel_size, 0, 1)
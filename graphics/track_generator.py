@@ -1,12 +1,18 @@
+import os
 import math
 import random
+import struct
+import hashlib
+import zipfile
 import numpy as np
 from scipy.interpolate import splprep, splev
+from graphics.track_field import CACHE_DIR
+from atomic_file import atomic_write
 
 LEMNISCATE = 0
 CIRCLE = 1
 
-def circle_checkpoints(ckeckpoints_number, track_radius, noise):
+def circle_checkpoints(ckeckpoints_number, track_radius, noise, rng=random):
     checkpoints = []
     for c in range(ckeckpoints_number):
         # Angle steps
@@ -17,14 +23,14 @@ def circle_checkpoints(ckeckpoints_number, track_radius, noise):
         y = track_radius * math.sin(t)
 
         # Add noise to points
-        x += random.uniform(noise/2, noise)
-        y += random.uniform(noise/2, noise)
+        x += rng.uniform(noise/2, noise)
+        y += rng.uniform(noise/2, noise)
 
         checkpoints.append((x, y))
     
     return checkpoints
 
-def lemniscate_checkpoints(ckeckpoints_number, track_radius, noise):
+def lemniscate_checkpoints(ckeckpoints_number, track_radius, noise, rng=random):
     checkpoints = []
     for c in range(ckeckpoints_number):
         # Angle steps
@@ -35,19 +41,21 @@ def lemniscate_checkpoints(ckeckpoints_number, track_radius, noise):
         y = track_radius * math.sin(t) * math.cos(t)  
 
         # Add noise to points
-        x += random.uniform(noise/3, noise)
-        y += random.uniform(noise/3, noise)
+        x += rng.uniform(noise/3, noise)
+        y += rng.uniform(noise/3, noise)
 
         checkpoints.append((x, y))
 
     return checkpoints
 
-def generate_track(type=LEMNISCATE, checkpoints=24, track_rad=40, noise_level=0.12, resolution=250):
-    # Seed random generator
-    SEED = None
-    if SEED is None:
+def generate_track(type=LEMNISCATE, checkpoints=24, track_rad=40, noise_level=0.12, resolution=250, seed=None):
+    # Seed a private random generator, the track is a pure function of the
+    # parameters when the seed is given (the global generator is not touched)
+    if seed is None:
         SEED = random.randint(0, 2**32 - 1)
-    random.seed(SEED)
+    else:
+        SEED = random.Random(seed).randint(0, 2**32 - 1)
+    rng = random.Random(SEED)
 
     CHECKPOINTS = checkpoints
     TRACK_RADIUS = track_rad
@@ -55,9 +63,9 @@ def generate_track(type=LEMNISCATE, checkpoints=24, track_rad=40, noise_level=0.
 
     # Generate checkpoints 
     if type == CIRCLE:
-        checkpoints = circle_checkpoints(CHECKPOINTS, TRACK_RADIUS, NOISE_LEVEL)
+        checkpoints = circle_checkpoints(CHECKPOINTS, TRACK_RADIUS, NOISE_LEVEL, rng)
     elif type == LEMNISCATE:
-        checkpoints = lemniscate_checkpoints(CHECKPOINTS, TRACK_RADIUS, NOISE_LEVEL)
+        checkpoints = lemniscate_checkpoints(CHECKPOINTS, TRACK_RADIUS, NOISE_LEVEL, rng)
     else:
         raise ValueError("Invalid track type")
 
@@ -92,42 +100,218 @@ def points_in_square(x0, y0, size, x_arr, y_arr):
 
     return np.where(inside_square)[0].tolist()
 
-def generate_cluster(length, width, scale, x_arr, y_arr):
+def partition_cluster(length, width, scale, x_arr, y_arr):
+    """
+    Partitions the track points in the cells of the grid.
+
+    Every cell (i, j) of the grid owns the points inside the square centered at
+    (i, j) with a side length of 2 * (length + width) / scale, the first cell in
+    row order wins the points shared by more than one square. The points are
+    binned in a single pass, hashing each one to the cells that contain it.
+
+    Args:
+        length (float): Length of the square.
+        width (float): Width of the square.
+        scale (float): Pixels per meter of the cluster points.
+        x_arr (np.ndarray): Array of x-coordinates of the points.
+        y_arr (np.ndarray): Array of y-coordinates of the points.
+
+    Returns:
+        np.ndarray: Indices of the points sorted by cluster.
+        np.ndarray: Bounds of each cluster in the indices, cluster k is order[bounds[k]:bounds[k + 1]].
+        np.ndarray: Position (row, column) of each cluster in the grid.
+    """
+    x_arr = np.asarray(x_arr)
+    y_arr = np.asarray(y_arr)
+    size = (length + width)/scale
+
+    # limits of the cells (the last one is not included)
+    i_first, i_last = -length//2, length//2
+    j_first, j_last = -width//2, width//2
+    columns = j_last - j_first
+
+    # first cell of each axis whose square contains the point
+    i0 = np.maximum(np.floor(x_arr - size).astype(int) + 1, i_first)
+    j0 = np.maximum(np.floor(y_arr - size).astype(int) + 1, j_first)
+
+    def cell_key(i, j):
+        # row order of the cells
+        return (i - i_first) * columns + (j - j_first)
+
+    def inside(i, j):
+        return (i < x_arr + size) & (i < i_last) & (j < y_arr + size) & (j < j_last)
+
+    # every cell whose square contains at least one point has a cluster
+    reach = int(math.ceil(2 * size)) + 1
+    keys = []
+    for di in range(reach):
+        for dj in range(reach):
+            valid = inside(i0 + di, j0 + dj)
+            keys.append(cell_key(i0[valid] + di, j0[valid] + dj))
+    keys = np.unique(np.concatenate(keys))
+
+    # the points belong to the first cell that contains them
+    order = np.where(inside(i0, j0))[0]
+    owner = cell_key(i0[order], j0[order])
+    order = order[np.argsort(owner, kind='stable')]
+    bounds = np.searchsorted(np.sort(owner), np.append(keys, keys[-1] + 1) if len(keys) else keys, side='left')
+
+    position = np.column_stack((keys // columns + i_first + length // 2, keys % columns + j_first + width // 2))
+    return order, bounds, position
+
+def generate_cluster(length, width, scale, x_arr, y_arr, partition=None):
     """
     Generates a cluster of points in a square area.
-    
+
     Args:
         length (float): Length of the square.
         width (float): Width of the square.
+        scale (float): Pixels per meter of the cluster points.
+        x_arr (np.ndarray): Array of x-coordinates of the points.
+        y_arr (np.ndarray): Array of y-coordinates of the points.
+        partition (tuple): Result of partition_cluster, computed when not given.
 
     Returns:
-        array of arrays: Array of points in the cluster.
+        array of arrays: Array of points (x, y, index) in the cluster, relative to the cell in pixels.
+        list: Position (row, column) of each cluster in the grid.
     """
+    x_arr = np.asarray(x_arr)
+    y_arr = np.asarray(y_arr)
+    order, bounds, position = partition if partition is not None else partition_cluster(length, width, scale, x_arr, y_arr)
 
     # matriz of 3 dimensions
     cluster_matrix = []
-    position = []
-
-    # save the points useds
-    processed_points = set()
-    for i in range(-length//2, length//2):
-        for j in range(-width//2, width//2):
-            # verify if has in the square
-            index_arr = points_in_square(i, j, (length + width)/scale, x_arr, y_arr)
-            if len(index_arr) > 0:
-                cluster_array = []
-                # create the cluster
-                for index in index_arr:
-                    # verify if the point is already used
-                    if index not in processed_points:
-                        x = (x_arr[index] - i) * scale
-                        y = (y_arr[index] - j) * scale
-                        cluster_array.append((x, y, index))
-                        processed_points.add(index)
-            
-                # add the cluster to the matrix
-                cluster_matrix.append([])
-                cluster_matrix[-1] = cluster_array
-                position.append((i + length // 2, j + width // 2))
-
-    return cluster_matrix, position
+    for k in range(len(position)):
+        index = np.asarray(order[bounds[k]:bounds[k + 1]])
+        x = (x_arr[index] - (position[k][0] - length // 2)) * scale
+        y = (y_arr[index] - (position[k][1] - width // 2)) * scale
+        cluster_matrix.append(list(zip(x.tolist(), y.tolist(), index.tolist())))
+
+    return cluster_matrix, [(int(i), int(j)) for i, j in position]
+
+def _save_npz(path, **arrays):
+    # writes an uncompressed archive, replaced at once so parallel readers never see half a file
+    with atomic_write(path) as file:
+        np.savez(file, **arrays)
+
+def _load_npz(path):
+    # memory maps the arrays of an uncompressed archive straight from the file
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+
+            # skip the local header of the member to reach the npy data
+            file.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', file.read(30)[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(file)
+
+            if dtype.hasobject or 0 in shape:
+                arrays[name] = np.zeros(shape, dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(), shape=shape, order='F' if fortran else 'C')
+    return arrays
+
+def load_track(type=LEMNISCATE, seed=None, checkpoints=24, track_rad=40, noise_level=0.12, resolution=250,
+               length=100, width=100, scale=300, cache_dir=CACHE_DIR):
+    """
+    Returns the track and its cluster partition, from the cache when they were already generated.
+
+    The cache is an uncompressed .npz file keyed by every parameter, loaded with
+    memory maps, so a warm start skips the spline fitting and the clustering.
+    Random tracks (seed None) are never cached.
+
+    Args:
+        type, seed, checkpoints, track_rad, noise_level, resolution: Parameters of generate_track.
+        length, width, scale: Parameters of partition_cluster.
+        cache_dir (str): Directory of the cache, None disables it.
+
+    Returns:
+        np.ndarray: Array of x-coordinates of the track.
+        np.ndarray: Array of y-coordinates of the track.
+        tuple: Cluster partition (order, bounds, position), see partition_cluster.
+    """
+    path = None
+    if cache_dir is not None and seed is not None:
+        parameters = (type, seed, checkpoints, track_rad, noise_level, resolution, length, width, scale)
+        key = hashlib.sha1(repr(parameters).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"track_{key}.npz")
+
+        if os.path.exists(path):
+            arrays = _load_npz(path)
+            return arrays["x"], arrays["y"], (arrays["order"], arrays["bounds"], arrays["position"])
+
+    x_arr, y_arr = generate_track(type, checkpoints, track_rad, noise_level, resolution, seed)
+    x_arr = np.ascontiguousarray(x_arr)
+    y_arr = np.ascontiguousarray(y_arr)
+    order, bounds, position = partition_cluster(length, width, scale, x_arr, y_arr)
+
+    if path is not None:
+        _save_npz(path, x=x_arr, y=y_arr, order=order, bounds=bounds, position=position)
+    return x_arr, y_arr, (order, bounds, position)
+
+def to_car_frame(x, y, pose):
+    """
+    Converts points of the track frame to the car frame (x to the right, y forward).
+
+    Args:
+        x (np.ndarray): x-coordinates of the points in meters.
+        y (np.ndarray): y-coordinates of the points in meters.
+        pose (tuple): Car pose (x, y, angle) in the track frame.
+
+    Returns:
+        tuple: x and y coordinates of the points in the car frame.
+    """
+    x0, y0, angle = pose
+    dx = np.asarray(x) - x0
+    dy = np.asarray(y) - y0
+    cos_theta, sin_theta = math.cos(angle), math.sin(angle)
+    return cos_theta * dx - sin_theta * dy, -(sin_theta * dx + cos_theta * dy)
+
+def to_track_frame(x, y, pose):
+    """
+    Converts points of the car frame back to the track frame, inverse of to_car_frame.
+
+    Args:
+        x (np.ndarray): x-coordinates of the points in the car frame.
+        y (np.ndarray): y-coordinates of the points in the car frame.
+        pose (tuple): Car pose (x, y, angle) in the track frame.
+
+    Returns:
+        tuple: x and y coordinates of the points in the track frame.
+    """
+    x0, y0, angle = pose
+    x = np.asarray(x)
+    y = -np.asarray(y)
+    cos_theta, sin_theta = math.cos(angle), math.sin(angle)
+    return x0 + cos_theta * x + sin_theta * y, y0 - sin_theta * x + cos_theta * y
+
+def get_future_points(x_arr, y_arr, pose, index, count, space):
+    """
+    Returns the next points of the track in the car frame.
+
+    The points are index + space, index + 2 * space, ... index + count * space,
+    the indices after the end of the track are held at the last point.
+
+    Args:
+        x_arr (np.ndarray): Array of x-coordinates of the track in meters.
+        y_arr (np.ndarray): Array of y-coordinates of the track in meters.
+        pose (tuple): Car pose (x, y, angle) in the track frame.
+        index (int): Index of the next point to be reached.
+        count (int): Number of future points.
+        space (int): Number of track points between future points.
+
+    Returns:
+        np.ndarray: Array (count, 2) of future points in the car frame.
+    """
+    future = np.minimum(index + space * np.arange(1, count + 1), len(x_arr) - 1)
+    x, y = to_car_frame(x_arr[future], y_arr[future], pose)
+    return np.column_stack((x, y))
@@ -0,0 +1,304 @@
+import math
+import bisect
+import numpy as np
+from scipy.spatial import cKDTree
+
+class TrackLine:
+    """
+    the metric polyline of the track (meters), the segments of zero length are
+    dropped. a track whose last point is on the first one is closed and its
+    segments wrap around.
+    """
+    _closing = 1e-6     # distance in meters between the ends of a closed track
+
+    def __init__(self, x_arr, y_arr):
+        """
+        initializes the polyline
+        args:
+            x_arr (np.ndarray): x coordinates of the track points in meters
+            y_arr (np.ndarray): y coordinates of the track points in meters
+        """
+        x = np.asarray(x_arr, dtype=float)
+        y = np.asarray(y_arr, dtype=float)
+
+        # distance along the track of every point
+        step_x = np.diff(x)
+        step_y = np.diff(y)
+        step = np.sqrt(step_x * step_x + step_y * step_y)
+        self.point_distance = np.concatenate(([0.0], np.cumsum(step)))
+
+        # the vertices of the segments, the start of each one
+        keep = np.concatenate(([True], step > 0))
+        x, y = x[keep], y[keep]
+        if len(x) < 2:
+            raise ValueError("The track needs two distinct points")
+        self.closed = len(x) > 2 and math.hypot(x[-1] - x[0], y[-1] - y[0]) <= self._closing
+        self.length = float(self.point_distance[-1])
+
+        self.ax, self.ay = x[:-1], y[:-1]
+        self.dx, self.dy = np.diff(x), np.diff(y)
+        self.length2 = self.dx * self.dx + self.dy * self.dy
+        self.segment_length = np.sqrt(self.length2)
+        self.distance = np.concatenate(([0.0], np.cumsum(self.segment_length)))[:-1]
+        self.count = len(self.ax)
+
+        # nearest vertex when the car is lost
+        self.tree = cKDTree(np.column_stack((self.ax, self.ay)))
+
+class TrackProgress:
+    """
+    arc length progress of the car along the track, the position is projected
+    on the segments of the track line walking from the segment of the last
+    update, a few segments per step (O(1) amortized). when the walk does not
+    end within the window, or the track is far, the nearest vertex is found in
+    a kd-tree (O(log n)) and the walk starts from it.
+    the distance along the track grows with the laps of a closed track. the
+    progress is the distance reached driving on the track (the lateral offset
+    within the tolerance) from where it was, cutting across or coming back on
+    the track ahead does not count.
+    """
+    def __init__(self, x_arr, y_arr, tolerance=0.1, window=32, recover_distance=0.5):
+        """
+        initializes the tracker at the first point of the track
+        args:
+            x_arr (np.ndarray): x coordinates of the track points in meters (or a TrackLine with y_arr None)
+            y_arr (np.ndarray): y coordinates of the track points in meters
+            tolerance (float): largest lateral offset on the track in meters
+            window (int): most segments walked in one update
+            recover_distance (float): distance to the track in meters that looks for a nearer part of it
+        """
+        self.line = x_arr if isinstance(x_arr, TrackLine) else TrackLine(x_arr, y_arr)
+        self.tolerance = tolerance
+        self.window = window
+        self.recover_distance = recover_distance
+
+        # the walk reads python floats, faster than numpy scalars
+        line = self.line
+        self._ax, self._ay = line.ax.tolist(), line.ay.tolist()
+        self._dx, self._dy = line.dx.tolist(), line.dy.tolist()
+        self._length2 = line.length2.tolist()
+        self._segment_length = line.segment_length.tolist()
+        self._distance = line.distance.tolist()
+        self._point_distance = line.point_distance.tolist()
+        self.reset()
+
+    def reset(self):
+        # at rest on the first point of the track
+        self.index = 0
+        self.lap = 0
+        self.distance = 0.0
+        self.offset = 0.0
+        self.progress = 0.0
+        self.recovered = False
+
+    def set_tolerance(self, tolerance):
+        self.tolerance = tolerance
+
+    def get_state(self):
+        # the values that change on each update, see set_state
+        return (self.index, self.lap, self.distance, self.offset, self.progress, self.recovered)
+
+    def set_state(self, state):
+        self.index, self.lap, self.distance, self.offset, self.progress, self.recovered = state
+
+    def get_points(self):
+        # number of track points reached, the points before the progress
+        return bisect.bisect_right(self._point_distance, self.progress)
+
+    def _walk(self, index, lap, x, y):
+        # the segment of the projection from index, None when the window ends first
+        ax, ay, dx, dy, length2 = self._ax, self._ay, self._dx, self._dy, self._length2
+        count = self.line.count
+        move = 0
+        for _ in range(self.window):
+            t = ((x - ax[index]) * dx[index] + (y - ay[index]) * dy[index]) / length2[index]
+            if t > 1 and move >= 0:
+                move = 1
+                index += 1
+                if index == count:
+                    if not self.line.closed:
+                        return count - 1, lap, 1.0
+                    index = 0
+                    lap += 1
+            elif t < 0 and move <= 0:
+                move = -1
+                index -= 1
+                if index < 0:
+                    if not self.line.closed:
+                        return 0, lap, 0.0
+                    index = count - 1
+                    lap -= 1
+            else:
+                return index, lap, min(1.0, max(0.0, t))
+        return None
+
+    def _gap(self, index, t, x, y):
+        # distance from the position to its projection on the segment
+        gap_x = x - (self._ax[index] + t * self._dx[index])
+        gap_y = y - (self._ay[index] + t * self._dy[index])
+        return math.sqrt(gap_x * gap_x + gap_y * gap_y)
+
+    def update(self, x, y):
+        """
+        projects the position on the track, the distance, lap, offset and
+        progress are updated
+        args:
+            x (float): x coordinate of the car in meters
+            y (float): y coordinate of the car in meters
+        returns:
+            float: the progress in meters
+        """
+        previous = self.distance
+        walk = self._walk(self.index, self.lap, x, y)
+        gap = math.inf if walk is None else self._gap(walk[0], walk[2], x, y)
+
+        # lost, or far from the track: the walk starts again from the nearest vertex
+        self.recovered = False
+        if gap > self.recover_distance:
+            nearest, vertex = self.line.tree.query((x, y))
+            if nearest < gap:
+                lap = self._nearest_lap(self._distance[vertex], previous)
+                walk = self._walk(int(vertex), lap, x, y) or (int(vertex), lap, 0.0)
+                self.recovered = True
+
+        self.index, self.lap, t = walk
+        index = self.index
+        self.distance = self.lap * self.line.length + self._distance[index] + t * self._segment_length[index]
+        self.offset = (self._dx[index] * (y - self._ay[index]) - self._dy[index] * (x - self._ax[index])) / self._segment_length[index]
+
+        # the progress follows the car on the track, from where it was
+        if not self.recovered and abs(self.offset) <= self.tolerance and previous <= self.progress + self.tolerance:
+            self.progress = max(self.progress, self.distance)
+        return self.progress
+
+    def _nearest_lap(self, distance, previous):
+        # the lap that puts the distance on the track nearest to the previous one
+        if not self.line.closed:
+            return 0
+        lap = math.floor((previous - distance) / self.line.length + 0.5)
+        return int(lap)
+
+class BatchTrackProgress:
+    """
+    TrackProgress of N cars at once, every state is an array with one value
+    per car. the equations are the same of TrackProgress, so every car gets
+    the result of its own tracker.
+    """
+    def __init__(self, x_arr, y_arr, count, tolerance=0.1, window=32, recover_distance=0.5):
+        """
+        initializes the trackers at the first point of the track
+        args:
+            count (int): number of cars
+            the other arguments are the ones of TrackProgress
+        """
+        self.line = x_arr if isinstance(x_arr, TrackLine) else TrackLine(x_arr, y_arr)
+        self.count = count
+        self.tolerance = tolerance
+        self.window = window
+        self.recover_distance = recover_distance
+        self.reset()
+
+    def reset(self):
+        # every car at rest on the first point of the track
+        self.index = np.zeros(self.count, dtype=int)
+        self.lap = np.zeros(self.count, dtype=int)
+        self.distance = np.zeros(self.count)
+        self.offset = np.zeros(self.count)
+        self.progress = np.zeros(self.count)
+        self.recovered = np.zeros(self.count, dtype=bool)
+
+    def set_tolerance(self, tolerance):
+        self.tolerance = tolerance
+
+    def get_points(self):
+        # number of track points reached by each car
+        return np.searchsorted(self.line.point_distance, self.progress, side="right")
+
+    def _walk(self, index, lap, x, y):
+        # the segment of the projection of each car, lost is set when the window ends first
+        line = self.line
+        index, lap = index.copy(), lap.copy()
+        t = np.zeros(len(index))
+        lost = np.zeros(len(index), dtype=bool)
+
+        # the cars still walking, with their segment, lap, direction and position
+        cars = np.arange(len(index))
+        k, k_lap, move, x, y = index.copy(), lap.copy(), np.zeros(len(index), dtype=int), x, y
+        for _ in range(self.window):
+            t_k = ((x - line.ax[k]) * line.dx[k] + (y - line.ay[k]) * line.dy[k]) / line.length2[k]
+            forward = (t_k > 1) & (move >= 0)
+            backward = (t_k < 0) & (move <= 0)
+
+            # the cars that stop on their segment
+            stop = ~(forward | backward)
+            done = cars[stop]
+            index[done], lap[done] = k[stop], k_lap[stop]
+            t[done] = np.minimum(1.0, np.maximum(0.0, t_k[stop]))
+
+            move = np.where(forward, 1, np.where(backward, -1, move))
+            k = k + forward - backward
+            end = k == line.count
+            start = k < 0
+            if line.closed:
+                k[end] = 0
+                k_lap[end] += 1
+                k[start] = line.count - 1
+                k_lap[start] -= 1
+            else:
+                index[cars[end]], t[cars[end]], lap[cars[end]] = line.count - 1, 1.0, k_lap[end]
+                index[cars[start]], t[cars[start]], lap[cars[start]] = 0, 0.0, k_lap[start]
+                stop |= end | start
+
+            walking = ~stop
+            cars, k, k_lap, move, x, y = cars[walking], k[walking], k_lap[walking], move[walking], x[walking], y[walking]
+            if not len(cars):
+                break
+        index[cars], lap[cars] = k, k_lap
+        lost[cars] = True
+        return index, lap, t, lost
+
+    def update(self, x, y):
+        """
+        projects the position of every car on the track, see TrackProgress.update
+        args:
+            x (np.ndarray): x coordinates of the cars in meters
+            y (np.ndarray): y coordinates of the cars in meters
+        returns:
+            np.ndarray: the progress of each car in meters
+        """
+        line = self.line
+        x = np.array(np.broadcast_to(np.asarray(x, dtype=float), (self.count,)))
+        y = np.array(np.broadcast_to(np.asarray(y, dtype=float), (self.count,)))
+        previous = self.distance
+        index, lap, t, lost = self._walk(self.index, self.lap, x, y)
+        gap_x = x - (line.ax[index] + t * line.dx[index])
+        gap_y = y - (line.ay[index] + t * line.dy[index])
+        gap = np.where(lost, np.inf, np.sqrt(gap_x * gap_x + gap_y * gap_y))
+
+        # lost, or far from the track: the walk starts again from the nearest vertex
+        self.recovered = np.zeros(self.count, dtype=bool)
+        far = np.flatnonzero(gap > self.recover_distance)
+        if len(far):
+            nearest, vertex = line.tree.query(np.column_stack((x[far], y[far])))
+            far, vertex = far[nearest < gap[far]], vertex[nearest < gap[far]]
+            vertex_lap = self._nearest_lap(line.distance[vertex], previous[far])
+            index_far, lap_far, t_far, lost_far = self._walk(vertex, vertex_lap, x[far], y[far])
+            index[far] = np.where(lost_far, vertex, index_far)
+            lap[far] = np.where(lost_far, vertex_lap, lap_far)
+            t[far] = np.where(lost_far, 0.0, t_far)
+            self.recovered[far] = True
+
+        self.index, self.lap = index, lap
+        self.distance = lap * line.length + line.distance[index] + t * line.segment_length[index]
+        self.offset = (line.dx[index] * (y - line.ay[index]) - line.dy[index] * (x - line.ax[index])) / line.segment_length[index]
+
+        # the progress follows the cars on the track, from where they were
+        follow = ~self.recovered & (np.abs(self.offset) <= self.tolerance) & (previous <= self.progress + self.tolerance)
+        self.progress = np.where(follow, np.maximum(self.progress, self.distance), self.progress)
+        return self.progress
+
+    def _nearest_lap(self, distance, previous):
+        # the lap of each car that puts the distance nearest to the previous one
+        if not self.line.closed:
+            return np.zeros(len(distance), dtype=int)
+        return np.floor((previous - distance) / self.line.length + 0.5).astype(int)
@@ -1,5 +1,5 @@
 from simulator import *
-import pandas as pd
+from car_modeling.gpc import GPC
 
 # screen settings => sizes FULL, MEDIUM, SMALL
 screen_size = MEDIUM
@@ -46,42 +46,6 @@ def make_step(alpha, len):
         step.append(alpha)
     return step
 
-def matriz_por_indices(caminho_csv, indices_colunas, limit=-1):
-    try:
-        df = pd.read_csv(caminho_csv, header=None)
-        if max(indices_colunas) >= len(df.columns):
-            raise IndexError("Um dos índices fornecidos excede o número de colunas no CSV.")
-        # stop on limit
-        return df.iloc[:, indices_colunas].values[:limit].tolist()
-    except Exception as e:
-        print(f"Erro ao processar o CSV: {e}")
-        return []
-
-def matrix_G_array(array_g, N_u, N):
-    # --- matriz de convolução ---
-    G = np.zeros((len(array_g), len(array_g)))
-    for i in range(len(array_g)):
-        for j in range(len(array_g)):
-            if j <= i:
-                G[i][j] = array_g[i-j][0]
-
-    # return just the N_u first columns and N rows
-    G = G[:N, :N_u]
-    return G
-
-def free_GPC(free_matrix, last_y):
-    if len(free_matrix[0]) != len(last_y):
-        print("coeffs diferentes dos y passados!")
-        return
-    
-    last_y = last_y[::-1]
-    future = []
-    for alpha in free_matrix:
-        y_k = sum([alpha[i] * last_y[i] for i in range(len(alpha))])
-        future.append(y_k)
-    
-    return future
-
 # --- insert your code here --- #
 
 alpha_l = math.exp(-z*5/accommodation_time_l)
@@ -98,53 +62,17 @@ N_horizon = future_points #int(math.log(0.01)/math.log(max(alpha_l, alpha_r)))
 N_ul = 5
 N_ur = 5
 
-# --- step response --- #
-
-g_l = matriz_por_indices("car_modeling/g.csv", [0])
-g_r = matriz_por_indices("car_modeling/g.csv", [1])
-
-G_lw = matrix_G_array(g_l, N_ul, N_horizon) * -wheels_radius/(2*wheels_distance)
-G_lv = matrix_G_array(g_l, N_ul, N_horizon) * wheels_radius/4
-G_rw = matrix_G_array(g_r, N_ur, N_horizon) * wheels_radius/(2*wheels_distance)
-G_rv = matrix_G_array(g_r, N_ur, N_horizon) * wheels_radius/4
+# --- matrices of the control --- #
 
-G = np.block([
-    [G_lw, G_rw], 
-    [G_lv, G_rv]
-])
+lamb_l = 1e-3
+lamb_r = 1e-3
+epsl_d = 1
+epsl_a = 5e-1
 
-# --- matrices of the control --- #
+d0 = 0.3
 
-lamb_l = 1e-3   /N_ul
-lamb_r = 1e-3   /N_ur
-epsl_d = 1      /N_horizon
-epsl_a = 5e-1   /N_horizon
-
-order = 3
-free_l = matriz_por_indices("car_modeling/coeffs.csv", [0, 1, 2], N_horizon)
-free_r = matriz_por_indices("car_modeling/coeffs.csv", [3, 4, 5], N_horizon)
-last_theta_l = [0, 0, 0]
-last_theta_r = [0, 0, 0]
-
-# --- matrizes do controle --- #
-
-R_l = np.eye(N_ul) * lamb_l
-R_r = np.eye(N_ur) * lamb_r
-R = np.block([
-    [R_l, np.zeros((N_ur, N_ul))],
-    [np.zeros((N_ul, N_ur)), R_r]
-])
-
-Q_v = np.eye(N_horizon) * epsl_d
-Q_w = np.eye(N_horizon) * epsl_a
-Q = np.block([
-    [Q_w, np.zeros((N_horizon, N_horizon))],
-    [np.zeros((N_horizon, N_horizon)), Q_v]
-])
-
-# solution of quadratic problem
-K = np.linalg.inv(G.T @ Q @ G + R) @ G.T @ Q
-K1 = K[0]
+# the gain matrix is solved once and cached on disk
+gpc = GPC(z, wheels_radius, wheels_distance, N_horizon, N_ul, N_ur, lamb_l, lamb_r, epsl_d, epsl_a, d0)
 
 # --- initial values of the control inputs --- #
 
@@ -154,8 +82,6 @@ v2 = 0
 delta_u_l = 0
 delta_u_r = 0
 
-d0 = 0.3
-
 while True:
     # saturate the inputs
     v1 += delta_u_l
@@ -172,44 +98,13 @@ while True:
     else:
         line, future_points, speed, omega, omega_wheels = data
 
-    # --- integrate the omega signal --- #
-
-    last_theta_l.append(last_theta_l[-1] + omega_wheels[0] * z)
-    last_theta_r.append(last_theta_r[-1] + omega_wheels[1] * z)
-
-    # --- convert to delta theta --- #
-
-    if len(last_theta_l) > 3:
-        for i in range(1, len(last_theta_l)):
-            last_theta_l[i] = last_theta_l[i] - last_theta_l[0]
-            last_theta_r[i] = last_theta_r[i] - last_theta_r[0]
-        last_theta_l.pop(0)
-        last_theta_r.pop(0)
-
     # --- calculate the free future response --- #
 
-    free_future_l = free_GPC(free_l, np.array(last_theta_l.copy()) - last_theta_l[2])
-    free_future_r = free_GPC(free_r, np.array(last_theta_r.copy()) - last_theta_r[2])
-
-    future_distance = []
-    future_theta = []
-
-    # --- calculate the current theta and distance --- #
-
-    for i in range(len(free_future_l)):
-        future_distance.append((free_future_l[i] + free_future_r[i]) * wheels_radius/2)
-        future_theta.append((free_future_l[i] - free_future_r[i]) * wheels_radius/wheels_distance)
-
-    future_theta = np.array(future_theta)
-    future_distance = np.array(future_distance)
+    future_theta, future_distance = gpc.free_response(omega_wheels)
 
     # --- reference using linearization --- #
 
-    x = [future_points[i][0] for i in range(len(future_points))]
-    y = [future_points[i][1] for i in range(len(future_points))]
-
-    angle = np.array(x)/d0
-    distance = np.array(y)
+    angle, distance = gpc.reference(future_points)
 
     # --- error of reference --- #
 
@@ -220,7 +115,7 @@ while True:
 
     # --- optimal control --- #
 
-    delta_u = K @ erro
+    delta_u = gpc.control(erro)
     delta_u_r = delta_u[0]
     delta_u_l = delta_u[N_ul]
 
@@ -0,0 +1,124 @@
+import time
+
+PACE_REAL_TIME = 'REAL_TIME'
+PACE_FACTOR = 'FACTOR'
+PACE_FAST = 'FAST'
+
+MIN_FACTOR = 0.25
+MAX_FACTOR = 20.0
+
+class Pacer:
+    """
+    keeps the simulated clock in step with the wall clock.
+    modes:
+        PACE_REAL_TIME: one simulated second takes one wall second
+        PACE_FACTOR: the simulated time runs factor times faster than the wall time
+        PACE_FAST: no waiting, the simulated time is decoupled from the wall time
+    the waits sleep until close to the deadline and spin only the last part,
+    so the deadlines are met with sub-millisecond accuracy without a busy core.
+    """
+    def __init__(self, period, mode=PACE_REAL_TIME, factor=1.0, spin=0.001, tolerance=0.001, window=1.0):
+        """
+        initializes the pacer
+        args:
+            period (float): simulated time of each step in seconds
+            mode (str): PACE_REAL_TIME, PACE_FACTOR or PACE_FAST
+            factor (float): real time factor of PACE_FACTOR, from 0.25 to 20
+            spin (float): wall time before the deadline that is spun instead of slept
+            tolerance (float): delay after the deadline counted as a deadline miss
+            window (float): wall time used to measure the real time factor
+        """
+        self.period = period
+        self.spin = spin
+        self.tolerance = tolerance
+        self.window = window
+        self.set_mode(mode, factor)
+
+    def set_mode(self, mode, factor=1.0):
+        # sets the mode and restarts the clocks
+        if mode not in (PACE_REAL_TIME, PACE_FACTOR, PACE_FAST):
+            raise ValueError("Invalid pacing mode")
+
+        self.mode = mode
+        self.factor = 1.0 if mode == PACE_REAL_TIME else max(MIN_FACTOR, min(MAX_FACTOR, factor))
+        self.reset()
+
+    def reset(self):
+        # restarts the simulated clock, the deadlines and the statistics
+        # the clocks start on the first step
+        self._start = None
+        self._deadline = None
+        self._window_start = None
+        self._window_steps = 0
+        self._real_time_factor = 0.0
+        self.steps = 0
+        self.misses = 0
+
+    def wait(self):
+        """
+        closes one step, waiting until its deadline in the real time modes
+        """
+        if self._start is None:
+            self._start = self._deadline = self._window_start = time.perf_counter()
+
+        self.steps += 1
+        self._window_steps += 1
+
+        if self.mode != PACE_FAST:
+            self._deadline += self.period / self.factor
+            now = time.perf_counter()
+            late = now - self._deadline
+
+            if late > self.tolerance:
+                self.misses += 1
+                # more than one step behind, drop the lost time instead of running to catch up
+                if late > self.period / self.factor:
+                    self._deadline = now
+            else:
+                # sleep the most of the wait and spin the rest
+                if -late > self.spin:
+                    time.sleep(-late - self.spin)
+                while time.perf_counter() < self._deadline:
+                    pass
+
+        # measure the real time factor of the last window
+        now = time.perf_counter()
+        if now - self._window_start >= self.window:
+            self._real_time_factor = self._window_steps * self.period / (now - self._window_start)
+            self._window_start = now
+            self._window_steps = 0
+
+    def get_simulated_time(self):
+        return self.steps * self.period
+
+    def get_real_time_factor(self):
+        # real time factor of the last complete window, or since the start
+        if self._real_time_factor > 0:
+            return self._real_time_factor
+        return self._total_real_time_factor()
+
+    def _total_real_time_factor(self):
+        elapsed = self.get_wall_time()
+        return self.get_simulated_time() / elapsed if elapsed > 0 else 0.0
+
+    def get_wall_time(self):
+        return 0.0 if self._start is None else time.perf_counter() - self._start
+
+    def get_misses(self):
+        return self.misses
+
+    def get_stats(self):
+        """
+        returns the mode, the simulated and wall times, the real time factors
+        (last window and total) and the deadline misses
+        """
+        return {
+            "mode": self.mode,
+            "target_factor": None if self.mode == PACE_FAST else self.factor,
+            "steps": self.steps,
+            "simulated_time": self.get_simulated_time(),
+            "wall_time": self.get_wall_time(),
+            "real_time_factor": self.get_real_time_factor(),
+            "total_real_time_factor": self._total_real_time_factor(),
+            "misses": self.misses,
+        }
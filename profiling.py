@@ -0,0 +1,132 @@
+import json
+import time
+import numpy as np
+from atomic_file import atomic_write
+
+class Profiler:
+    """
+    records the wall time of the stages of the simulation in rolling windows,
+    the statistics and histograms are computed from the last samples of each
+    stage only when they are asked. the simulator keeps no profiler when the
+    profiling is disabled, so a disabled profiling costs one test per stage.
+    usage:
+        clock = time.perf_counter()
+        ...
+        clock = profiler.lap("stage", clock)
+    """
+    def __init__(self, window=512, dump_file=None, dump_interval=5.0):
+        """
+        initializes the profiler
+        args:
+            window (int): number of samples kept for each stage
+            dump_file (str): json file where the statistics are written periodically, None disables it
+            dump_interval (float): wall time between two dumps in seconds
+        """
+        self.window = window
+        self.dump_file = dump_file
+        self.dump_interval = dump_interval
+        self.reset()
+
+    def reset(self):
+        # forgets all the samples
+        self._samples = {}
+        self._heads = {}
+        self._counts = {}
+        self.steps = 0
+        self._start = time.perf_counter()
+        self._last_dump = self._start
+
+    def record(self, stage, seconds):
+        # adds one sample of the stage
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = np.zeros(self.window)
+            self._heads[stage] = 0
+            self._counts[stage] = 0
+        samples[self._heads[stage]] = seconds
+        self._heads[stage] = (self._heads[stage] + 1) % self.window
+        self._counts[stage] += 1
+
+    def lap(self, stage, clock):
+        """
+        records the time since clock for the stage
+        returns:
+            float: the current clock, the start of the next stage
+        """
+        now = time.perf_counter()
+        self.record(stage, now - clock)
+        return now
+
+    def tick(self):
+        # closes one step, writes the dump when it is time
+        self.steps += 1
+        if self.dump_file is not None and time.perf_counter() - self._last_dump >= self.dump_interval:
+            self.dump()
+
+    def _window(self, stage):
+        # samples of the window, in no particular order
+        return self._samples[stage][:min(self._counts[stage], self.window)]
+
+    def get_stages(self):
+        return list(self._samples)
+
+    def get_stats(self):
+        """
+        returns the statistics of the window of each stage in milliseconds
+        (mean, median, 95th percentile, max and last) and the total count
+        """
+        stats = {}
+        for stage in self._samples:
+            samples = self._window(stage) * 1e3
+            p50, p95 = np.percentile(samples, (50, 95))
+            stats[stage] = {
+                "count": self._counts[stage],
+                "mean_ms": float(samples.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "max_ms": float(samples.max()),
+                "last_ms": float(self._samples[stage][self._heads[stage] - 1] * 1e3),
+            }
+        return stats
+
+    def get_histogram(self, stage, bins=24, low=1e-6, high=1.0):
+        """
+        histogram of the window of the stage on logarithmic bins
+        args:
+            bins (int): number of bins
+            low, high (float): limits of the bins in seconds, the samples outside go to the first and last bins
+        returns:
+            tuple: counts of each bin and the edges of the bins in seconds
+        """
+        edges = np.geomspace(low, high, bins + 1)
+        counts, _ = np.histogram(np.clip(self._window(stage), low, high), edges)
+        return counts, edges
+
+    def summary(self, count=8):
+        """
+        returns one line per stage (the slowest first) with the mean and the
+        95th percentile in milliseconds
+        """
+        stats = sorted(self.get_stats().items(), key=lambda item: -item[1]["mean_ms"])
+        return "\n".join(f"{stage}: {values['mean_ms']:.2f} / {values['p95_ms']:.2f} ms" for stage, values in stats[:count])
+
+    def dump(self, path=None):
+        """
+        writes the statistics and histograms of every stage to a json file
+        """
+        path = path or self.dump_file
+        data = {
+            "time": time.time(),
+            "wall_time": time.perf_counter() - self._start,
+            "steps": self.steps,
+            "stats": self.get_stats(),
+            "histograms": {},
+        }
+        for stage in self._samples:
+            counts, edges = self.get_histogram(stage)
+            data["histograms"][stage] = {"counts": counts.tolist(), "edges_s": edges.tolist()}
+
+        # replaced at once, a reader never sees half a file
+        with atomic_write(path, "w") as file:
+            json.dump(data, file, indent=1)
+        self._last_dump = time.perf_counter()
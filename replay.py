@@ -0,0 +1,201 @@
+import time
+import argparse
+import pygame
+from simulator import SimulatorController, PACE_FAST, MEDIUM, SMALL, FULL
+from telemetry import TelemetryReader
+
+MIN_SPEED = 0.1
+MAX_SPEED = 50.0
+
+class Replay:
+    """
+    re-renders a recorded run (see start_recording) through the drawables of
+    the simulator, the car is placed at the recorded poses and nothing is
+    stepped, neither the car dynamics nor the controller.
+    seeking reads one row of the telemetry, so any step is reached at once.
+    the playback follows the wall clock, the steps that cannot be rendered in
+    time are skipped (the graphs still get their samples).
+    keys:
+        space: pause, left/right: 1 second back/forward (10 with shift),
+        up/down: double/halve the speed, comma/period: one step back/forward,
+        home/end: first/last step, esc: quit
+    """
+    def __init__(self, path, screen_size=None, speed=1.0, hud_rate=15):
+        """
+        initializes the replay, opening the window of the simulator
+        args:
+            path (str): directory of the recording
+            screen_size (str): FULL, MEDIUM or SMALL, the one of the recording by default
+            speed (float): playback speed, from 0.1 to 50
+            hud_rate (int): refresh rate of the graphs and displays in Hz
+        """
+        self.telemetry = TelemetryReader(path)
+        if len(self.telemetry) == 0:
+            raise ValueError("The recording has no steps")
+
+        meta = self.telemetry.meta
+        track = self.telemetry.attachment("track")
+        self.sim = SimulatorController(screen_size or meta["screen_size"], meta["fps"], meta["length"], meta["width"], meta["scale"], meta["render"],
+                                       meta["track_type"], meta["track_length"], meta["sensor_spacing"], pacing=PACE_FAST,
+                                       track_seed=meta["track_seed"], hud_rate=hud_rate,
+                                       track=None if track is None else (track[:, 0], track[:, 1]))
+        self.sim.setup_car_drawing(meta["car_size"], meta["sensor_distance"], meta["sensor_count"])
+        self.sim.set_future_points(meta["future_points"], meta["future_space"])
+
+        # columns of the recording (memory maps)
+        self._time = self.telemetry["time"]
+        self._pose = self.telemetry["pose"]
+        self._progress = self.telemetry["progress"]
+        self._wheels = self.telemetry["wheels"]
+        self._v1 = self.telemetry["v1"]
+        self._v2 = self.telemetry["v2"]
+        self._perturbation = self.telemetry["perturbation"]
+        self._future_points = self.telemetry["future_points"]
+
+        self.period = 1/meta["fps"]
+        self.step = -1
+        self.skipped = 0
+        self.paused = False
+        self.set_speed(speed)
+        self.seek(0)
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    def set_speed(self, speed):
+        # sets the playback speed, the clock of the playback restarts
+        self.speed = max(MIN_SPEED, min(MAX_SPEED, speed))
+        self._restart_clock()
+
+    def _restart_clock(self):
+        self._clock = time.perf_counter()
+        self._origin = self.step
+
+    def seek(self, step):
+        """
+        places the simulator at the step, only the row of the step and the
+        samples shown by the graphs are read
+        """
+        step = max(0, min(len(self) - 1, int(step)))
+
+        # the graphs get the samples after the last step shown, or all their samples after a seek back
+        length = self.sim.display.get_length()
+        if step < self.step or self.step < 0:
+            self.sim.display.clear_graph_data()
+            first = max(0, step + 1 - length)
+        else:
+            first = max(self.step + 1, step + 1 - length)
+        self._extend_graphs(first, step + 1)
+
+        # place the car
+        x, y, angle = self._pose[step]
+        self.sim.track.set_coordinates(((x + self.sim.LENGTH//2) * self.sim.SCALE, (y + self.sim.WIDTH//2) * self.sim.SCALE))
+        self.sim.track.set_angle(angle)
+        self.sim.future_points.set_points(self.sim.car_draw.get_center() + self._future_points[step] * (self.sim.SCALE, -self.sim.SCALE))
+        self.sim.track.progress.next_point = int(self._progress[step])
+        self.sim.time_simulation = float(self._time[step])
+        self.step = step
+
+    def _extend_graphs(self, begin, end):
+        # the samples of the graphs of the simulator from the recorded steps
+        if begin >= end:
+            return
+        display = self.sim.display
+        wheels = self._wheels[begin:end]
+        perturbation = self._perturbation[begin:end]
+        display.extend_graph_data("wheels", "left", wheels[:, 0])
+        display.extend_graph_data("wheels", "right", wheels[:, 1])
+        display.extend_graph_data("car", "vm", (wheels[:, 0] + wheels[:, 1]) / 2)
+        display.extend_graph_data("car", "ω", (wheels[:, 0] - wheels[:, 1]) / 2)
+        display.extend_graph_data("control", "left", self._v1[begin:end])
+        display.extend_graph_data("control", "right", self._v2[begin:end])
+        display.extend_graph_data("perturbation", "left", perturbation[:, 0])
+        display.extend_graph_data("perturbation", "right", perturbation[:, 1])
+
+    def render(self):
+        # draws the current step
+        self.sim.update_coverage("{:.2f}%".format(self.sim.get_coverage()))
+        self.sim.update_points("{:.2f}".format(self.sim.get_score()))
+        self.sim.fps_display.set_text(f"replay {self.speed:g}x{' paused' if self.paused else ''} step: {self.step}/{len(self) - 1} skip: {self.skipped}")
+        self.sim._update_interface()
+
+    def _handle_events(self):
+        # returns False when the replay is closed
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+
+            if event.type == pygame.KEYDOWN:
+                seconds = 10 if event.mod & pygame.KMOD_SHIFT else 1
+                if event.key == pygame.K_ESCAPE:
+                    return False
+                elif event.key == pygame.K_SPACE:
+                    self.paused = not self.paused
+                elif event.key == pygame.K_RIGHT:
+                    self.seek(self.step + seconds / self.period)
+                elif event.key == pygame.K_LEFT:
+                    self.seek(self.step - seconds / self.period)
+                elif event.key == pygame.K_PERIOD:
+                    self.seek(self.step + 1)
+                elif event.key == pygame.K_COMMA:
+                    self.seek(self.step - 1)
+                elif event.key == pygame.K_HOME:
+                    self.seek(0)
+                elif event.key == pygame.K_END:
+                    self.seek(len(self) - 1)
+                elif event.key == pygame.K_UP:
+                    self.set_speed(self.speed * 2)
+                elif event.key == pygame.K_DOWN:
+                    self.set_speed(self.speed / 2)
+                self._restart_clock()
+                self.sim.hud.refresh()
+
+            self.sim.display.verify_checkbox(event)
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                self.sim.hud.refresh()
+
+        return True
+
+    def run(self):
+        """
+        plays the recording until the window is closed, pausing at the last step
+        """
+        self._restart_clock()
+        while self._handle_events():
+            if not self.paused:
+                # the step of the wall clock, the ones in between are skipped
+                target = self._origin + int((time.perf_counter() - self._clock) * self.speed / self.period)
+                if target >= len(self) - 1:
+                    target = len(self) - 1
+                    self.paused = True
+                if target > self.step:
+                    self.skipped += target - self.step - 1
+                    self.seek(target)
+            self.render()
+
+            # wait for the next step, or a while when paused
+            if self.paused:
+                time.sleep(1/30)
+                self._restart_clock()
+            else:
+                deadline = self._clock + (self.step + 1 - self._origin) * self.period / self.speed
+                time.sleep(max(0.0, deadline - time.perf_counter()))
+
+    def close(self):
+        pygame.quit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay of a recorded run")
+    parser.add_argument("path", help="directory of the recording")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, from 0.1 to 50")
+    parser.add_argument("--start", type=float, default=0.0, help="simulated second where the replay starts")
+    parser.add_argument("--screen", choices=[FULL, MEDIUM, SMALL], default=None)
+    args = parser.parse_args()
+
+    replay = Replay(args.path, args.screen, args.speed)
+    replay.seek(args.start / replay.period)
+    replay.sim.hud.refresh()
+    try:
+        replay.run()
+    finally:
+        replay.close()
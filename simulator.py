@@ -1,24 +1,56 @@
+import time
 import pygame
 import random
-import time
+from collections import namedtuple
 from graphics.graphics_elements import *
 from graphics.track_generator import *
+from graphics.track_field import *
+from graphics.track_progress import *
+from pacing import *
+from profiling import *
+from telemetry import *
 from car_modeling.car_dynamics import *
 import numpy as np
 
+# state of a simulation between two steps, see SimulatorController.snapshot
+Snapshot = namedtuple("Snapshot", ["win", "steps", "time_simulation", "car", "pose", "next_point", "track_progress", "perturbation", "interface"])
+
 class SimulatorController:
     def __init__(self, screen_size, fps, length, width, scale, render,
-                 track_type=0, track_length=0.02, sensor_spacing=0.001):
+                 track_type=0, track_length=0.02, sensor_spacing=0.001, headless=False, sensor=None,
+                 pacing=None, time_factor=1.0, track_seed=None, hud_rate=15, profiler=None, track=None, physics_rate=None, render_rate=None):
 
         self._init_config(screen_size, fps, length, width, scale, render,
-                          track_type, track_length, sensor_spacing)
+                          track_type, track_length, sensor_spacing, headless, sensor, physics_rate, render_rate)
+        self.track_seed = track_seed
+        self.track_points = track
+        self.hud_rate = hud_rate
+
+        # the headless mode runs as fast as possible unless asked otherwise
+        if pacing is None:
+            pacing = PACE_FAST if headless else PACE_REAL_TIME
+        self.pacer = Pacer(1/fps, pacing, time_factor)
 
         self._init_simulation_objects()
         self._setup_simulator()
+        self.set_profiler(profiler)
 
     def _init_config(self, screen_size, fps, length, width, scale, render,
-                     track_type, track_length, sensor_spacing):
+                     track_type, track_length, sensor_spacing, headless, sensor, physics_rate, render_rate):
         self.screen_size = screen_size
+        self.headless = headless
+
+        # the controller runs at fps, the physics and the rendering at their own rates
+        # (the physics at least as fast and the rendering at most as fast)
+        self.physics_rate = max(fps, physics_rate or fps)
+        self.render_rate = min(fps, render_rate or fps)
+        self.steps = 0
+
+        # the headless mode has no screen to read, neither has a step that is not
+        # rendered, the line comes from the field
+        if sensor is None or headless or self.render_rate < fps:
+            sensor = SENSOR_FIELD if headless or self.render_rate < fps else SENSOR_SCREEN
+        self.sensor = sensor
         self.FPS = fps
         self.LENGTH = length
         self.WIDTH = width
@@ -29,9 +61,12 @@ class SimulatorController:
         self.track_type = track_type
         self.track_length = track_length
         self.array_sensor_dist = sensor_spacing
+        self.sensor_distance = 0.1
+        self.sensor_count = 8
 
     def _init_simulation_objects(self):
-        self.simulator = Simulator(self.screen_size, self.FPS)
+        # the headless mode never opens a window, only the physics is stepped
+        self.simulator = None if self.headless else Simulator(self.screen_size, self.render_rate)
         self.car = None
         self.track = None
         self.display = None
@@ -39,12 +74,19 @@ class SimulatorController:
         self.fps_display = None
         self.coordinates_display = None
         self.compass = None
+        self.hud = None
+        self.profiler = None
+        self.profiler_display = None
+        self.recorder = None
+        self.perturbation = 0.0
         self.line_sensor = None
+        self.track_field = None
         self.future_points = None
         self.track_percentage = None
         self.points = None
         self.win = None
 
+        self._car_config = None
         self.future_points_count = 10
         self.future_space = 30
         self.future_omega = [0] * 10
@@ -58,23 +100,40 @@ class SimulatorController:
         self.error_omega = [0] * 10
         self.error_v = [0] * 10
 
-    def setup_car_dynamics(self,  wheels_radius=0.04, wheels_distance=0.1, wheels_RPM=3000, ke_l=1, ke_r=1, kq=1, accommodation_time_l=1.0, accommodation_time_r=1.0, sensor_distance=0.1, sensor_count=8):
-        z = 1/self.FPS
-        self.car = car_dynamics(z, wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, kq, accommodation_time_l, accommodation_time_r)
-        self.car_draw.set_size(self.car.get_size()*self.SCALE)
+    def setup_car_dynamics(self,  wheels_radius=0.04, wheels_distance=0.1, wheels_RPM=3000, ke_l=1, ke_r=1, kq=1, accommodation_time_l=1.0, accommodation_time_r=1.0, sensor_distance=0.1, sensor_count=8,
+                           integrator=POSE_EULER):
+        self._car_config = dict(wheels_radius=wheels_radius, wheels_distance=wheels_distance, wheels_RPM=wheels_RPM, ke_l=ke_l, ke_r=ke_r, kq=kq,
+                                accommodation_time_l=accommodation_time_l, accommodation_time_r=accommodation_time_r,
+                                sensor_distance=sensor_distance, sensor_count=sensor_count, integrator=integrator)
+        z = 1/self.physics_rate
+        self.car = car_dynamics(z, wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, kq, accommodation_time_l, accommodation_time_r, integrator)
+        self.setup_car_drawing(self.car.get_size(), sensor_distance, sensor_count)
+
+    def setup_car_drawing(self, car_size, sensor_distance=0.1, sensor_count=8):
+        """
+        sets the size of the car and the position and size of the line sensor,
+        without a model of the dynamics (the replay draws recorded poses)
+        """
+        self.car_draw.set_size(car_size*self.SCALE)
+        self.sensor_distance = sensor_distance
+        self.sensor_count = sensor_count
         self.line_sensor.set_coordinates((self.car_draw.get_center()[0], self.car_draw.get_center()[1] - sensor_distance * self.SCALE))
         self.line_sensor.set_size(sensor_count * self.SCALE * self.array_sensor_dist) # 0.05 meter beetween sensors
 
+        # center of each pixel under the sensor in the car frame (meters)
+        pixels = int(self.line_sensor.get_size())
+        self._sensor_x = (np.arange(pixels) + 0.5 - self.line_sensor.get_size()/2) / self.SCALE
+        self._sensor_y = np.full(pixels, self.sensor_distance)
+
     def set_future_points(self, count, space):
         self.future_points_count = count
         self.future_space = space
-        Cluster.set_master(self.car_draw.get_center(), self.car_draw.get_size())    # set the master point
-        Cluster.set_future_count(self.future_points_count, self.future_space)     # set the future points count
+        self.track_progress.set_tolerance(self.car_draw.get_size() / self.SCALE)    # the size of the car, in meters
 
     # divide the track in clusters for rendering 
     def configurate_cluster(self):
-        # create clusters of points in the track
-        cluster_matrix, position = generate_cluster(self.LENGTH, self.WIDTH, self.SCALE, self.x_track, self.y_track)
+        # create clusters of points in the track (the partition comes from the track cache)
+        cluster_matrix, position = generate_cluster(self.LENGTH, self.WIDTH, self.SCALE, self.x_track, self.y_track, self.track_partition)
 
         # create the cluster
         for i in range(len(cluster_matrix)):
@@ -87,12 +146,22 @@ class SimulatorController:
         # print the initialization message
         print("Initializing simulator...")
 
-        # generate trajectory
-        self.x_track, self.y_track = generate_track(self.track_type, noise_level=0.225, checkpoints=36, resolution=500, track_rad=30)
+        # generate trajectory and its clusters, or load them from the cache
+        # a given track (x, y) is used as it is, only its clusters are computed
+        if self.track_points is not None:
+            self.x_track, self.y_track = (np.ascontiguousarray(points, dtype=float) for points in self.track_points)
+            self.track_partition = partition_cluster(self.LENGTH, self.WIDTH, self.SCALE, self.x_track, self.y_track)
+        else:
+            self.x_track, self.y_track, self.track_partition = load_track(self.track_type, self.track_seed, noise_level=0.225, checkpoints=36, resolution=500, track_rad=30,
+                                                                          length=self.LENGTH, width=self.WIDTH, scale=self.SCALE)
         self.win = len(self.x_track-1)
 
-        # create car
-        self.car_draw = Car(self.simulator.get_center(), center=(1.36, 1.8))
+        # progress along the track line, the same with and without a window (the tolerance is the size of the car, see set_future_points)
+        self.track_progress = TrackProgress(self.x_track, self.y_track, tolerance=0)
+
+        # create car (the headless mode has no window, the car is the origin)
+        screen_center = (0, 0) if self.headless else self.simulator.get_center()
+        self.car_draw = Car(screen_center, center=(1.36, 1.8))
 
         # create the track
         self.track = Track((self.LENGTH, self.WIDTH), self.SCALE, self.RENDER)
@@ -103,19 +172,34 @@ class SimulatorController:
         # create future points
         self.future_points = FuturePoints(self.car_draw.get_center(), size=self.track_length*0.5*self.SCALE)
 
+        # set track properties
+        self.track.set_coordinates(self._start_coordinates())
+        self.track.set_center(self.car_draw.get_center())
+        self.track.set_pivot(self.car_draw.get_center())
+
+        # distance field of the line to read the sensor without a screen
+        if self.sensor == SENSOR_FIELD:
+            self.track_field = TrackField(self.x_track, self.y_track, self.track_length)
+
+        if not self.headless:
+            self._setup_interface()
+
+        # print the initialization message
+        print("Simulator initialized")
+
+        if not self.headless:
+            self.simulator.start()
+
+    def _setup_interface(self):
         # create minimap
         minimap_position = (0.9 * self.simulator.get_center()[0], 1.75 * self.simulator.get_center()[1])
         self.minimap = MiniMap(minimap_position, (200, 150))
         for k in range(0, len(self.x_track), self.SCALE // 10):
             self.minimap.add_point((2 * self.x_track[k] / self.LENGTH, 2 * self.y_track[k] / self.WIDTH))
 
-        # set track properties
-        self.track.set_coordinates(((self.x_track[0] + self.LENGTH//2) * self.SCALE, (self.y_track[0] + self.WIDTH//2) * self.SCALE))
-        self.track.set_center(self.car_draw.get_center())
-        self.track.set_pivot(self.car_draw.get_center())
-
         # create display
         self.display = Display(self.simulator.get_center(), self.simulator.get_window_size())
+        self.display.set_time(self.FPS, seconds=5)  # the graphs show the last 5 seconds
         self._setup_display_graphs()
 
         # create coordinates display
@@ -143,27 +227,113 @@ class SimulatorController:
         # create compass
         self.compass = Compass((1.85 * self.simulator.get_center()[0], 1.75 * self.simulator.get_center()[1]))
 
+        # the displays are redrawn at the rate of the hud, between the refreshes
+        # the cached layer is blitted unchanged (the data is collected every step)
+        self.hud = CachedLayer(self.simulator.get_window_size(), max(1, round(self.render_rate / self.hud_rate)))
+        self.hud.add(self.minimap, "minimap")
+        self.hud.add(self.fps_display, "fps")
+        self.hud.add(self.coordinates_display, "coordinates")
+        self.hud.add(self.compass, "compass")
+        self.hud.add(self.track_percentage, "coverage")
+        self.hud.add(self.points, "score")
+        self.hud.add(self.display, "display")
+
         # add objects to the simulator
         # the order of the objects is the layer order
-        self.simulator.add(self.track)
-        self.simulator.add(self.car_draw)
-        self.simulator.add(self.line_sensor)
-        self.simulator.add(self.minimap)
-        self.simulator.add(self.fps_display)
-        self.simulator.add(self.coordinates_display)
-        self.simulator.add(self.compass)
-        self.simulator.add(self.future_points)
-        self.simulator.add(self.track_percentage)
-        self.simulator.add(self.points)
-        self.simulator.add(self.display)
+        self.simulator.add(self.track, "track")
+        self.simulator.add(self.car_draw, "car")
+        self.simulator.add(self.line_sensor, "line_sensor")
+        self.simulator.add(self.future_points, "future_points")
+        self.simulator.add(self.hud, "hud")
 
         # configurate the cluster
         self.configurate_cluster()
 
-        # print the initialization message
-        print("Simulator initialized")
+    def _start_coordinates(self):
+        # position of the start of the track in track pixels
+        return ((self.x_track[0] + self.LENGTH//2) * self.SCALE, (self.y_track[0] + self.WIDTH//2) * self.SCALE)
 
-        self.simulator.start()
+    def reset(self):
+        """
+        puts the car at rest at the start of the track, the progress, the
+        simulated time, the perturbation and the pacing restart
+        """
+        if self._car_config is not None:
+            self.setup_car_dynamics(**self._car_config)
+        self.track.set_coordinates(self._start_coordinates())
+        self.track.set_angle(0)
+        self.track.progress.reset()
+        self.track_progress.reset()
+        self.steps = 0
+        self.time_simulation = 0
+        self.perturbation = 0.0
+        self.pacer.reset()
+
+        if not self.headless:
+            self.display.clear_graph_data()
+            self.hud.refresh()
+
+    def snapshot(self):
+        """
+        returns the state of the simulation (motors, pose, progress, simulated
+        time, perturbation and, with a window, the graphs and the drawn future
+        points that the screen sensor sees) as an immutable Snapshot, restore
+        puts it back bit for bit. the recording, the profiler and the pacing
+        are not part of the state.
+        """
+        interface = None
+        if not self.headless:
+            future_points = np.array(self.future_points.get_points(), dtype=float)
+            future_points.flags.writeable = False
+            interface = (self.display.get_graph_state(), future_points)
+        return Snapshot(self.win, self.steps, self.time_simulation, self.car.get_state(), (*self.track.get_center(), self.track.get_angle()),
+                        self.track.progress.next_point, self.track_progress.get_state(), self.perturbation, interface)
+
+    def restore(self, snapshot):
+        """
+        puts back the state of a snapshot of this simulation or of another one
+        on the same track
+        """
+        if snapshot.win != self.win:
+            raise ValueError("The snapshot is of another track")
+
+        self.car.set_state(snapshot.car)
+        x, y, angle = snapshot.pose
+        self.track.set_coordinates((x, y))
+        self.track.set_angle(angle)
+        self.track.progress.next_point = snapshot.next_point
+        self.track_progress.set_state(snapshot.track_progress)
+        self.steps = snapshot.steps
+        self.time_simulation = snapshot.time_simulation
+        self.perturbation = snapshot.perturbation
+
+        if not self.headless and snapshot.interface is not None:
+            graphs, future_points = snapshot.interface
+            self.display.set_graph_state(graphs)
+            self.future_points.set_points(future_points)
+            self.hud.refresh()
+
+    def set_profiler(self, profiler, overlay=True):
+        """
+        times the stages of the step and the drawables with the profiler, None
+        disables the profiling. the overlay shows the slowest stages under the
+        pacing display.
+        """
+        self.profiler = profiler
+        if self.headless:
+            return
+
+        self.simulator.set_profiler(profiler)
+        self.hud.set_profiler(profiler, "hud.")
+
+        if self.profiler_display is not None:
+            self.hud.remove(self.profiler_display)
+            self.profiler_display = None
+
+        if profiler is not None and overlay:
+            self.profiler_display = Statistics((1.99 * self.simulator.get_center()[0], 0.08 * self.simulator.get_center()[1]))
+            self.profiler_display.set_source(profiler.summary)
+            self.hud.add(self.profiler_display, "profiler")
 
     def get_rand_color(self):
         random.seed(None)
@@ -201,12 +371,12 @@ class SimulatorController:
         self.display.add_graph("error")
         self.display.add_line_to_graph("error", "d", color=self.get_rand_color())
         self.display.add_line_to_graph("error", "θ", color=self.get_rand_color())
-    def _update_graps(self):
+    def _update_graps(self, left, right):
         """
-        update the graphs with the given values.
+        update the graphs with the given values, the normalized wheels speed
         """
-        self.display.update_graph_data("wheels", "left", self.car.get_wheels_norm()[0])
-        self.display.update_graph_data("wheels", "right", self.car.get_wheels_norm()[1])
+        self.display.update_graph_data("wheels", "left", left)
+        self.display.update_graph_data("wheels", "right", right)
         self.display.update_graph_data("car", "vm", self.car.speed_norm())
         self.display.update_graph_data("car", "ω", self.car.omega_norm())
         self.display.update_graph_data("control", "left", self.car.v1)
@@ -222,11 +392,11 @@ class SimulatorController:
         self.display.set_graph_data("error", "d", self.error_v)
         self.display.set_graph_data("error", "θ", self.error_omega)
 
-    def update_FPS(self, fps):
+    def update_pacing(self, real_time_factor, misses):
         """
-        update the FPS display with the given value.
+        update the pacing display with the real time factor and the deadline misses.
         """
-        self.fps_display.set_text(f"fps: {fps}")
+        self.fps_display.set_text(f"rtf: {real_time_factor} miss: {misses}")
 
     def update_coverage(self, coverage):
         """
@@ -240,24 +410,75 @@ class SimulatorController:
         """
         self.points.set_text(f"score: {points}")
 
-    def step(self, v1, v2, q1=0, q2=0):
+    def get_coverage(self):
         """
-        perform one simulation step with given movement and rotation inputs.
+        returns the percentage of the track covered by the car.
         """
-        # step the car dynamics
-        self.car.step(v1, v2, q1, q2)
+        return self.track.progress.next_point/self.win * 100
 
-        # calculates the car values normalized
-        simulator._update_graps()
+    def get_score(self):
+        """
+        returns the score, the coverage divided by the simulated time.
+        """
+        if self.time_simulation == 0:
+            return 0.0
+        return 100*self.get_coverage()/self.time_simulation
+
+    def get_car_pose(self):
+        """
+        returns the car pose in meters (x, y, angle) in the track frame.
+        """
+        x = self.track.get_center()[0]/self.SCALE - self.LENGTH//2
+        y = self.track.get_center()[1]/self.SCALE - self.WIDTH//2
+        return x, y, self.track.get_angle()
 
-        # get the car values
-        dx, dy, angle = self.car.get_space()
+    def get_track_progress(self):
+        """
+        returns the progress along the track in meters (the distance reached
+        driving on the track), the completed laps and the lateral offset of
+        the car from the track line in meters (positive on the left).
+        """
+        return self.track_progress.progress, self.track_progress.lap, self.track_progress.offset
+
+    def _update_progress(self):
+        """
+        advance the next point to the points reached by the progress along the
+        track line, on every physics step whether it is drawn or not.
+        """
+        x, y, _ = self.get_car_pose()
+        self.track_progress.update(x, y)
+        self.track.progress.next_point = min(self.win, self.track_progress.get_points())
+
+    def _read_line_sensor_field(self):
+        """
+        read the line sensor from the distance field of the track, each pixel
+        under the sensor is sampled at the car pose.
+        """
+        x, y = to_track_frame(self._sensor_x, self._sensor_y, self.get_car_pose())
+        line_pb = 255 * (1 - self.track_field.coverage(x, y, 1/self.SCALE))
 
-        dx *= -self.SCALE
-        dy *= -self.SCALE
-        angle *= -1
-        self.track.step(dx, dy, angle)
+        block_len = int(self.array_sensor_dist * self.SCALE)
+        block_count = line_pb.shape[0] // block_len
+        final_line = line_pb[:block_count * block_len].reshape(block_count, block_len).mean(axis=1)
+        return final_line
 
+    def _read_line_sensor(self):
+        """
+        read the line sensor from the pixels under it on the rendered screen.
+        """
+        line = self.simulator.screen.subsurface((self.line_sensor.get_x() - self.line_sensor.get_size()/2, self.line_sensor.get_y() -1, self.line_sensor.get_size(), 1))
+        line_arr = pygame.surfarray.pixels3d(line)
+        line_pb = line_arr.mean(axis=2)  # calculate the mediam 
+        line_pb = np.array(line_pb[:, 0], dtype=np.uint8)  # remove dimension 
+        block_len = int(self.array_sensor_dist * self.SCALE)
+        block_count = line_pb.shape[0] // block_len
+        final_line = line_pb[:block_count * block_len].reshape(block_count, block_len).mean(axis=1)
+        return final_line
+
+    def _update_interface(self):
+        """
+        update the displays that follow the car and render the simulator.
+        """
         # update compass and coordinates
         self.compass.set_angle(-self.track.get_angle() - math.pi / 2)
         self.coordinates_display.set_text(
@@ -270,65 +491,401 @@ class SimulatorController:
              -2 * self.track.get_center()[1]/(self.SCALE * self.WIDTH) + 1)
         )
 
-        # render the simulator
+        # render the simulator, the profiler times each drawable
         self.simulator.draw()
 
+    def _physics_ticks(self):
+        # physics steps of the current controller step, spread evenly on the simulated clock
+        return (self.steps + 1) * self.physics_rate // self.FPS - self.steps * self.physics_rate // self.FPS
+
+    def _render_due(self):
+        # the current controller step is rendered, the renders are spread evenly on the simulated clock
+        return self.steps * self.render_rate // self.FPS != (self.steps - 1) * self.render_rate // self.FPS
+
+    def step(self, v1, v2, q1=0, q2=0):
+        """
+        perform one controller step with given movement and rotation inputs,
+        the inputs are held over the physics steps of the controller step.
+        in headless mode nothing is rendered, the progress is calculated from
+        the track in meters on every physics step in both modes.
+        returns:
+            tuple: line (np.ndarray), future points in the car frame (list of (x, y)),
+            speed, omega (float) and wheels speed (tuple of float), None when the track is complete
+        """
+        # the profiler times each stage, when it is enabled
+        profiler = self.profiler
+        if profiler:
+            clock = time.perf_counter()
+
+        render = not self.headless and self._render_due()
+        car = self.car
+        track = self.track
+        for _ in range(self._physics_ticks()):
+            # step the car dynamics and get the car values
+            dx, dy, angle, speed, omega, left, right = car.step_space(v1, v2, q1, q2)
+            if profiler:
+                clock = profiler.lap("car_dynamics", clock)
+
+            track.step(dx * -self.SCALE, dy * -self.SCALE, -angle)
+            if profiler:
+                clock = profiler.lap("track_step", clock)
+
+            self._update_progress()
+            if profiler:
+                clock = profiler.lap("progress", clock)
+
+        # calculates the car values normalized
+        if not self.headless:
+            self._update_graps(left, right)
+            if profiler:
+                clock = profiler.lap("graphs", clock)
+
+        if render:
+            self._update_interface()
+            if profiler:
+                clock = time.perf_counter()
+        self.steps += 1
+
         # verify if win the game
-        if Cluster._next_point == self.win:
+        if self.track.progress.next_point == self.win:
+            if self.recorder:
+                self.recorder.meta["win"] = True
             print("Congratulations!")
             print("You win the game, you score is {:.2f}".format(100*100/self.time_simulation))
             return None
 
-        # get the future points
-        future_point = Cluster.get_next_point()
-        self.future_points.set_points(future_point)
-        future_point = [((x - self.car_draw.get_center()[0])/self.SCALE, (-y + self.car_draw.get_center()[1])/self.SCALE) for x, y in future_point]
+        # get the future points in the car frame
+        future_point = get_future_points(self.x_track, self.y_track, self.get_car_pose(), self.track.progress.next_point,
+                                         self.future_points_count, self.future_space)
+        if not self.headless:
+            self.future_points.set_points(self.car_draw.get_center() + future_point * (self.SCALE, -self.SCALE))
+        if profiler:
+            clock = profiler.lap("future_points", clock)
+
+        # get the sensor value
+        if self.sensor == SENSOR_FIELD:
+            final_line = self._read_line_sensor_field()
+        else:
+            final_line = self._read_line_sensor()
+        if profiler:
+            clock = profiler.lap("sensor", clock)
+
+        line = 1 - final_line/255
+        if self.recorder:
+            self._record(v1, v2, q1, q2, line, future_point)
+            if profiler:
+                profiler.lap("telemetry", clock)
+
+        # the future points and the car values are python types, as they always were
+        return line, list(map(tuple, future_point.tolist())), float(speed), float(omega), (float(left), float(right))
+
+    def _record(self, v1, v2, q1, q2, line, future_point):
+        # one row of the telemetry, the time is the end of the step
+        if self.recorder.rows == 0:
+            self.recorder.meta.update(self._recording_meta())
+        self.recorder.record({
+            "time": self.time_simulation + 1/self.FPS,
+            "v1": v1,
+            "v2": v2,
+            "perturbation": (q1, q2),
+            "wheels": self.car.get_wheels_speed(),
+            "speed": self.car.speed(),
+            "omega": self.car.omega(),
+            "pose": self.get_car_pose(),
+            "progress": self.track.progress.next_point,
+            "line": line,
+            "future_points": future_point,
+        })
+
+    def set_recorder(self, recorder):
+        """
+        records the telemetry of every step with the recorder, None stops the
+        recording (the recorder is not closed)
+        """
+        self.recorder = recorder
+
+    def _recording_meta(self):
+        # setup of the simulation saved with the telemetry, read when the first row is recorded
+        return {
+            "fps": self.FPS,
+            "physics_rate": self.physics_rate,
+            "render_rate": self.render_rate,
+            "screen_size": self.screen_size,
+            "length": self.LENGTH,
+            "width": self.WIDTH,
+            "scale": self.SCALE,
+            "render": self.RENDER,
+            "track_type": self.track_type,
+            "track_seed": self.track_seed,
+            "track_length": self.track_length,
+            "sensor_spacing": self.array_sensor_dist,
+            "sensor_distance": self.sensor_distance,
+            "sensor_count": self.sensor_count,
+            "car_size": self.car.get_size(),
+            "integrator": self.car.integrator,
+            "future_points": self.future_points_count,
+            "future_space": self.future_space,
+            "win_points": self.win,
+        }
+    
+class Environment:
+    """
+    one simulation that owns all of its state (car, track, progress, time,
+    perturbation, pacing and recording), many environments run side by side
+    in one process, the headless ones also in threads. the module functions
+    (start_simulation, step_simulation, ...) drive one environment.
+    usage:
+        env = Environment(fps=80, seed=1112, track_type=LEMNISCATE, headless=True)
+        env.set_car_dynamics(...)
+        env.set_future_points(45, 3)
+        data = env.step(0, 0)
+        while data is not None:
+            data = env.step(*controller.update(data))
+        env.reset()
+    """
+    def __init__(self, screen_size=MEDIUM, fps=120, length=100, width=100, scale=300, render=4, seed=None, track_type=0, track_length=0.02,
+                 sensor_spacing=0.001, headless=False, sensor=None, pacing=None, time_factor=1.0, hud_rate=15, track=None,
+                 physics_rate=None, render_rate=None):
+        """
+        initializes the environment, the arguments are the ones of start_simulation
+        args:
+            seed (int): seed of the track, None generates a random track
+            track (tuple): arrays (x, y) of the track in meters, used instead of a generated track
+        """
+        self._config = dict(screen_size=screen_size, fps=fps, length=length, width=width, scale=scale, render=render,
+                            track_type=track_type, track_length=track_length, sensor_spacing=sensor_spacing, headless=headless,
+                            sensor=sensor, pacing=pacing, time_factor=time_factor, hud_rate=hud_rate,
+                            physics_rate=physics_rate, render_rate=render_rate)
+        self.seed = seed
+        self.sim = SimulatorController(**self._config, track_seed=seed, track=track)
+
+    def set_car_dynamics(self, wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count,
+                         integrator=POSE_EULER):
+        self.sim.setup_car_dynamics(wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, 1, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count,
+                                    integrator)
 
-        # return the sensor value
-        line = self.simulator.screen.subsurface((self.line_sensor.get_x() - self.line_sensor.get_size()/2, self.line_sensor.get_y() -1, self.line_sensor.get_size(), 1))
-        line_arr = pygame.surfarray.pixels3d(line)
-        line_pb = line_arr.mean(axis=2)  # calculate the mediam 
-        line_pb = np.array(line_pb[:, 0], dtype=np.uint8)  # remove dimension 
-        block_len = int(self.array_sensor_dist * self.SCALE)
-        block_count = line_pb.shape[0] // block_len
-        final_line = line_pb[:block_count * block_len].reshape(block_count, block_len).mean(axis=1)
+    def set_future_points(self, count, space):
+        self.sim.set_future_points(count, space)
 
-        return (1 - final_line/255), future_point, self.car.speed(), self.car.omega(), self.car.get_wheels_speed()
-    
-simulator = None #SimulatorController()
-timer = time.time()
-perturbation = 0.0
+    def reset(self, seed=None):
+        """
+        starts a new run from the start of the track, the recording is stopped
+        args:
+            seed (int): seed of a new track, None keeps the current track
+        """
+        self.stop_recording()
+        if seed is None or seed == self.seed:
+            self.sim.reset()
+            return
+
+        # a new track, the setup of the car, the pacing and the profiler are kept
+        old = self.sim
+        if not old.headless:
+            pygame.quit()
+        self.seed = seed
+        self.sim = SimulatorController(**self._config, track_seed=seed, profiler=old.profiler)
+        self.sim.pacer.set_mode(old.pacer.mode, old.pacer.factor)
+        if old._car_config is not None:
+            self.sim.setup_car_dynamics(**old._car_config)
+            self.sim.set_future_points(old.future_points_count, old.future_space)
+
+    def snapshot(self):
+        # the state of the simulation, see SimulatorController.snapshot
+        return self.sim.snapshot()
+
+    def get_track_progress(self):
+        # progress (m), laps and lateral offset (m), see SimulatorController.get_track_progress
+        return self.sim.get_track_progress()
+
+    def restore(self, snapshot):
+        self.sim.restore(snapshot)
+
+    def fork(self, count=1, snapshot=None):
+        """
+        returns new headless environments on the same track, with the same car,
+        each one continues from the snapshot (the current state by default)
+        independently, e.g. to try many controls from the same point
+        """
+        if self.sim.car is None:
+            raise RuntimeError("The car dynamics are not set")
+        snapshot = snapshot or self.snapshot()
+        config = {**self._config, "headless": True, "pacing": PACE_FAST}
+
+        # a random track is not generated again, its points are given
+        track = (self.sim.x_track, self.sim.y_track) if self.seed is None else None
+        forks = []
+        for _ in range(count):
+            env = Environment(**config, seed=self.seed, track=track)
+            env.sim.setup_car_dynamics(**self.sim._car_config)
+            env.sim.set_future_points(self.sim.future_points_count, self.sim.future_space)
+            env.restore(snapshot._replace(interface=None))
+            forks.append(env)
+        return forks
+
+    def step(self, v1, v2):
+        """
+        one step of the simulation with the inputs of the motors
+        returns:
+            tuple: line, future points, speed, omega and wheels speed, None when
+            the track is complete or the window is closed
+        """
+        sim = self.sim
+        if sim.car is None:
+            raise RuntimeError("The car dynamics are not set")
+
+        profiler = sim.profiler
+        if profiler:
+            clock = time.perf_counter()
+
+        # check for events, the headless mode has no window to listen
+        if not sim.headless and not self._handle_events():
+            self.stop_recording()
+            return None
+        if profiler:
+            profiler.lap("events", clock)
+
+        # render the simulator
+        data = sim.step(v1, v2, sim.perturbation, -sim.perturbation)
+
+        if data is None:
+            self.stop_recording()
+            if not sim.headless:
+                pygame.quit()
+            return None
+
+        # integrate the time simulation
+        sim.time_simulation += 1/sim.FPS
+
+        # wait for the deadline of the step
+        if profiler:
+            clock = time.perf_counter()
+        sim.pacer.wait()
+        if profiler:
+            profiler.lap("pacing", clock)
+            profiler.tick()
+
+        # the headless mode has no displays
+        if sim.headless:
+            return data
+
+        # calculate coverage percentage
+        sim.update_coverage("{:.2f}%".format(sim.get_coverage()))
+
+        # calculate the points of the track
+        sim.update_points("{:.2f}".format(sim.get_score()))
+
+        # update the real time factor and the deadline misses
+        sim.update_pacing("{:.2f}x".format(sim.pacer.get_real_time_factor()), sim.pacer.get_misses())
+
+        return data
+
+    def _handle_events(self):
+        sim = self.sim
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                print("Simulation stopped using X button")
+                return False
+
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    pygame.quit()
+                    print("Simulation stopped using ESC")
+                    return False
+                
+            # Detecta quando a tecla 'P' é pressionada
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_p:
+                    result = input("Enter perturbation value (default is 0.0): ")
+                    sim.perturbation = float(result)
+                    print(f"Perturbation set to {sim.perturbation}")
+
+            sim.display.verify_checkbox(event)
+
+            # show a clicked checkbox without waiting for the next refresh of the hud
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                sim.hud.refresh()
+
+        return True
+
+    def start_recording(self, path, chunk_rows=4096):
+        """
+        records the telemetry of every step into the directory, see TelemetryRecorder.
+        the recording is closed by stop_recording, reset or close.
+        """
+        self.stop_recording()
+        recorder = TelemetryRecorder(path, chunk_rows, dtypes={"line": np.float32, "future_points": np.float32})
+        recorder.attach("track", np.column_stack((self.sim.x_track, self.sim.y_track)))
+        self.sim.set_recorder(recorder)
+        return recorder
+
+    def stop_recording(self):
+        # closes the recording, the final time and coverage go to its meta
+        recorder = self.sim.recorder
+        if recorder is None:
+            return
+
+        self.sim.set_recorder(None)
+        recorder.close(time_simulation=self.sim.time_simulation, coverage=self.sim.get_coverage())
+
+    def close(self):
+        # closes the recording and the window
+        self.stop_recording()
+        if not self.sim.headless:
+            pygame.quit()
+
+# the environment of the module functions and its simulator
+environment = None
+simulator = None
+
+def start_simulation(screen_size=MEDIUM, fps=120, length=100, width=100, scale=300, render=4, seed=None, track_type=0, track_length=0.02, sensor_spacing=0.001, headless=False, sensor=None, pacing=None, time_factor=1.0, hud_rate=15,
+                     physics_rate=None, render_rate=None):
+    # fps is the rate of the controller (step_simulation), the physics and the rendering run
+    # at physics_rate and render_rate on the same simulated clock (fps by default)
 
-def start_simulation(screen_size=MEDIUM, fps=120, length=100, width=100, scale=300, render=4, seed=None, track_type=0, track_length=0.02, sensor_spacing=0.001):
     # define the seed
     if seed is not None:
         random.seed(seed)
         np.random.seed(seed)
 
     # check if the simulator is initialized
+    global environment
     global simulator
-    if simulator is not None:
+    if environment is not None:
         print("Simulator already initialized")
         return
     
-    simulator = SimulatorController(screen_size, fps, length, width, scale, render, track_type, track_length, sensor_spacing)
+    environment = Environment(screen_size, fps, length, width, scale, render, seed, track_type, track_length, sensor_spacing, headless, sensor, pacing, time_factor, hud_rate,
+                              physics_rate=physics_rate, render_rate=render_rate)
+    simulator = environment.sim
     return simulator
 
-def set_car_dynamics(wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count):
-    # check if the simulator is initialized
-    if simulator is None:
+def stop_simulation():
+    # close the simulator so a new one can be started in this process
+    global environment
+    global simulator
+    if environment is None:
+        return
+
+    environment.close()
+    environment = None
+    simulator = None
+
+def set_car_dynamics(wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count, integrator=POSE_EULER):
+    # check if the simulator is initialized, the integrator of the pose is one of POSE_INTEGRATORS
+    if environment is None:
         print("Simulator not initialized")
         return
 
-    simulator.setup_car_dynamics(wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, 1, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count)
+    environment.set_car_dynamics(wheels_radius, wheels_distance, wheels_RPM, ke_l, ke_r, accommodation_time_l, accommodation_time_r, sensor_distance, sensor_count, integrator)
 
 def set_future_points(count, space):
     # check if the simulator is initialized
-    if simulator is None:
+    if environment is None:
         print("Simulator not initialized")
         return
 
-    simulator.set_future_points(count, space)
+    environment.set_future_points(count, space)
 
 def set_graph_future_control(left, right):
     # check if the simulator is initialized
@@ -375,62 +932,93 @@ def set_graph_error(omega, v):
     simulator.error_omega = omega
     simulator.error_v = v
 
-def step_simulation(v1, v2):
-    global timer
-    global perturbation
+def set_profiling(enabled=True, dump_file=None, dump_interval=5.0, overlay=True, window=512):
+    """
+    enables the timing of the stages of each step and of each drawable, the
+    statistics are read with get_profile_stats, shown in an overlay and
+    written to dump_file every dump_interval seconds.
+    """
+    # check if the simulator is initialized
+    if simulator is None:
+        print("Simulator not initialized")
+        return
+
+    profiler = Profiler(window, dump_file, dump_interval) if enabled else None
+    simulator.set_profiler(profiler, overlay)
+    return profiler
 
+def start_recording(path, chunk_rows=4096):
+    """
+    records the telemetry of every step into the directory, see TelemetryRecorder.
+    the recording is closed by stop_recording or stop_simulation.
+    """
     # check if the simulator is initialized
-    if simulator is None or simulator.car is None:
+    if environment is None:
+        print("Simulator not initialized")
+        return
+
+    return environment.start_recording(path, chunk_rows)
+
+def stop_recording():
+    # closes the recording, the final time and coverage go to its meta
+    if environment is None:
+        return
+
+    environment.stop_recording()
+
+def get_track_progress():
+    # returns the progress along the track (m), the laps and the lateral offset (m)
+    if simulator is None:
         print("Simulator not initialized")
         return None
 
-    # check for events
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            print("Simulation stopped using X button")
-            return None
+    return simulator.get_track_progress()
 
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
-                pygame.quit()
-                print("Simulation stopped using ESC")
-                return None
-            
-        # Detecta quando a tecla 'P' é pressionada
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_p:
-                result = input("Enter perturbation value (default is 0.0): ")
-                perturbation = float(result)
-                print(f"Perturbation set to {perturbation}")
-
-        simulator.display.verify_checkbox(event)
-
-    # render the simulator
-    data = simulator.step(v1, v2, perturbation, -perturbation)
-
-    if data is None:
-        pygame.quit()
+def get_profile_stats():
+    # returns the statistics of each stage, None when the profiling is disabled
+    if simulator is None or simulator.profiler is None:
         return None
+    return simulator.profiler.get_stats()
 
-    # integrate the time simulation
-    simulator.time_simulation += 1/simulator.FPS
+def set_pacing(mode, time_factor=1.0):
+    # check if the simulator is initialized
+    if simulator is None:
+        print("Simulator not initialized")
+        return
 
-    # calculate coverage percentage
-    coverage = Cluster._next_point/simulator.win * 100
-    simulator.update_coverage("{:.2f}%".format(coverage))
+    simulator.pacer.set_mode(mode, time_factor)
 
-    # calculate the points of the track
-    simulator.update_points("{:.2f}".format(100*coverage/simulator.time_simulation))
+def snapshot_simulation():
+    # returns the state of the simulation, see SimulatorController.snapshot
+    if environment is None:
+        print("Simulator not initialized")
+        return None
+
+    return environment.snapshot()
 
-    # fix the fps
-    while (time.time() - timer) < 1/simulator.FPS:
-        pass
+def restore_simulation(snapshot):
+    # check if the simulator is initialized
+    if environment is None:
+        print("Simulator not initialized")
+        return
 
-    # update the fps count
-    simulator.update_FPS("{:.1f}".format(1/(time.time() - timer)))
+    environment.restore(snapshot)
 
-    # update the timer
-    timer = time.time()
+def reset_simulation(seed=None):
+    # starts a new run, on a new track when the seed changes (see Environment.reset)
+    global simulator
+    if environment is None:
+        print("Simulator not initialized")
+        return
+
+    environment.reset(seed)
+    simulator = environment.sim
+    return simulator
+
+def step_simulation(v1, v2):
+    # check if the simulator is initialized
+    if environment is None or environment.sim.car is None:
+        print("Simulator not initialized")
+        return None
 
-    return data
\ No newline at end of file
+    return environment.step(v1, v2)
@@ -0,0 +1,217 @@
+import io
+import os
+import json
+import time
+import signal
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import simulator
+from car_modeling.gpc import GPC
+
+# parameters of main.py, every run of the sweep overrides some of them
+DEFAULT_CONFIG = {
+    # simulation
+    "track_seed": 1112,
+    "track_type": simulator.LEMNISCATE,
+    "fps": 80,
+    "track_length": 0.02,
+    "max_time": 120.0,     # simulated seconds
+
+    # car constants
+    "wheels_radius": 0.04,
+    "wheels_distance": 0.15,
+    "wheels_RPM": 1000,
+    "sensor_distance": 0.15,
+    "sensor_count": 15,
+    "sensor_spacing": 0.008,
+    "ke_l": 1.00,
+    "ke_r": 1.00,
+    "accommodation_time_l": 0.62,
+    "accommodation_time_r": 0.58,
+
+    # future points
+    "future_points": 45,
+    "future_spacing": 3,
+
+    # controller
+    "N_ul": 5,
+    "N_ur": 5,
+    "lamb_l": 1e-3,
+    "lamb_r": 1e-3,
+    "epsl_d": 1,
+    "epsl_a": 5e-1,
+    "d0": 0.3,
+}
+
+STATUS_WIN = 'win'
+STATUS_TIME_LIMIT = 'time_limit'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'
+STATUS_CRASHED = 'crashed'
+
+class DefaultController:
+    """
+    the GPC controller of main.py, built from a sweep configuration
+    """
+    def __init__(self, config):
+        self.gpc = GPC(1/config["fps"], config["wheels_radius"], config["wheels_distance"], config["future_points"],
+                       config["N_ul"], config["N_ur"], config["lamb_l"], config["lamb_r"], config["epsl_d"], config["epsl_a"], config["d0"])
+        self.v1 = 0
+        self.v2 = 0
+
+    def update(self, data):
+        """
+        returns the next inputs (v1, v2) from the values of step_simulation
+        """
+        line, future_points, speed, omega, omega_wheels = data
+        delta_u_l, delta_u_r = self.gpc.step(future_points, omega_wheels)
+        self.v1 = max(min(self.v1 + delta_u_l, 100), -100)
+        self.v2 = max(min(self.v2 + delta_u_r, 100), -100)
+        return self.v1, self.v2
+
+def grid(**axes):
+    """
+    returns the configurations of the cartesian product of the values of each axis
+    example: grid(d0=[0.2, 0.3], lamb_l=[1e-3, 1e-2]) returns 4 configurations
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+class _Timeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise _Timeout()
+
+@contextlib.contextmanager
+def _time_limit(seconds):
+    # interrupts the run with an alarm, where the platform has one
+    if seconds is None or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _simulate(config, controller_factory):
+    # one headless run, the same setup of main.py
+    simulator.start_simulation(fps=config["fps"], seed=config["track_seed"], track_type=config["track_type"],
+                               track_length=config["track_length"], sensor_spacing=config["sensor_spacing"], headless=True)
+    simulator.set_car_dynamics(config["wheels_radius"], config["wheels_distance"], config["wheels_RPM"], config["ke_l"], config["ke_r"],
+                               config["accommodation_time_l"], config["accommodation_time_r"], config["sensor_distance"], config["sensor_count"])
+    simulator.set_future_points(config["future_points"], config["future_spacing"])
+    controller = controller_factory(config)
+
+    sim = simulator.simulator
+    v1, v2 = 0, 0
+    status = STATUS_TIME_LIMIT
+    while sim.time_simulation < config["max_time"]:
+        data = simulator.step_simulation(v1, v2)
+        if data is None:
+            status = STATUS_WIN
+            break
+        v1, v2 = controller.update(data)
+
+    # the step of the win is not integrated by step_simulation
+    coverage = 100.0 if status == STATUS_WIN else sim.get_coverage()
+    score = 100*coverage/sim.time_simulation if sim.time_simulation > 0 else 0.0
+    return {"status": status, "score": score, "coverage": coverage, "time": sim.time_simulation, "steps": sim.pacer.steps}
+
+def run_config(config, controller_factory=DefaultController, timeout=None, quiet=True):
+    """
+    runs one configuration in a headless simulator, never raises
+    args:
+        config (dict): values that override DEFAULT_CONFIG
+        controller_factory (callable): builds the controller from the full configuration,
+            the controller has update(data) -> (v1, v2)
+        timeout (float): wall time limit of the run in seconds
+        quiet (bool): hide the prints of the simulator
+    returns:
+        dict: the configuration, status, score, coverage, simulated time, steps and wall time
+    """
+    full_config = {**DEFAULT_CONFIG, **config}
+    result = {"config": config, "status": STATUS_ERROR, "score": 0.0, "coverage": 0.0, "time": 0.0, "steps": 0, "error": None}
+    begin = time.perf_counter()
+    output = io.StringIO() if quiet else None
+    try:
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            with _time_limit(timeout):
+                result.update(_simulate(full_config, controller_factory))
+    except _Timeout:
+        result["status"] = STATUS_TIMEOUT
+    except Exception as error:
+        result["error"] = repr(error)
+    finally:
+        if simulator.simulator is not None:
+            result["time"] = simulator.simulator.time_simulation
+            result["coverage"] = result["coverage"] or simulator.simulator.get_coverage()
+        simulator.stop_simulation()
+    result["wall_time"] = time.perf_counter() - begin
+    return result
+
+def run_sweep(configs, controller_factory=DefaultController, workers=None, timeout=None, retries=1):
+    """
+    runs the configurations in a pool of processes and yields each result as it finishes
+    args:
+        configs (list): configurations, see DEFAULT_CONFIG
+        controller_factory (callable): picklable factory of the controller, see run_config
+        workers (int): number of processes, default is one per core
+        timeout (float): wall time limit of each run in seconds
+        retries (int): times a run is submitted again after its worker crashed
+    """
+    workers = workers or os.cpu_count()
+
+    # a crashed worker breaks the pool, the runs not finished are submitted again
+    # with one process each, so a new crash takes down only its own run
+    pending = yield from _run_pool(configs, controller_factory, workers, timeout)
+    for attempt in range(retries):
+        crashed = []
+        for begin in range(0, len(pending), workers):
+            crashed += yield from _run_isolated(pending[begin:begin + workers], controller_factory, timeout)
+        pending = crashed
+
+    for config in pending:
+        yield {"config": config, "status": STATUS_CRASHED, "score": 0.0, "coverage": 0.0, "time": 0.0,
+               "steps": 0, "error": "worker crashed", "wall_time": 0.0}
+
+def _run_pool(configs, controller_factory, workers, timeout):
+    # runs the configurations in a shared pool, returns the ones lost in a crash
+    broken = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_config, config, controller_factory, timeout): config for config in configs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+    return broken
+
+def _run_isolated(configs, controller_factory, timeout):
+    # runs each configuration in its own process, returns the ones that crashed
+    crashed = []
+    executors = [ProcessPoolExecutor(max_workers=1) for _ in configs]
+    try:
+        futures = {executor.submit(run_config, config, controller_factory, timeout): config
+                   for executor, config in zip(executors, configs)}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                crashed.append(futures[future])
+    finally:
+        for executor in executors:
+            executor.shutdown()
+    return crashed
+
+if __name__ == "__main__":
+    # example: sweep the reference distance and the control weights
+    configs = grid(d0=[0.2, 0.3, 0.4], lamb_l=[1e-3, 1e-2], lamb_r=[1e-3, 1e-2], max_time=[30.0])
+    for result in run_sweep(configs, timeout=300):
+        print(json.dumps(result), flush=True)
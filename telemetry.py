@@ -0,0 +1,227 @@
+import os
+import json
+import queue
+import threading
+import numpy as np
+from atomic_file import atomic_write
+
+META_FILE = "meta.json"
+
+class TelemetryRecorder:
+    """
+    records one row per step into a directory of columnar binary files, one
+    raw file per column plus meta.json with the dtype and shape of each
+    column. the rows go to preallocated chunks in memory, a full chunk is
+    handed to a writer thread and replaced by a free one, so the step only
+    copies its values into the chunk. the columns are created on the first
+    row, with the shapes of its values.
+    the directory must be empty or hold a recording, the files of that
+    recording are replaced and the other files are left untouched.
+    """
+    def __init__(self, path, chunk_rows=4096, meta=None, dtypes=None, threaded=True):
+        """
+        initializes the recorder, the directory is created or emptied
+        args:
+            path (str): directory of the recording, created when it does not exist
+            chunk_rows (int): rows of each chunk written at once
+            meta (dict): values saved with the recording (json serializable)
+            dtypes (dict): dtype of some columns, float64 by default
+            threaded (bool): write the chunks in a thread instead of in the step
+        """
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.meta = dict(meta or {})
+        self.dtypes = dict(dtypes or {})
+        self.rows = 0
+        self.closed = False
+
+        os.makedirs(path, exist_ok=True)
+        self._remove_recording()
+
+        self._columns = None
+        self._attachments = []
+        self._files = {}
+        self._chunk = None
+        self._filled = 0
+        self._free = queue.Queue()
+        self._error = None
+
+        self._queue = queue.Queue() if threaded else None
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+
+    def _remove_recording(self):
+        # removes the files listed in the meta of a previous recording, any other file is kept
+        names = os.listdir(self.path)
+        if not names:
+            return
+        if META_FILE not in names:
+            raise FileExistsError(f"{self.path} is not empty and holds no recording")
+        with open(os.path.join(self.path, META_FILE)) as file:
+            data = json.load(file)
+        files = [f"{name}.bin" for name in data.get("columns", {})] + [f"{name}.npy" for name in data.get("attachments", [])]
+        for name in files + [META_FILE]:
+            if name in names:
+                os.remove(os.path.join(self.path, name))
+
+    def _create_columns(self, values):
+        # the shape and dtype of each column come from the first row
+        self._columns = {}
+        for name, value in values.items():
+            value = np.asarray(value)
+            dtype = np.dtype(self.dtypes.get(name, np.int64 if np.issubdtype(value.dtype, np.integer) else np.float64))
+            self._columns[name] = {"dtype": dtype.str, "shape": list(value.shape)}
+            self._files[name] = open(os.path.join(self.path, f"{name}.bin"), "wb")
+        self._chunk = self._new_chunk()
+        self._write_meta()
+
+    def _new_chunk(self):
+        # reuses a chunk already written, or allocates a new one
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return {name: np.empty((self.chunk_rows, *column["shape"]), dtype=column["dtype"])
+                    for name, column in self._columns.items()}
+
+    def attach(self, name, array):
+        """
+        saves an array that is not recorded per step (e.g. the track) with the recording
+        """
+        np.save(os.path.join(self.path, f"{name}.npy"), np.asarray(array))
+        if name not in self._attachments:
+            self._attachments.append(name)
+
+    def record(self, values):
+        """
+        adds one row
+        args:
+            values (dict): value of each column, the same columns on every row
+        """
+        if self._columns is None:
+            self._create_columns(values)
+
+        chunk = self._chunk
+        row = self._filled
+        for name, value in values.items():
+            chunk[name][row] = value
+        self._filled += 1
+        self.rows += 1
+
+        if self._filled == self.chunk_rows:
+            self._hand_over()
+
+    def _hand_over(self):
+        # sends the filled rows of the chunk to the writer and takes a free chunk
+        chunk, filled = self._chunk, self._filled
+        if self._queue is not None:
+            # the meta is copied, the step may change it while the writer saves it
+            self._queue.put((chunk, filled, self._meta_data()))
+            self._chunk = self._new_chunk()
+        else:
+            self._write(chunk, filled, self._meta_data())
+        self._filled = 0
+
+    def _write(self, chunk, filled, data):
+        # appends the rows of each column to its file, the meta tells how many rows are complete
+        for name, file in self._files.items():
+            file.write(chunk[name][:filled].tobytes())
+            file.flush()
+        self._write_meta(data)
+
+    def _writer(self):
+        # thread that writes the chunks in order and returns them to the free chunks
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            chunk, filled, data = item
+            try:
+                self._write(chunk, filled, data)
+            except Exception as error:
+                self._error = error
+            self._free.put(chunk)
+
+    def _meta_data(self):
+        # content of meta.json for the rows recorded so far, copied so the writer reads it safely
+        return {"rows": self.rows, "chunk_rows": self.chunk_rows, "columns": self._columns or {},
+                "attachments": list(self._attachments), "meta": dict(self.meta)}
+
+    def _write_meta(self, data=None):
+        # replaced at once, a reader never sees half a file
+        with atomic_write(os.path.join(self.path, META_FILE), "w") as file:
+            json.dump(self._meta_data() if data is None else data, file, indent=1)
+
+    def close(self, **meta):
+        """
+        writes the rows left and closes the files
+        args:
+            meta: values added to the meta of the recording (e.g. the final status)
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        if self._columns is not None and self._filled > 0:
+            self._hand_over()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+        # the writer is done, the final meta goes only to the last write
+        self.meta.update(meta)
+        for file in self._files.values():
+            file.close()
+        self._write_meta()
+
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TelemetryReader:
+    """
+    reads a recording without copying it, each column is a read only memory
+    map of its file with one row per step
+    usage:
+        telemetry = TelemetryReader(path)
+        telemetry["pose"][-1], telemetry.meta["fps"]
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as file:
+            data = json.load(file)
+        self.rows = data["rows"]
+        self.meta = data["meta"]
+        self.columns = data["columns"]
+        self._arrays = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        # memory maps the column on the first access
+        if name not in self._arrays:
+            column = self.columns[name]
+            shape = (self.rows, *column["shape"])
+            if self.rows == 0:
+                self._arrays[name] = np.empty(shape, dtype=column["dtype"])
+            else:
+                self._arrays[name] = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=column["dtype"], mode="r", shape=shape)
+        return self._arrays[name]
+
+    def attachment(self, name):
+        # array saved with TelemetryRecorder.attach, memory mapped, None when there is no such array
+        path = os.path.join(self.path, f"{name}.npy")
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    def row(self, index):
+        # values of every column at one step
+        return {name: self[name][index] for name in self.columns}